@@ -1,23 +1,197 @@
 # app.py
-from flask import Flask, jsonify, send_file
+from flask import Flask, Response, g, jsonify, request, send_file, stream_with_context
+import json
 import os
-from sqlalchemy import create_engine, text
+import time
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.exc import DBAPIError
+
+from activation_map import activation_map, encode_volume, foci_arrays, study_set_hash, volume_headers, volume_mimetype
+from cache import GenerationWatcher, RedisCache, ResponseCache, cache_key
+from compression import compress_response
+from metrics import Metrics, SlowQueryLog, instrument_engine
+from snapshot import SnapshotStore
+from queries import (
+    PARAM_TYPES, PREPARED_STATEMENTS, batch_query, both_query, counts_body, directed_pairs, group_by_pair,
+    index_batch, index_minus, minus_query, page_body, page_slice, pair_entries, parse_batch, parse_exact, parse_foci,
+    parse_k, parse_kernel, parse_map_format, parse_order, parse_page, parse_radius, parse_search, parse_threshold,
+    positional, ranked_query, search_body, search_query, similar_body, similar_query, split_sides, term_params,
+    wants_ndjson,
+)
+from set_query import (TERM_DF_SQL, atom_kinds, canonical, compile_sql, evaluate, parse_expression, size_params,
+                       sizes_from_rows)
+from similar_index import get_similar_index, refresh_similar_index, similar_index_status
+from spatial_index import coord_index_status, get_coord_index, refresh_coord_index
+from table_stats import TableStats, exact_counts
+from term_index import get_term_index, refresh_term_index, term_index_status
 
 _engine = None
+_cache = None
+_map_cache = None
+_generation = None
+_snapshots = None
+_metrics = None
+_slow_log = None
+_table_stats = None
 
-def get_engine():
-    global _engine
-    if _engine is not None:
-        return _engine
+def database_url():
     db_url = os.getenv("DB_URL") or os.getenv("DATABASE_URL")
     if not db_url:
         raise RuntimeError("Missing DB_URL (or DATABASE_URL) environment variable.")
     if db_url.startswith("postgres://"):
         db_url = "postgresql://" + db_url[len("postgres://"):]
-    _engine = create_engine(db_url, pool_pre_ping=True)
+    return db_url
+
+
+def get_engine():
+    global _engine
+    if _engine is not None:
+        return _engine
+    _engine = create_engine(
+        database_url(),
+        pool_pre_ping=env_flag("DB_POOL_PRE_PING", True),
+        pool_size=int(os.getenv("DB_POOL_SIZE", "5")),
+        max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "1800")),
+    )
+    statement_timeout = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))
+    prepare = env_flag("DB_PREPARE", True)
+
+    @event.listens_for(_engine, "connect")
+    def on_connect(dbapi_conn, record):
+        setup_connection(dbapi_conn, record, statement_timeout, prepare)
+
+    if get_metrics() is not None:
+        instrument_engine(_engine, get_metrics(), get_slow_log())
     return _engine
 
 
+def checkout():
+    """Pooled connection; the time spent waiting on the pool goes to ns_pool_checkout_seconds"""
+    started = time.perf_counter()
+    conn = get_engine().connect()
+    if _metrics is not None:
+        _metrics.pool_wait_seconds.observe(time.perf_counter() - started)
+    return conn
+
+
+def read_connection():
+    """Autocommit connection for single-statement reads (no BEGIN/COMMIT round trips)"""
+    return checkout().execution_options(isolation_level="AUTOCOMMIT")
+
+
+# -----------------------
+# Per-connection session setup
+# -----------------------
+def setup_connection(dbapi_conn, record, statement_timeout=0, prepare=True):
+    """Set search_path and statement_timeout, and PREPARE the hot queries, once per new pooled connection"""
+    prepared = {}
+    dbapi_conn.autocommit = True
+    try:
+        with dbapi_conn.cursor() as cur:
+            cur.execute("SET search_path TO ns, public")
+            if statement_timeout:
+                cur.execute(f"SET statement_timeout = {int(statement_timeout)}")
+            for name, sql in (PREPARED_STATEMENTS.items() if prepare else ()):
+                body, names = positional(sql)
+                types = ", ".join(PARAM_TYPES[n] for n in names)
+                try:
+                    cur.execute(f"PREPARE {name}({types}) AS {body}")
+                    prepared[name] = names
+                except Exception:
+                    # e.g. PostGIS or the tables not there yet; that query keeps the text() path
+                    pass
+    finally:
+        dbapi_conn.autocommit = False
+    record.info["prepared"] = prepared
+
+
+def run_prepared(conn, name, params):
+    """EXECUTE a statement prepared on this connection, or run its SQL ad hoc if it could not be prepared"""
+    names = conn.connection.info.get("prepared", {}).get(name)
+    if names is None:
+        return conn.execute(text(PREPARED_STATEMENTS[name]), params)
+    args = ", ".join(f"%({n})s" for n in names)
+    return conn.exec_driver_sql(f"EXECUTE {name}({args})", params)
+
+
+def env_flag(name, default=False):
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def get_cache():
+    global _cache
+    if _cache is not None:
+        return _cache
+    ttl = float(os.getenv("CACHE_TTL", "300"))
+    cache_url = os.getenv("CACHE_URL")
+    if cache_url:
+        _cache = RedisCache(cache_url, ttl=ttl)
+    else:
+        _cache = ResponseCache(max_bytes=int(os.getenv("CACHE_MAX_BYTES", str(64 * 1024 * 1024))), ttl=ttl)
+    return _cache
+
+
+def get_map_cache():
+    """In-process cache of encoded activation maps (bytes; never shared through CACHE_URL)"""
+    global _map_cache
+    if _map_cache is None:
+        _map_cache = ResponseCache(max_bytes=int(os.getenv("MAP_CACHE_MAX_BYTES", str(128 * 1024 * 1024))),
+                                   ttl=float(os.getenv("CACHE_TTL", "300")))
+    return _map_cache
+
+
+def get_metrics():
+    """Process-wide Metrics registry, or None with METRICS=0"""
+    global _metrics
+    if _metrics is None and env_flag("METRICS", True):
+        _metrics = Metrics()
+    return _metrics
+
+
+def get_slow_log():
+    """Ring buffer of statements slower than SLOW_QUERY_MS (0 disables), with their EXPLAIN ANALYZE plans"""
+    global _slow_log
+    if _slow_log is None:
+        _slow_log = SlowQueryLog(threshold_ms=float(os.getenv("SLOW_QUERY_MS", "500")),
+                                 size=int(os.getenv("SLOW_QUERY_LOG_SIZE", "50")),
+                                 explain=env_flag("SLOW_QUERY_EXPLAIN", True))
+    return _slow_log
+
+
+def get_table_stats():
+    """Row counts from the load manifest or pg_class.reltuples, cached for STATS_TTL seconds"""
+    global _table_stats
+    if _table_stats is None:
+        _table_stats = TableStats(get_engine, ttl=float(os.getenv("STATS_TTL", "60")))
+    return _table_stats
+
+
+def get_snapshots():
+    """SnapshotStore following SNAPSHOT_DIR (written by create_db.py --snapshot), or None if unset"""
+    global _snapshots
+    root = os.getenv("SNAPSHOT_DIR")
+    if _snapshots is None and root:
+        cell = float(os.getenv("SPATIAL_INDEX_CELL", "8"))
+        _snapshots = SnapshotStore(root, cell=cell, ttl=float(os.getenv("SNAPSHOT_CHECK_TTL", "5")))
+    return _snapshots
+
+
+def get_generation():
+    """Data generation source: the snapshot's when SNAPSHOT_DIR is set (no DB needed), else ns.load_info"""
+    global _generation
+    if _generation is None:
+        snapshots = get_snapshots()
+        if snapshots is not None:
+            _generation = snapshots
+        else:
+            _generation = GenerationWatcher(get_engine, ttl=float(os.getenv("CACHE_GENERATION_TTL", "5")))
+    return _generation
+
+
 def create_app():
     app = Flask(__name__)
 
@@ -38,47 +212,271 @@ def create_app():
     # -----------------------
     # Helper functions
     # -----------------------
-    def query_terms(term_a, term_b):
-        """Return studies that contain term_a but not term_b, ignoring prefix and case"""
-        eng = get_engine()
-        with eng.begin() as conn:
-            conn.execute(text("SET search_path TO ns, public;"))
-            sql = text("""
-                SELECT DISTINCT a.study_id
-                FROM annotations_terms a
-                WHERE a.term ILIKE '%' || :term_a
-                  AND a.study_id NOT IN (
-                      SELECT study_id
-                      FROM annotations_terms
-                      WHERE term ILIKE '%' || :term_b
-                  )
-            """)
-            rows = conn.execute(sql, {"term_a": term_a, "term_b": term_b}).all()
-            return [r[0] for r in rows]
-
-    def query_coords(coords_a, coords_b):
-        """Return studies that contain coords_a but not coords_b"""
-        x1, y1, z1 = map(float, coords_a.split("_"))
-        x2, y2, z2 = map(float, coords_b.split("_"))
-        eng = get_engine()
-        with eng.begin() as conn:
-            conn.execute(text("SET search_path TO ns, public;"))
-            sql = text("""
-                SELECT DISTINCT c1.study_id
-                FROM coordinates c1
-                WHERE ST_X(c1.geom) = :x1
-                  AND ST_Y(c1.geom) = :y1
-                  AND ST_Z(c1.geom) = :z1
-                  AND c1.study_id NOT IN (
-                      SELECT study_id FROM coordinates
-                      WHERE ST_X(geom) = :x2
-                        AND ST_Y(geom) = :y2
-                        AND ST_Z(geom) = :z2
-                  )
-            """)
-            rows = conn.execute(sql, {"x1": x1, "y1": y1, "z1": z1,
-                                      "x2": x2, "y2": y2, "z2": z2}).all()
-            return [r[0] for r in rows]
+    use_cache = env_flag("CACHE", True)
+    use_term_index = env_flag("TERM_INDEX")
+    use_coord_index = env_flag("SPATIAL_INDEX")
+    use_similar_index = env_flag("SIMILAR_INDEX")
+    coord_cell = float(os.getenv("SPATIAL_INDEX_CELL", "8"))
+
+    def resident_index(kind):
+        """The snapshot's or loaded in-memory index for `kind` if enabled, else None (use SQL)"""
+        snapshot = get_snapshots().get() if get_snapshots() is not None else None
+        if snapshot is not None:
+            return snapshot.terms if kind == "terms" else snapshot.coords
+        # Indexes loaded from ns reload once the generation moves (a create_db.py load)
+        if kind == "terms":
+            return get_term_index(get_engine, get_generation().current()) if use_term_index else None
+        return get_coord_index(get_engine, coord_cell, get_generation().current()) if use_coord_index else None
+
+    def minus_rows(kind, a, b, radius=0.0, after=None, limit=None, stream=False, threshold=0.0):
+        """Yield the study ids of A \\ B in study_id order, optionally only those after `after`, at most `limit`"""
+        index = resident_index(kind)
+        if index is not None:
+            yield from page_slice(index_minus(kind, index, a, b, radius, threshold), after, limit)
+            return
+        # Fallback: SQL path
+        name, params = minus_query(kind, a, b, radius, after, limit, threshold)
+        if stream:
+            # Server-side cursor; psycopg2 needs a transaction for it and cannot DECLARE over EXECUTE
+            with checkout() as conn, conn.begin():
+                rows = conn.execution_options(stream_results=True, yield_per=5000).execute(
+                    text(PREPARED_STATEMENTS[name]), params)
+                for (study_id,) in rows:
+                    yield study_id
+            return
+        with read_connection() as conn:
+            rows = run_prepared(conn, name, params).all()
+        for (study_id,) in rows:
+            yield study_id
+
+    def query_terms(term_a, term_b, after=None, limit=None, threshold=0.0):
+        """Return studies that contain term_a but not term_b, matched on the canonical term key"""
+        return list(minus_rows("terms", term_a, term_b, after=after, limit=limit, threshold=threshold))
+
+    def query_ranked(term_a, term_b, threshold=0.0, limit=None):
+        """A \\ B as [{"study_id", "weight"}] by descending weight for term_a, top `limit`"""
+        index = resident_index("terms")
+        if index is not None:
+            return index.ranked(term_a, term_b, threshold, limit)
+        with read_connection() as conn:
+            rows = run_prepared(conn, *ranked_query(term_a, term_b, threshold, limit)).all()
+        return [{"study_id": study_id, "weight": weight} for study_id, weight in rows]
+
+    def query_coords(coords_a, coords_b, radius=0.0, after=None, limit=None):
+        """Return studies with a focus within `radius` mm of coords_a but none within `radius` of coords_b"""
+        return list(minus_rows("locations", coords_a, coords_b, radius, after, limit))
+
+    def query_both(kind, a, b, radius=0.0, threshold=0.0):
+        """Return both directions; on the SQL path from a single statement scanning each side once"""
+        index = resident_index(kind)
+        if index is not None:
+            return {"A_minus_B": index_minus(kind, index, a, b, radius, threshold),
+                    "B_minus_A": index_minus(kind, index, b, a, radius, threshold)}
+        with read_connection() as conn:
+            return split_sides(run_prepared(conn, *both_query(kind, a, b, radius, threshold)).all())
+
+    def query_counts(term_a, term_b, threshold=0.0):
+        """|A|, |B|, |A ∩ B|: from the term index, else one term_cooccurrence lookup, else counted from annotations_terms"""
+        index = resident_index("terms")
+        if index is not None:
+            return counts_body(*index.counts(term_a, term_b, threshold), "index")
+        params = term_params(term_a, term_b, threshold)
+        with read_connection() as conn:
+            if not threshold:
+                try:
+                    keys_a, keys_b, n_a, n_b, n_ab = run_prepared(conn, "ns_terms_cooc_counts", params).one()
+                    if keys_a <= 1 and keys_b <= 1:
+                        return counts_body(n_a, n_b, n_ab, "cooccurrence")
+                except DBAPIError:
+                    pass  # term_vocab / term_cooccurrence not built (create_db.py --cooccurrence)
+            return counts_body(*run_prepared(conn, "ns_terms_counts", params).one(), "annotations")
+
+    def query_batch(kind, directed, radius=0.0, threshold=0.0):
+        """Yield the study list of each directed (a, b) pair, in order, from one SQL statement or in-memory pass"""
+        index = resident_index(kind)
+        if index is not None:
+            yield from index_batch(kind, index, directed, radius, threshold)
+            return
+        # Fallback: SQL path, streamed and grouped by pair number
+        sql, params = batch_query(kind, directed, radius, threshold)
+        with checkout() as conn, conn.begin():
+            rows = conn.execution_options(stream_results=True, yield_per=5000).execute(text(sql), params)
+            yield from group_by_pair(rows, len(directed))
+
+    def query_similar(study_id, k=10):
+        """k nearest studies: pgvector index, else (SIMILAR_INDEX=1 or no pgvector) the in-process index; None if unknown"""
+        if not use_similar_index:
+            try:
+                with read_connection() as conn:
+                    rows = run_prepared(conn, *similar_query(study_id, k)).all()
+                return similar_body(study_id, rows, "pgvector") if rows else None
+            except DBAPIError:
+                pass  # no pgvector (study_embeddings stored as real[]) or no embeddings yet
+        index = get_similar_index(get_engine, get_generation().current())
+        if index is None:
+            raise RuntimeError("Study embeddings unavailable; load them with create_db.py --embeddings DIM")
+        neighbours = index.similar(study_id, k)
+        return similar_body(study_id, neighbours, "index") if neighbours is not None else None
+
+    def cached(kind, fn, *args):
+        """Call fn(*args) through the response cache, keyed on the data generation"""
+        if not use_cache:
+            return fn(*args)
+        cache = get_cache()
+        key = cache_key(kind, get_generation().current(), *args)
+        found, value = cache.get(key)
+        if found:
+            return value
+        value = fn(*args)
+        cache.set(key, value)
+        return value
+
+    def study_foci(studies):
+        """(study codes, xyz) of every focus of the studies, from the spatial index or ns.coordinates"""
+        index = resident_index("locations")
+        if index is not None:
+            return index.foci(studies)
+        with read_connection() as conn:
+            return foci_arrays(run_prepared(conn, "ns_study_foci", {"ids": list(studies)}).all())
+
+    def study_map(studies, kernel, size, fmt):
+        """Encoded activation map of a study set, cached on the data generation and the study-set hash"""
+        if not use_cache:
+            return encode_volume(activation_map(*study_foci(studies), kernel, size), fmt)
+        cache = get_map_cache()
+        key = cache_key("map", get_generation().current(), study_set_hash(studies), kernel, size, fmt)
+        found, body = cache.get(key)
+        if not found:
+            body = encode_volume(activation_map(*study_foci(studies), kernel, size), fmt)
+            cache.set(key, body)
+        return body
+
+    def map_response(kind, a, b, radius=0.0, threshold=0.0):
+        """Activation map of A \\ B as gzipped NIfTI or raw float32 (?format=), kernel from ?kernel=&size="""
+        kernel, size = parse_kernel(request.args)
+        fmt = parse_map_format(request.args)
+        if kind == "terms":
+            studies = cached("terms", query_terms, a, b, None, None, threshold)
+        else:
+            parse_foci(a), parse_foci(b)
+            studies = cached("locations", query_coords, a, b, radius, None, None)
+        body = study_map(studies, kernel, size, fmt)
+        return Response(body, mimetype=volume_mimetype(fmt), headers=volume_headers(fmt, len(studies)))
+
+    page_max = int(os.getenv("PAGE_MAX_LIMIT", "10000"))
+
+    def query_search(q, after=None, limit=20, highlight=False, within=None, radius=0.0, threshold=0.0):
+        """One page of full-text hits, optionally restricted to the studies of a dissociation"""
+        ids = None
+        if within is not None:
+            kind, a, b = within
+            if kind == "terms":
+                ids = cached("terms", query_terms, a, b, None, None, threshold)
+            else:
+                ids = cached("locations", query_coords, a, b, radius, None, None)
+            if not ids:
+                return {"results": [], "next": None}
+        with read_connection() as conn:
+            rows = run_prepared(conn, *search_query(q, ids, after, limit, highlight)).all()
+        return search_body(rows, limit, highlight)
+
+    def query_expression(node, threshold=0.0, after=None, limit=None):
+        """Study ids of a /query expression: from the resident indexes when they cover its operands, else one SQL statement"""
+        kinds = atom_kinds(node)
+        terms = resident_index("terms") if "term" in kinds else None
+        coords = resident_index("locations") if "loc" in kinds else None
+        if ("term" not in kinds or terms is not None) and ("loc" not in kinds or coords is not None):
+            return page_slice(evaluate(node, terms, coords, threshold), after, limit)
+        with read_connection() as conn:
+            sizes, df_params = {}, size_params(node)
+            if df_params is not None:
+                try:
+                    sizes = sizes_from_rows(conn.execute(text(TERM_DF_SQL), df_params).all())
+                except DBAPIError:
+                    pass  # term_vocab not built (create_db.py --cooccurrence); AND order falls back to shape
+            sql, params = compile_sql(node, threshold, sizes)
+            params.update(after=after, limit=limit)
+            return [r[0] for r in conn.execute(text(sql), params)]
+
+    def studies_response(kind, a, b, radius=0.0, threshold=0.0, order="study_id"):
+        """A \\ B as a JSON list, as a {"studies", "next"} page (?limit=&after=), or as an NDJSON stream"""
+        after, limit = parse_page(request.args, page_max)
+        if kind == "locations":
+            parse_foci(a), parse_foci(b)
+        if order == "weight":
+            # Top-k by weight: [{"study_id", "weight"}], no keyset cursor
+            if after is not None:
+                raise ValueError("after is not supported with order=weight; use limit for the top k")
+            ranked = cached("terms_ranked", query_ranked, a, b, threshold, limit)
+            if wants_ndjson(request.args, request.headers):
+                return Response("".join(json.dumps(r) + "\n" for r in ranked), mimetype="application/x-ndjson")
+            return jsonify(ranked), 200
+        if wants_ndjson(request.args, request.headers):
+            def generate():
+                lines = []
+                try:
+                    for study_id in minus_rows(kind, a, b, radius, after, limit, stream=True, threshold=threshold):
+                        lines.append(json.dumps(study_id) + "\n")
+                        if len(lines) >= 1000:
+                            yield "".join(lines)
+                            lines = []
+                    yield "".join(lines)
+                except Exception as e:
+                    # Headers are already sent; report the failure as the last line
+                    yield "".join(lines) + json.dumps({"error": str(e)}) + "\n"
+            return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+        if kind == "terms":
+            studies = cached("terms", query_terms, a, b, after, limit, threshold)
+        else:
+            studies = cached("locations", query_coords, a, b, radius, after, limit)
+        return jsonify(page_body(studies, after, limit)), 200
+
+    # -----------------------
+    # Conditional requests (ETag) and compression
+    # -----------------------
+    use_etag = env_flag("ETAG", True)
+    use_compression = env_flag("COMPRESS", True)
+    compress_min_bytes = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+    etag_endpoints = {"terms_dissociate", "terms_dissociate_both", "terms_dissociate_counts", "terms_dissociate_map",
+                      "locations_dissociate", "locations_dissociate_both", "locations_dissociate_map", "search",
+                      "studies_similar", "boolean_query"}
+
+    metrics = get_metrics()
+
+    @app.before_request
+    def start_timer():
+        g.started = time.perf_counter()
+
+    @app.before_request
+    def check_etag():
+        """Answer 304 from the data generation alone when the client already holds this response"""
+        if not use_etag or request.method != "GET" or request.endpoint not in etag_endpoints:
+            return None
+        generation = get_generation().current()
+        if generation is None:
+            return None
+        g.etag = cache_key(generation, request.path, sorted(request.args.items(multi=True)),
+                           wants_ndjson(request.args, request.headers))
+        if request.if_none_match.contains_weak(g.etag):
+            response = Response(status=304)
+            response.set_etag(g.etag, weak=True)
+            return response
+        return None
+
+    @app.after_request
+    def finish_response(response):
+        etag = g.pop("etag", None)
+        if etag is not None and response.status_code == 200:
+            response.set_etag(etag, weak=True)
+            response.headers["Cache-Control"] = "no-cache"
+        if use_compression:
+            compress_response(response, request.accept_encodings, compress_min_bytes)
+        if metrics is not None and "started" in g:
+            # On close, so streamed bodies are timed to their last byte
+            endpoint, method, status, started = request.endpoint, request.method, response.status_code, g.started
+            response.call_on_close(
+                lambda: metrics.observe_request(endpoint, method, status, time.perf_counter() - started))
+        return response
 
     # -----------------------
     # Dissociate by terms
@@ -86,19 +484,54 @@ def create_app():
     @app.get("/dissociate/terms/<term_a>/<term_b>", endpoint="terms_dissociate")
     def dissociate_terms(term_a, term_b):
         try:
-            studies = query_terms(term_a, term_b)
-            return jsonify(studies), 200
+            return studies_response("terms", term_a, term_b, threshold=parse_threshold(request.args),
+                                    order=parse_order(request.args))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         except Exception as e:
             return jsonify({"error": str(e)}), 500
 
     @app.get("/dissociate/terms/<term1>/<term2>/both", endpoint="terms_dissociate_both")
     def dissociate_terms_both(term1, term2):
         try:
-            result = {
-                "A_minus_B": query_terms(term1, term2),
-                "B_minus_A": query_terms(term2, term1)
-            }
+            result = cached("terms_both", query_both, "terms", term1, term2, 0.0, parse_threshold(request.args))
+            return jsonify(result), 200
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+
+    @app.get("/dissociate/terms/<term1>/<term2>/counts", endpoint="terms_dissociate_counts")
+    def dissociate_terms_counts(term1, term2):
+        try:
+            result = cached("terms_counts", query_counts, term1, term2, parse_threshold(request.args))
             return jsonify(result), 200
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+
+    @app.get("/dissociate/terms/<term1>/<term2>/map", endpoint="terms_dissociate_map")
+    def dissociate_terms_map(term1, term2):
+        try:
+            return map_response("terms", term1, term2, threshold=parse_threshold(request.args))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+
+    # -----------------------
+    # In-memory term index (TERM_INDEX=1)
+    # -----------------------
+    @app.get("/term_index", endpoint="term_index_status")
+    def term_index_info():
+        return jsonify({"enabled": use_term_index, **term_index_status()}), 200
+
+    @app.post("/term_index/refresh", endpoint="term_index_refresh")
+    def term_index_refresh():
+        try:
+            refresh_term_index(get_engine, get_generation().current())
+            return jsonify({"enabled": use_term_index, **term_index_status()}), 200
         except Exception as e:
             return jsonify({"error": str(e)}), 500
 
@@ -108,37 +541,239 @@ def create_app():
     @app.get("/dissociate/locations/<coords_a>/<coords_b>", endpoint="locations_dissociate")
     def dissociate_locations(coords_a, coords_b):
         try:
-            studies = query_coords(coords_a, coords_b)
-            return jsonify(studies), 200
+            return studies_response("locations", coords_a, coords_b, parse_radius(request.args))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         except Exception as e:
             return jsonify({"error": str(e)}), 500
 
     @app.get("/dissociate/locations/<coords1>/<coords2>/both", endpoint="locations_dissociate_both")
     def dissociate_locations_both(coords1, coords2):
         try:
-            result = {
-                "A_minus_B": query_coords(coords1, coords2),
-                "B_minus_A": query_coords(coords2, coords1)
-            }
+            result = cached("locations_both", query_both, "locations", coords1, coords2, parse_radius(request.args))
+            return jsonify(result), 200
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+
+    @app.get("/dissociate/locations/<coords1>/<coords2>/map", endpoint="locations_dissociate_map")
+    def dissociate_locations_map(coords1, coords2):
+        try:
+            return map_response("locations", coords1, coords2, parse_radius(request.args))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+
+    # -----------------------
+    # Similar studies (study_embeddings)
+    # -----------------------
+    @app.get("/studies/<study_id>/similar", endpoint="studies_similar")
+    def studies_similar(study_id):
+        try:
+            result = cached("similar", query_similar, study_id, parse_k(request.args))
+            if result is None:
+                return jsonify({"error": f"No embedding for study {study_id!r}"}), 404
+            return jsonify(result), 200
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+
+    @app.get("/similar_index", endpoint="similar_index_status")
+    def similar_index_info():
+        return jsonify({"enabled": use_similar_index, **similar_index_status()}), 200
+
+    @app.post("/similar_index/refresh", endpoint="similar_index_refresh")
+    def similar_index_refresh():
+        try:
+            refresh_similar_index(get_engine, get_generation().current())
+            return jsonify({"enabled": use_similar_index, **similar_index_status()}), 200
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+
+    # -----------------------
+    # Full-text search over metadata
+    # -----------------------
+    @app.get("/search", endpoint="search")
+    def search():
+        try:
+            q, after, limit, highlight, within = parse_search(request.args, page_max)
+            radius, threshold = parse_radius(request.args), parse_threshold(request.args)
+            result = cached("search", query_search, q, after, limit, highlight, within, radius, threshold)
+            return jsonify(result), 200
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+
+    # -----------------------
+    # Boolean set algebra over terms and locations
+    # -----------------------
+    query_max_atoms = int(os.getenv("QUERY_MAX_OPERANDS", "32"))
+
+    @app.get("/query", endpoint="boolean_query")
+    def boolean_query():
+        try:
+            node = parse_expression(request.args.get("q"), parse_radius(request.args), query_max_atoms)
+            threshold = parse_threshold(request.args)
+            after, limit = parse_page(request.args, page_max)
+            studies = cached("query", query_expression, node, threshold, after, limit)
+            response = jsonify(page_body(studies, after, limit))
+            response.headers["X-Query"] = canonical(node)
+            return response, 200
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+
+    # -----------------------
+    # Batch dissociation
+    # -----------------------
+    batch_max_pairs = int(os.getenv("BATCH_MAX_PAIRS", "1000"))
+
+    def batch_results(pairs, both, radius, threshold=0.0):
+        """Yield (kind, "a/b", {"A_minus_B": [...][, "B_minus_A": [...]]}) in request order"""
+        for kind, items in pairs.items():
+            if not items:
+                continue
+            results = query_batch(kind, directed_pairs(items, both), radius, threshold)
+            for pair, entry in pair_entries(items, both, results):
+                yield kind, pair, entry
+            results.close()
+
+    @app.post("/dissociate/batch", endpoint="dissociate_batch")
+    def dissociate_batch():
+        try:
+            pairs, both, radius, threshold = parse_batch(request.get_json(silent=True), batch_max_pairs)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        if wants_ndjson(request.args, request.headers):
+            def generate():
+                try:
+                    for kind, pair, entry in batch_results(pairs, both, radius, threshold):
+                        yield json.dumps({"kind": kind, "pair": pair, **entry}) + "\n"
+                except Exception as e:
+                    # Headers are already sent; report the failure as the last line
+                    yield json.dumps({"error": str(e)}) + "\n"
+            return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+        try:
+            result = {"terms": {}, "locations": {}}
+            for kind, pair, entry in batch_results(pairs, both, radius, threshold):
+                result[kind][pair] = entry if both else entry["A_minus_B"]
             return jsonify(result), 200
         except Exception as e:
             return jsonify({"error": str(e)}), 500
 
+    # -----------------------
+    # In-memory spatial index (SPATIAL_INDEX=1)
+    # -----------------------
+    @app.get("/spatial_index", endpoint="spatial_index_status")
+    def spatial_index_info():
+        return jsonify({"enabled": use_coord_index, **coord_index_status()}), 200
+
+    @app.post("/spatial_index/refresh", endpoint="spatial_index_refresh")
+    def spatial_index_refresh():
+        try:
+            refresh_coord_index(get_engine, coord_cell, get_generation().current())
+            return jsonify({"enabled": use_coord_index, **coord_index_status()}), 200
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+
+    # -----------------------
+    # Memory-mapped snapshot (SNAPSHOT_DIR)
+    # -----------------------
+    @app.get("/snapshot", endpoint="snapshot_status")
+    def snapshot_info():
+        snapshots = get_snapshots()
+        if snapshots is None:
+            return jsonify({"enabled": False}), 200
+        return jsonify({"enabled": True, **snapshots.status()}), 200
+
+    # -----------------------
+    # Response cache
+    # -----------------------
+    @app.get("/cache", endpoint="cache_stats")
+    def cache_stats():
+        if not use_cache:
+            return jsonify({"enabled": False}), 200
+        return jsonify({"enabled": True, "generation": get_generation().current(), **get_cache().stats(),
+                        "maps": get_map_cache().stats()}), 200
+
+    @app.post("/cache/clear", endpoint="cache_clear")
+    def cache_clear():
+        if use_cache:
+            get_cache().clear()
+            get_map_cache().clear()
+        return jsonify({"ok": True}), 200
+
+    # -----------------------
+    # Metrics (Prometheus) and slow statements
+    # -----------------------
+    @app.get("/metrics", endpoint="metrics")
+    def metrics_text():
+        if metrics is None:
+            return Response("metrics disabled (METRICS=0)\n", status=404, mimetype="text/plain")
+        caches = {"response": get_cache().stats(), "maps": get_map_cache().stats()} if use_cache else None
+        return Response(metrics.render(caches), mimetype="text/plain; version=0.0.4")
+
+    @app.get("/debug/slow_queries", endpoint="slow_queries")
+    def slow_queries():
+        slow_log = get_slow_log()
+        return jsonify({"enabled": metrics is not None and slow_log.enabled,
+                        "threshold_ms": slow_log.threshold * 1000, "explain": slow_log.explain,
+                        "entries": slow_log.entries()}), 200
+
+    # -----------------------
+    # Liveness, readiness and table stats
+    # -----------------------
+    @app.get("/live", endpoint="live")
+    def live():
+        """The process answers (no database access)"""
+        return jsonify({"ok": True}), 200
+
+    @app.get("/ready", endpoint="ready")
+    def ready():
+        """A pooled connection answers a ping"""
+        try:
+            with read_connection() as conn:
+                conn.exec_driver_sql("SELECT 1").scalar()
+            return jsonify({"ok": True}), 200
+        except Exception as e:
+            return jsonify({"ok": False, "error": str(e)}), 503
+
+    @app.get("/stats", endpoint="table_stats")
+    def table_stats():
+        """Row counts (manifest or estimate, cached); ?exact=1 runs COUNT(*) over every table"""
+        try:
+            if parse_exact(request.args):
+                with read_connection() as conn:
+                    return jsonify({"source": "exact", "counts": exact_counts(conn)}), 200
+            return jsonify(get_table_stats().get()), 200
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+
     # -----------------------
     # Test DB connection
     # -----------------------
     @app.get("/test_db", endpoint="test_db")
     def test_db():
+        """Version and row counts; the counts are the cached /stats ones unless ?exact=1"""
         eng = get_engine()
         payload = {"ok": False, "dialect": eng.dialect.name}
         try:
-            with eng.begin() as conn:
-                conn.execute(text("SET search_path TO ns, public;"))
+            exact = parse_exact(request.args)
+            with read_connection() as conn:
                 payload["version"] = conn.exec_driver_sql("SELECT version()").scalar()
-                payload["coordinates_count"] = conn.execute(text("SELECT COUNT(*) FROM ns.coordinates")).scalar()
-                payload["metadata_count"] = conn.execute(text("SELECT COUNT(*) FROM ns.metadata")).scalar()
-                payload["annotations_terms_count"] = conn.execute(text("SELECT COUNT(*) FROM ns.annotations_terms")).scalar()
-                payload["ok"] = True
+                stats = {"source": "exact", "counts": exact_counts(conn)} if exact else None
+            stats = stats or get_table_stats().get()
+            for table, n in stats["counts"].items():
+                payload[f"{table}_count"] = n
+            payload["counts_source"] = stats["source"]
+            payload["ok"] = True
             return jsonify(payload), 200
         except Exception as e:
             payload["error"] = str(e)
@@ -0,0 +1,803 @@
+# asgi.py
+"""
+Async ASGI entry point serving the same routes as app.create_app():
+
+    uvicorn asgi:app --workers 2
+
+A request waiting on Postgres does not hold a worker: queries go through
+asyncpg with its own connection pool (search_path and statement_timeout are
+sent as server settings at connect; asyncpg prepares and caches every
+statement per connection). Both directions of /both run concurrently on two
+connections, and batches are split into chunks of pairs queried
+concurrently.
+
+SQL, parameters and response shapes come from queries.py, shared with the
+Flask app. The response cache, data generation and in-memory indexes are the
+same objects app.py uses; index loads go through its synchronous engine, off
+the event loop.
+"""
+
+import asyncio
+import contextlib
+import json
+import os
+import time
+from functools import lru_cache, wraps
+
+import asyncpg
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.responses import FileResponse, HTMLResponse, JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from activation_map import activation_map, encode_volume, foci_arrays, study_set_hash, volume_headers, volume_mimetype
+from app import (database_url, env_flag, get_cache, get_engine, get_generation, get_map_cache, get_metrics,
+                 get_slow_log, get_snapshots, get_table_stats)
+from cache import cache_key
+from metrics import statement_label
+from queries import (
+    PREPARED_STATEMENTS, batch_query, counts_body, directed_pairs, group_by_pair, index_batch, index_minus,
+    minus_query, page_body, page_slice, pair_entries, parse_batch, parse_exact, parse_foci, parse_kernel,
+    parse_map_format, parse_k, parse_order, parse_page, parse_radius, parse_search, parse_threshold, positional,
+    ranked_query, search_body, search_query, similar_body, similar_query, term_params, wants_ndjson,
+)
+from set_query import (TERM_DF_SQL, atom_kinds, canonical, compile_sql, evaluate, parse_expression, size_params,
+                       sizes_from_rows)
+from similar_index import get_similar_index, refresh_similar_index, similar_index_status
+from spatial_index import coord_index_status, get_coord_index, refresh_coord_index
+from table_stats import TABLES
+from term_index import get_term_index, refresh_term_index, term_index_status
+
+_pool = None
+_pool_lock = asyncio.Lock()
+
+
+async def get_pool():
+    global _pool
+    if _pool is not None:
+        return _pool
+    async with _pool_lock:
+        if _pool is None:
+            settings = {"search_path": "ns, public"}
+            statement_timeout = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))
+            if statement_timeout:
+                settings["statement_timeout"] = str(statement_timeout)
+            _pool = await asyncpg.create_pool(
+                database_url(),
+                min_size=int(os.getenv("ASYNC_POOL_MIN", "1")),
+                max_size=int(os.getenv("ASYNC_POOL_SIZE", "20")),
+                max_inactive_connection_lifetime=float(os.getenv("DB_POOL_RECYCLE", "1800")),
+                server_settings=settings,
+            )
+    return _pool
+
+
+@lru_cache(maxsize=1024)  # bounded: /query compiles a statement per expression shape
+def statement(sql):
+    return positional(sql)
+
+
+def bind(sql, params):
+    """($n SQL, positional args) for asyncpg from a :name statement and its params"""
+    body, names = statement(sql)
+    return body, [params[n] for n in names]
+
+
+STATEMENT_NAMES = {sql: name for name, sql in PREPARED_STATEMENTS.items()}
+
+
+async def acquire():
+    """Pool connection context, timing the wait for it (ns_pool_checkout_seconds)"""
+    pool = await get_pool()
+    metrics = get_metrics()
+    if metrics is None:
+        return pool.acquire()
+    started = time.perf_counter()
+    conn = await pool.acquire()
+    metrics.pool_wait_seconds.observe(time.perf_counter() - started)
+
+    @contextlib.asynccontextmanager
+    async def release():
+        try:
+            yield conn
+        finally:
+            await pool.release(conn)
+    return release()
+
+
+def observe_sql(sql, body, args, seconds, rows=None, failed=False):
+    """Record a statement's latency and rows (same series as app.py); slow ones get an EXPLAIN ANALYZE"""
+    metrics = get_metrics()
+    if metrics is None:
+        return
+    label = STATEMENT_NAMES.get(sql) or statement_label(body)
+    if failed:
+        metrics.sql_errors.inc(statement=label)
+        return
+    metrics.sql_seconds.observe(seconds, statement=label)
+    if rows is not None:
+        metrics.sql_rows.observe(rows, statement=label)
+    slow_log = get_slow_log()
+    if slow_log.enabled and seconds >= slow_log.threshold:
+        metrics.slow_queries.inc(statement=label)
+        loop = asyncio.get_running_loop()
+        # Runs on the slow log's thread; the EXPLAIN itself goes back through this loop's pool
+        explain_fn = lambda: asyncio.run_coroutine_threadsafe(explain(body, args), loop).result(timeout=300)
+        slow_log.record(label, body, args, seconds, explain_fn)
+
+
+async def explain(body, args):
+    async with (await get_pool()).acquire() as conn:
+        rows = await conn.fetch("EXPLAIN (ANALYZE, BUFFERS) " + body, *args)
+    return "\n".join(r[0] for r in rows)
+
+
+async def fetch(sql, params):
+    body, args = bind(sql, params)
+    async with await acquire() as conn:
+        started = time.perf_counter()
+        try:
+            rows = await conn.fetch(body, *args)
+        except Exception:
+            observe_sql(sql, body, args, 0.0, failed=True)
+            raise
+    observe_sql(sql, body, args, time.perf_counter() - started, len(rows))
+    return rows
+
+
+async def stream(sql, params, prefetch=5000):
+    """Iterate the rows through a server-side cursor (needs a transaction)"""
+    body, args = bind(sql, params)
+    async with await acquire() as conn:
+        started, n = time.perf_counter(), 0
+        async with conn.transaction():
+            async for record in conn.cursor(body, *args, prefetch=prefetch):
+                n += 1
+                yield record
+    observe_sql(sql, body, args, time.perf_counter() - started, n)
+
+
+class TimingMiddleware:
+    """
+    Per-endpoint request latency and 5xx counts (ns_http_*), timed to the last
+    body byte; `names` maps route endpoints to app.py's endpoint names, so both
+    apps report the same series.
+    """
+
+    def __init__(self, app, metrics, names):
+        self.app = app
+        self.metrics = metrics
+        self.names = names
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            endpoint = self.names.get(scope.get("endpoint"))
+            self.metrics.observe_request(endpoint, scope["method"], status, time.perf_counter() - started)
+
+
+def error(e, status):
+    return JSONResponse({"error": str(e)}, status_code=status)
+
+
+def create_app():
+    # -----------------------
+    # Helper functions
+    # -----------------------
+    use_cache = env_flag("CACHE", True)
+    use_term_index = env_flag("TERM_INDEX")
+    use_coord_index = env_flag("SPATIAL_INDEX")
+    use_similar_index = env_flag("SIMILAR_INDEX")
+    coord_cell = float(os.getenv("SPATIAL_INDEX_CELL", "8"))
+    page_max = int(os.getenv("PAGE_MAX_LIMIT", "10000"))
+    batch_max_pairs = int(os.getenv("BATCH_MAX_PAIRS", "1000"))
+    batch_chunk = int(os.getenv("ASYNC_BATCH_CHUNK", "25"))
+
+    async def resident_index(kind):
+        """The snapshot's or loaded in-memory index for `kind` if enabled, else None (use SQL)"""
+        if get_snapshots() is not None:
+            snapshot = await run_in_threadpool(get_snapshots().get)
+            if snapshot is not None:
+                return snapshot.terms if kind == "terms" else snapshot.coords
+        if not (use_term_index if kind == "terms" else use_coord_index):
+            return None
+        # Indexes loaded from ns reload once the generation moves (a create_db.py load)
+        generation = await run_in_threadpool(get_generation().current)
+        if kind == "terms":
+            return await run_in_threadpool(get_term_index, get_engine, generation)
+        return await run_in_threadpool(get_coord_index, get_engine, coord_cell, generation)
+
+    async def query_minus(kind, a, b, radius=0.0, after=None, limit=None, threshold=0.0):
+        """A \\ B in study_id order, optionally only those after `after`, at most `limit`"""
+        index = await resident_index(kind)
+        if index is not None:
+            return page_slice(index_minus(kind, index, a, b, radius, threshold), after, limit)
+        name, params = minus_query(kind, a, b, radius, after, limit, threshold)
+        return [r[0] for r in await fetch(PREPARED_STATEMENTS[name], params)]
+
+    async def minus_stream(kind, a, b, radius=0.0, after=None, limit=None, threshold=0.0):
+        index = await resident_index(kind)
+        if index is not None:
+            for study_id in page_slice(index_minus(kind, index, a, b, radius, threshold), after, limit):
+                yield study_id
+            return
+        name, params = minus_query(kind, a, b, radius, after, limit, threshold)
+        async for record in stream(PREPARED_STATEMENTS[name], params):
+            yield record[0]
+
+    async def query_terms(term_a, term_b, after=None, limit=None, threshold=0.0):
+        return await query_minus("terms", term_a, term_b, after=after, limit=limit, threshold=threshold)
+
+    async def query_ranked(term_a, term_b, threshold=0.0, limit=None):
+        """A \\ B as [{"study_id", "weight"}] by descending weight for term_a, top `limit`"""
+        index = await resident_index("terms")
+        if index is not None:
+            return index.ranked(term_a, term_b, threshold, limit)
+        name, params = ranked_query(term_a, term_b, threshold, limit)
+        return [{"study_id": r[0], "weight": r[1]} for r in await fetch(PREPARED_STATEMENTS[name], params)]
+
+    async def query_coords(coords_a, coords_b, radius=0.0, after=None, limit=None):
+        return await query_minus("locations", coords_a, coords_b, radius, after, limit)
+
+    async def query_both(kind, a, b, radius=0.0, threshold=0.0):
+        """Both directions, run concurrently on two pool connections"""
+        a_minus_b, b_minus_a = await asyncio.gather(
+            query_minus(kind, a, b, radius, threshold=threshold), query_minus(kind, b, a, radius, threshold=threshold))
+        return {"A_minus_B": a_minus_b, "B_minus_A": b_minus_a}
+
+    async def query_counts(term_a, term_b, threshold=0.0):
+        """|A|, |B|, |A ∩ B|: from the term index, else one term_cooccurrence lookup, else counted from annotations_terms"""
+        index = await resident_index("terms")
+        if index is not None:
+            return counts_body(*index.counts(term_a, term_b, threshold), "index")
+        params = term_params(term_a, term_b, threshold)
+        if not threshold:
+            try:
+                keys_a, keys_b, n_a, n_b, n_ab = (await fetch(PREPARED_STATEMENTS["ns_terms_cooc_counts"], params))[0]
+                if keys_a <= 1 and keys_b <= 1:
+                    return counts_body(n_a, n_b, n_ab, "cooccurrence")
+            except asyncpg.UndefinedTableError:
+                pass  # term_vocab / term_cooccurrence not built (create_db.py --cooccurrence)
+        return counts_body(*(await fetch(PREPARED_STATEMENTS["ns_terms_counts"], params))[0], "annotations")
+
+    async def query_batch(kind, directed, radius=0.0, threshold=0.0):
+        """Study list of each directed pair, in order, from one statement or in-memory pass"""
+        index = await resident_index(kind)
+        if index is not None:
+            return list(index_batch(kind, index, directed, radius, threshold))
+        sql, params = batch_query(kind, directed, radius, threshold)
+        return list(group_by_pair(await fetch(sql, params), len(directed)))
+
+    async def query_similar(study_id, k=10):
+        """k nearest studies: pgvector index, else (SIMILAR_INDEX=1 or no pgvector) the in-process index; None if unknown"""
+        if not use_similar_index:
+            try:
+                name, params = similar_query(study_id, k)
+                rows = await fetch(PREPARED_STATEMENTS[name], params)
+                return similar_body(study_id, rows, "pgvector") if rows else None
+            except asyncpg.PostgresError:
+                pass  # no pgvector (study_embeddings stored as real[]) or no embeddings yet
+        generation = await run_in_threadpool(get_generation().current)
+        index = await run_in_threadpool(get_similar_index, get_engine, generation)
+        if index is None:
+            raise RuntimeError("Study embeddings unavailable; load them with create_db.py --embeddings DIM")
+        neighbours = index.similar(study_id, k)
+        return similar_body(study_id, neighbours, "index") if neighbours is not None else None
+
+    async def batch_results(pairs, both, radius, threshold=0.0):
+        """Yield (kind, "a/b", entry) in request order; chunks of pairs are queried concurrently"""
+        tasks = []
+        for kind, items in pairs.items():
+            for i in range(0, len(items), batch_chunk):
+                chunk = items[i:i + batch_chunk]
+                task = asyncio.ensure_future(query_batch(kind, directed_pairs(chunk, both), radius, threshold))
+                tasks.append((kind, chunk, task))
+        try:
+            for kind, chunk, task in tasks:
+                for pair, entry in pair_entries(chunk, both, await task):
+                    yield kind, pair, entry
+        finally:
+            for _, _, task in tasks:
+                task.cancel()
+
+    async def cached(kind, fn, *args):
+        """Await fn(*args) through the response cache, keyed on the data generation (same keys as app.py)"""
+        if not use_cache:
+            return await fn(*args)
+        cache = get_cache()
+        key = cache_key(kind, await run_in_threadpool(get_generation().current), *args)
+        found, value = cache.get(key)
+        if found:
+            return value
+        value = await fn(*args)
+        cache.set(key, value)
+        return value
+
+    async def study_foci(studies):
+        """(study codes, xyz) of every focus of the studies, from the spatial index or ns.coordinates"""
+        index = await resident_index("locations")
+        if index is not None:
+            return index.foci(studies)
+        return foci_arrays(await fetch(PREPARED_STATEMENTS["ns_study_foci"], {"ids": list(studies)}))
+
+    async def study_map(studies, kernel, size, fmt):
+        """Encoded activation map of a study set (same cache keys as app.py); built off the event loop"""
+        async def build():
+            codes, xyz = await study_foci(studies)
+            volume = await run_in_threadpool(activation_map, codes, xyz, kernel, size)
+            return await run_in_threadpool(encode_volume, volume, fmt)
+        if not use_cache:
+            return await build()
+        cache = get_map_cache()
+        generation = await run_in_threadpool(get_generation().current)
+        key = cache_key("map", generation, study_set_hash(studies), kernel, size, fmt)
+        found, body = cache.get(key)
+        if not found:
+            body = await build()
+            cache.set(key, body)
+        return body
+
+    async def map_response(request, kind, a, b, radius=0.0, threshold=0.0):
+        """Activation map of A \\ B as gzipped NIfTI or raw float32 (?format=), kernel from ?kernel=&size="""
+        kernel, size = parse_kernel(request.query_params)
+        fmt = parse_map_format(request.query_params)
+        if kind == "terms":
+            studies = await cached("terms", query_terms, a, b, None, None, threshold)
+        else:
+            parse_foci(a), parse_foci(b)
+            studies = await cached("locations", query_coords, a, b, radius, None, None)
+        body = await study_map(studies, kernel, size, fmt)
+        return Response(body, media_type=volume_mimetype(fmt), headers=volume_headers(fmt, len(studies)))
+
+    async def query_search(q, after=None, limit=20, highlight=False, within=None, radius=0.0, threshold=0.0):
+        """One page of full-text hits, optionally restricted to the studies of a dissociation"""
+        ids = None
+        if within is not None:
+            kind, a, b = within
+            if kind == "terms":
+                ids = await cached("terms", query_terms, a, b, None, None, threshold)
+            else:
+                ids = await cached("locations", query_coords, a, b, radius, None, None)
+            if not ids:
+                return {"results": [], "next": None}
+        name, params = search_query(q, ids, after, limit, highlight)
+        return search_body(await fetch(PREPARED_STATEMENTS[name], params), limit, highlight)
+
+    async def query_expression(node, threshold=0.0, after=None, limit=None):
+        """Study ids of a /query expression: from the resident indexes when they cover its operands, else one SQL statement"""
+        kinds = atom_kinds(node)
+        terms = await resident_index("terms") if "term" in kinds else None
+        coords = await resident_index("locations") if "loc" in kinds else None
+        if ("term" not in kinds or terms is not None) and ("loc" not in kinds or coords is not None):
+            return page_slice(await run_in_threadpool(evaluate, node, terms, coords, threshold), after, limit)
+        sizes, df_params = {}, size_params(node)
+        if df_params is not None:
+            try:
+                sizes = sizes_from_rows(await fetch(TERM_DF_SQL, df_params))
+            except asyncpg.PostgresError:
+                pass  # term_vocab not built (create_db.py --cooccurrence); AND order falls back to shape
+        sql, params = compile_sql(node, threshold, sizes)
+        params.update(after=after, limit=limit)
+        return [r[0] for r in await fetch(sql, params)]
+
+    async def studies_response(request, kind, a, b, radius=0.0, threshold=0.0, order="study_id"):
+        """A \\ B as a JSON list, as a {"studies", "next"} page (?limit=&after=), or as an NDJSON stream"""
+        after, limit = parse_page(request.query_params, page_max)
+        if kind == "locations":
+            parse_foci(a), parse_foci(b)
+        if order == "weight":
+            # Top-k by weight: [{"study_id", "weight"}], no keyset cursor
+            if after is not None:
+                raise ValueError("after is not supported with order=weight; use limit for the top k")
+            ranked = await cached("terms_ranked", query_ranked, a, b, threshold, limit)
+            if wants_ndjson(request.query_params, request.headers):
+                return Response("".join(json.dumps(r) + "\n" for r in ranked), media_type="application/x-ndjson")
+            return JSONResponse(ranked)
+        if wants_ndjson(request.query_params, request.headers):
+            async def generate():
+                lines = []
+                try:
+                    async for study_id in minus_stream(kind, a, b, radius, after, limit, threshold):
+                        lines.append(json.dumps(study_id) + "\n")
+                        if len(lines) >= 1000:
+                            yield "".join(lines)
+                            lines = []
+                    yield "".join(lines)
+                except Exception as e:
+                    # Headers are already sent; report the failure as the last line
+                    yield "".join(lines) + json.dumps({"error": str(e)}) + "\n"
+            return StreamingResponse(generate(), media_type="application/x-ndjson")
+        if kind == "terms":
+            studies = await cached("terms", query_terms, a, b, after, limit, threshold)
+        else:
+            studies = await cached("locations", query_coords, a, b, radius, after, limit)
+        return JSONResponse(page_body(studies, after, limit))
+
+    # -----------------------
+    # Conditional requests (ETag)
+    # -----------------------
+    use_etag = env_flag("ETAG", True)
+
+    def conditional(handler):
+        """Answer 304 from the data generation alone when the client already holds this response"""
+        @wraps(handler)
+        async def wrapper(request):
+            if not use_etag:
+                return await handler(request)
+            generation = await run_in_threadpool(get_generation().current)
+            if generation is None:
+                return await handler(request)
+            etag = 'W/"%s"' % cache_key(generation, request.url.path, sorted(request.query_params.multi_items()),
+                                        wants_ndjson(request.query_params, request.headers))
+            if etag in [t.strip() for t in request.headers.get("If-None-Match", "").split(",")]:
+                return Response(status_code=304, headers={"ETag": etag})
+            response = await handler(request)
+            if response.status_code == 200:
+                response.headers["ETag"] = etag
+                response.headers["Cache-Control"] = "no-cache"
+            return response
+        return wrapper
+
+    # -----------------------
+    # Health check / test image
+    # -----------------------
+    async def health(request):
+        return HTMLResponse("<p>Server working!</p>")
+
+    async def show_img(request):
+        return FileResponse(os.path.join(os.path.dirname(os.path.abspath(__file__)), "amygdala.gif"),
+                            media_type="image/gif")
+
+    # -----------------------
+    # Dissociate by terms
+    # -----------------------
+    @conditional
+    async def dissociate_terms(request):
+        p = request.path_params
+        try:
+            return await studies_response(request, "terms", p["term_a"], p["term_b"],
+                                          threshold=parse_threshold(request.query_params),
+                                          order=parse_order(request.query_params))
+        except ValueError as e:
+            return error(e, 400)
+        except Exception as e:
+            return error(e, 500)
+
+    @conditional
+    async def dissociate_terms_both(request):
+        p = request.path_params
+        try:
+            threshold = parse_threshold(request.query_params)
+            return JSONResponse(await cached("terms_both", query_both, "terms", p["term1"], p["term2"], 0.0, threshold))
+        except ValueError as e:
+            return error(e, 400)
+        except Exception as e:
+            return error(e, 500)
+
+    @conditional
+    async def dissociate_terms_counts(request):
+        p = request.path_params
+        try:
+            threshold = parse_threshold(request.query_params)
+            return JSONResponse(await cached("terms_counts", query_counts, p["term1"], p["term2"], threshold))
+        except ValueError as e:
+            return error(e, 400)
+        except Exception as e:
+            return error(e, 500)
+
+    @conditional
+    async def dissociate_terms_map(request):
+        p = request.path_params
+        try:
+            threshold = parse_threshold(request.query_params)
+            return await map_response(request, "terms", p["term1"], p["term2"], threshold=threshold)
+        except ValueError as e:
+            return error(e, 400)
+        except Exception as e:
+            return error(e, 500)
+
+    # -----------------------
+    # Dissociate by coordinates
+    # -----------------------
+    @conditional
+    async def dissociate_locations(request):
+        p = request.path_params
+        try:
+            radius = parse_radius(request.query_params)
+            return await studies_response(request, "locations", p["coords_a"], p["coords_b"], radius)
+        except ValueError as e:
+            return error(e, 400)
+        except Exception as e:
+            return error(e, 500)
+
+    @conditional
+    async def dissociate_locations_both(request):
+        p = request.path_params
+        try:
+            radius = parse_radius(request.query_params)
+            parse_foci(p["coords1"]), parse_foci(p["coords2"])
+            result = await cached("locations_both", query_both, "locations", p["coords1"], p["coords2"], radius)
+            return JSONResponse(result)
+        except ValueError as e:
+            return error(e, 400)
+        except Exception as e:
+            return error(e, 500)
+
+    @conditional
+    async def dissociate_locations_map(request):
+        p = request.path_params
+        try:
+            radius = parse_radius(request.query_params)
+            return await map_response(request, "locations", p["coords1"], p["coords2"], radius)
+        except ValueError as e:
+            return error(e, 400)
+        except Exception as e:
+            return error(e, 500)
+
+    # -----------------------
+    # Similar studies (study_embeddings)
+    # -----------------------
+    @conditional
+    async def studies_similar(request):
+        study_id = request.path_params["study_id"]
+        try:
+            result = await cached("similar", query_similar, study_id, parse_k(request.query_params))
+            if result is None:
+                return error(f"No embedding for study {study_id!r}", 404)
+            return JSONResponse(result)
+        except ValueError as e:
+            return error(e, 400)
+        except Exception as e:
+            return error(e, 500)
+
+    # -----------------------
+    # Full-text search over metadata
+    # -----------------------
+    @conditional
+    async def search(request):
+        try:
+            q, after, limit, highlight, within = parse_search(request.query_params, page_max)
+            radius, threshold = parse_radius(request.query_params), parse_threshold(request.query_params)
+            return JSONResponse(await cached("search", query_search, q, after, limit, highlight, within, radius, threshold))
+        except ValueError as e:
+            return error(e, 400)
+        except Exception as e:
+            return error(e, 500)
+
+    # -----------------------
+    # Boolean set algebra over terms and locations
+    # -----------------------
+    query_max_atoms = int(os.getenv("QUERY_MAX_OPERANDS", "32"))
+
+    @conditional
+    async def boolean_query(request):
+        try:
+            node = parse_expression(request.query_params.get("q"), parse_radius(request.query_params), query_max_atoms)
+            threshold = parse_threshold(request.query_params)
+            after, limit = parse_page(request.query_params, page_max)
+            studies = await cached("query", query_expression, node, threshold, after, limit)
+            return JSONResponse(page_body(studies, after, limit), headers={"X-Query": canonical(node)})
+        except ValueError as e:
+            return error(e, 400)
+        except Exception as e:
+            return error(e, 500)
+
+    # -----------------------
+    # Batch dissociation
+    # -----------------------
+    async def dissociate_batch(request):
+        try:
+            body = await request.json()
+        except ValueError:
+            body = None
+        try:
+            pairs, both, radius, threshold = parse_batch(body, batch_max_pairs)
+        except ValueError as e:
+            return error(e, 400)
+
+        if wants_ndjson(request.query_params, request.headers):
+            async def generate():
+                try:
+                    async for kind, pair, entry in batch_results(pairs, both, radius, threshold):
+                        yield json.dumps({"kind": kind, "pair": pair, **entry}) + "\n"
+                except Exception as e:
+                    # Headers are already sent; report the failure as the last line
+                    yield json.dumps({"error": str(e)}) + "\n"
+            return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+        try:
+            result = {"terms": {}, "locations": {}}
+            async for kind, pair, entry in batch_results(pairs, both, radius, threshold):
+                result[kind][pair] = entry if both else entry["A_minus_B"]
+            return JSONResponse(result)
+        except Exception as e:
+            return error(e, 500)
+
+    # -----------------------
+    # In-memory indexes
+    # -----------------------
+    async def term_index_info(request):
+        return JSONResponse({"enabled": use_term_index, **term_index_status()})
+
+    async def term_index_refresh(request):
+        try:
+            generation = await run_in_threadpool(get_generation().current)
+            await run_in_threadpool(refresh_term_index, get_engine, generation)
+            return JSONResponse({"enabled": use_term_index, **term_index_status()})
+        except Exception as e:
+            return error(e, 500)
+
+    async def similar_index_info(request):
+        return JSONResponse({"enabled": use_similar_index, **similar_index_status()})
+
+    async def similar_index_refresh(request):
+        try:
+            generation = await run_in_threadpool(get_generation().current)
+            await run_in_threadpool(refresh_similar_index, get_engine, generation)
+            return JSONResponse({"enabled": use_similar_index, **similar_index_status()})
+        except Exception as e:
+            return error(e, 500)
+
+    async def spatial_index_info(request):
+        return JSONResponse({"enabled": use_coord_index, **coord_index_status()})
+
+    async def spatial_index_refresh(request):
+        try:
+            generation = await run_in_threadpool(get_generation().current)
+            await run_in_threadpool(refresh_coord_index, get_engine, coord_cell, generation)
+            return JSONResponse({"enabled": use_coord_index, **coord_index_status()})
+        except Exception as e:
+            return error(e, 500)
+
+    async def snapshot_info(request):
+        snapshots = get_snapshots()
+        if snapshots is None:
+            return JSONResponse({"enabled": False})
+        return JSONResponse({"enabled": True, **await run_in_threadpool(snapshots.status)})
+
+    # -----------------------
+    # Response cache
+    # -----------------------
+    async def cache_stats(request):
+        if not use_cache:
+            return JSONResponse({"enabled": False})
+        generation = await run_in_threadpool(get_generation().current)
+        return JSONResponse({"enabled": True, "generation": generation, **get_cache().stats(),
+                             "maps": get_map_cache().stats()})
+
+    async def cache_clear(request):
+        if use_cache:
+            get_cache().clear()
+            get_map_cache().clear()
+        return JSONResponse({"ok": True})
+
+    # -----------------------
+    # Metrics (Prometheus) and slow statements
+    # -----------------------
+    async def metrics_text(request):
+        metrics = get_metrics()
+        if metrics is None:
+            return Response("metrics disabled (METRICS=0)\n", status_code=404, media_type="text/plain")
+        caches = {"response": get_cache().stats(), "maps": get_map_cache().stats()} if use_cache else None
+        return Response(metrics.render(caches), media_type="text/plain; version=0.0.4")
+
+    async def slow_queries(request):
+        slow_log = get_slow_log()
+        return JSONResponse({"enabled": get_metrics() is not None and slow_log.enabled,
+                             "threshold_ms": slow_log.threshold * 1000, "explain": slow_log.explain,
+                             "entries": slow_log.entries()})
+
+    # -----------------------
+    # Liveness, readiness and table stats
+    # -----------------------
+    async def live(request):
+        return JSONResponse({"ok": True})
+
+    async def ready(request):
+        try:
+            async with await acquire() as conn:
+                await conn.fetchval("SELECT 1")
+            return JSONResponse({"ok": True})
+        except Exception as e:
+            return JSONResponse({"ok": False, "error": str(e)}, status_code=503)
+
+    async def exact_counts(conn):
+        return {t: await conn.fetchval(f"SELECT COUNT(*) FROM ns.{t}") for t in TABLES}
+
+    async def table_stats(request):
+        try:
+            if parse_exact(request.query_params):
+                async with await acquire() as conn:
+                    return JSONResponse({"source": "exact", "counts": await exact_counts(conn)})
+            return JSONResponse(await run_in_threadpool(get_table_stats().get))
+        except Exception as e:
+            return error(e, 500)
+
+    # -----------------------
+    # Test DB connection
+    # -----------------------
+    async def test_db(request):
+        payload = {"ok": False, "dialect": "postgresql", "driver": "asyncpg"}
+        try:
+            exact = parse_exact(request.query_params)
+            async with await acquire() as conn:
+                payload["version"] = await conn.fetchval("SELECT version()")
+                stats = {"source": "exact", "counts": await exact_counts(conn)} if exact else None
+            stats = stats or await run_in_threadpool(get_table_stats().get)
+            for table, n in stats["counts"].items():
+                payload[f"{table}_count"] = n
+            payload["counts_source"] = stats["source"]
+            payload["ok"] = True
+            return JSONResponse(payload)
+        except Exception as e:
+            payload["error"] = str(e)
+            return JSONResponse(payload, status_code=500)
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        global _pool
+        yield
+        if _pool is not None:
+            await _pool.close()
+            _pool = None
+
+    routes = [
+        Route("/", health, methods=["GET"], name="health"),
+        Route("/img", show_img, methods=["GET"], name="show_img"),
+        Route("/dissociate/terms/{term_a}/{term_b}", dissociate_terms, methods=["GET"], name="terms_dissociate"),
+        Route("/dissociate/terms/{term1}/{term2}/both", dissociate_terms_both, methods=["GET"],
+              name="terms_dissociate_both"),
+        Route("/dissociate/terms/{term1}/{term2}/counts", dissociate_terms_counts, methods=["GET"],
+              name="terms_dissociate_counts"),
+        Route("/dissociate/terms/{term1}/{term2}/map", dissociate_terms_map, methods=["GET"],
+              name="terms_dissociate_map"),
+        Route("/term_index", term_index_info, methods=["GET"], name="term_index_status"),
+        Route("/term_index/refresh", term_index_refresh, methods=["POST"], name="term_index_refresh"),
+        Route("/dissociate/locations/{coords_a}/{coords_b}", dissociate_locations, methods=["GET"],
+              name="locations_dissociate"),
+        Route("/dissociate/locations/{coords1}/{coords2}/both", dissociate_locations_both, methods=["GET"],
+              name="locations_dissociate_both"),
+        Route("/dissociate/locations/{coords1}/{coords2}/map", dissociate_locations_map, methods=["GET"],
+              name="locations_dissociate_map"),
+        Route("/search", search, methods=["GET"], name="search"),
+        Route("/query", boolean_query, methods=["GET"], name="boolean_query"),
+        Route("/studies/{study_id}/similar", studies_similar, methods=["GET"], name="studies_similar"),
+        Route("/similar_index", similar_index_info, methods=["GET"], name="similar_index_status"),
+        Route("/similar_index/refresh", similar_index_refresh, methods=["POST"], name="similar_index_refresh"),
+        Route("/dissociate/batch", dissociate_batch, methods=["POST"], name="dissociate_batch"),
+        Route("/spatial_index", spatial_index_info, methods=["GET"], name="spatial_index_status"),
+        Route("/spatial_index/refresh", spatial_index_refresh, methods=["POST"], name="spatial_index_refresh"),
+        Route("/snapshot", snapshot_info, methods=["GET"], name="snapshot_status"),
+        Route("/cache", cache_stats, methods=["GET"], name="cache_stats"),
+        Route("/cache/clear", cache_clear, methods=["POST"], name="cache_clear"),
+        Route("/metrics", metrics_text, methods=["GET"], name="metrics"),
+        Route("/debug/slow_queries", slow_queries, methods=["GET"], name="slow_queries"),
+        Route("/live", live, methods=["GET"], name="live"),
+        Route("/ready", ready, methods=["GET"], name="ready"),
+        Route("/stats", table_stats, methods=["GET"], name="table_stats"),
+        Route("/test_db", test_db, methods=["GET"], name="test_db"),
+    ]
+    middleware = []
+    if get_metrics() is not None:
+        names = {route.endpoint: route.name for route in routes}
+        middleware.append(Middleware(TimingMiddleware, metrics=get_metrics(), names=names))
+    if env_flag("COMPRESS", True):
+        middleware.append(Middleware(GZipMiddleware, minimum_size=int(os.getenv("COMPRESS_MIN_BYTES", "1024"))))
+    return Starlette(routes=routes, middleware=middleware, lifespan=lifespan)
+
+
+# ASGI entry point
+app = create_app()
@@ -0,0 +1,12 @@
+"""
+Reproducible benchmarks for create_db.py and the HTTP endpoints.
+
+    python -m bench run --scale small --docker --out results.json
+    python -m bench compare base.json results.json
+
+- synth: synthetic coordinates / metadata / annotations Parquet files shaped
+  like the Neurosynth drop, at a configurable scale
+- loader: times each create_db.py phase against a database
+- load: concurrent HTTP load generator reporting p50/p95/p99 and throughput
+- pg: a throwaway Postgres + PostGIS container (docker)
+"""
@@ -0,0 +1,189 @@
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from .synth import SCALES
+
+
+def parse_args():
+    ap = argparse.ArgumentParser(prog="python -m bench", description="Load and HTTP benchmarks on synthetic data.")
+    sub = ap.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="Generate data, time the load, drive the endpoints, write JSON results.")
+    run.add_argument("--scale", choices=sorted(SCALES), default="small",
+                     help="Preset size (studies, terms, mean foci per study); neurosynth matches the real drop.")
+    run.add_argument("--studies", type=int, default=None, help="Override the preset's number of studies.")
+    run.add_argument("--terms", type=int, default=None, help="Override the preset's number of terms.")
+    run.add_argument("--foci", type=float, default=None, help="Override the preset's mean foci per study.")
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("--data-dir", default=None,
+                     help="Reuse (or keep) the generated Parquet files here; default: a temporary directory.")
+    target = run.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="Database to load into (its `--schema` is replaced).")
+    target.add_argument("--docker", action="store_true", help="Start a throwaway Postgres+PostGIS container.")
+    run.add_argument("--image", default=None, help="Docker image for --docker (default: postgis/postgis:16-3.4).")
+    run.add_argument("--schema", default="ns", help="Schema to load; the app reads ns.")
+    run.add_argument("--jobs", type=int, default=1, help="create_db.py --jobs for the loader and index builds.")
+    run.add_argument("--batch-cols", type=int, default=150)
+    run.add_argument("--no-stream", action="store_true", help="Read whole files first (times read_parquet).")
+    run.add_argument("--covering-index", action="store_true")
+    run.add_argument("--embeddings", type=int, default=0, help="Also time build_embeddings at this dimension.")
+    run.add_argument("--skip-load", action="store_true", help="Reuse data already loaded at --url.")
+    run.add_argument("--skip-http", action="store_true", help="Only time the load.")
+    run.add_argument("--base-url", default=None,
+                     help="Drive an already running server instead of serving app.py in-process.")
+    run.add_argument("--cache", action="store_true", help="Leave the response cache on (default CACHE=0).")
+    run.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                     help="Extra environment for the in-process app, e.g. --env TERM_INDEX=1 (repeatable).")
+    run.add_argument("--concurrency", type=int, default=8)
+    run.add_argument("--duration", type=float, default=30.0, help="Seconds of load after warm-up.")
+    run.add_argument("--requests", type=int, default=None, help="Stop after this many responses instead.")
+    run.add_argument("--warmup", type=int, default=2, help="Unrecorded requests per endpoint before timing.")
+    run.add_argument("--out", default=None, help="Write results JSON here (default: stdout).")
+
+    cmp = sub.add_parser("compare", help="Compare two results files (e.g. from two commits).")
+    cmp.add_argument("base")
+    cmp.add_argument("head")
+    cmp.add_argument("--metric", default="p95_ms", choices=["p50_ms", "p95_ms", "p99_ms", "mean_ms", "rps"])
+    cmp.add_argument("--threshold", type=float, default=10.0,
+                     help="Flag changes larger than this percentage (default 10).")
+    return ap.parse_args()
+
+
+def git_revision() -> dict:
+    def git(*args):
+        try:
+            out = subprocess.run(["git", *args], capture_output=True, text=True, check=True,
+                                 cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+            return out.stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+    return {"commit": git("rev-parse", "HEAD"), "describe": git("describe", "--always", "--dirty")}
+
+
+def run(args) -> dict:
+    studies, terms, foci = SCALES[args.scale]
+    studies = args.studies or studies
+    terms = args.terms or terms
+    foci = args.foci if args.foci is not None else foci
+    results = {
+        "git": git_revision(),
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "scale": {"name": args.scale, "studies": studies, "terms": terms, "mean_foci": foci, "seed": args.seed},
+    }
+
+    with contextlib.ExitStack() as stack:
+        data_dir = args.data_dir or stack.enter_context(tempfile.TemporaryDirectory(prefix="ns-bench-"))
+        if not args.skip_load:
+            if not all(os.path.exists(os.path.join(data_dir, f"{k}.parquet"))
+                       for k in ("coordinates", "metadata", "annotations")) or not args.data_dir:
+                from .synth import generate
+                print(f"🧪 generating {studies:,} studies × {terms:,} terms into {data_dir}")
+                t0 = time.perf_counter()
+                results["data"] = generate(data_dir, studies, terms, foci, seed=args.seed)
+                results["data"]["seconds"] = round(time.perf_counter() - t0, 3)
+            else:
+                print(f"🧪 reusing Parquet files in {data_dir}")
+
+        if args.docker:
+            from .pg import IMAGE, throwaway_postgres
+            url = stack.enter_context(throwaway_postgres(args.image or IMAGE))
+        else:
+            url = args.url
+
+        if not args.skip_load:
+            from .loader import time_load
+            results["load"] = time_load(url, data_dir, args.schema, jobs=max(1, args.jobs),
+                                        batch_cols=args.batch_cols, stream=not args.no_stream,
+                                        covering_index=args.covering_index, embeddings=args.embeddings)
+
+        if not args.skip_http:
+            from .load import default_targets, run_load, serve_app
+            if args.base_url:
+                base_url = args.base_url
+            else:
+                env = {"DB_URL": url, "CACHE": "1" if args.cache else "0"}
+                env.update(kv.split("=", 1) for kv in args.env)
+                base_url = stack.enter_context(serve_app(env))
+            print(f"🚦 {args.concurrency} clients against {base_url}")
+            results["http"] = run_load(base_url, default_targets(), concurrency=args.concurrency,
+                                       duration=None if args.requests else args.duration,
+                                       requests=args.requests, warmup=args.warmup)
+            results["http"]["server"] = "external" if args.base_url else "werkzeug (in-process)"
+            results["http"]["cache"] = args.cache
+    return results
+
+
+def change(base, head) -> float:
+    if base in (None, 0) or head is None:
+        return None
+    return (head - base) / base * 100.0
+
+
+def number(v) -> str:
+    return "-" if v is None else f"{v:,.2f}"
+
+
+def compare(args):
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.head) as f:
+        head = json.load(f)
+    print(f"base: {base.get('git', {}).get('describe')}  head: {head.get('git', {}).get('describe')}")
+    if base.get("scale") != head.get("scale"):
+        print(f"⚠️  different scales: {base.get('scale')} vs {head.get('scale')}")
+
+    # Lower is better, except for throughput
+    higher_is_better = args.metric == "rps"
+    regressions = 0
+
+    def row(name, b, h, higher_better=False):
+        nonlocal regressions
+        pct = change(b, h)
+        flag = ""
+        if pct is not None and abs(pct) > args.threshold:
+            worse = pct < 0 if higher_better else pct > 0
+            flag = "  ❌ slower" if worse else "  ✅ faster"
+            regressions += worse
+        print(f"  {name:<28} {number(b):>12} {number(h):>12} {'' if pct is None else f'{pct:+.1f}%':>9}{flag}")
+
+    if base.get("load") and head.get("load"):
+        print("\nload (s)")
+        for phase in dict.fromkeys([*base["load"], *head["load"]]):
+            row(phase, base["load"].get(phase), head["load"].get(phase))
+    if base.get("http") and head.get("http"):
+        print(f"\nhttp ({args.metric})")
+        endpoints = dict.fromkeys([*base["http"]["endpoints"], *head["http"]["endpoints"]])
+        for name in endpoints:
+            row(name, base["http"]["endpoints"].get(name, {}).get(args.metric),
+                head["http"]["endpoints"].get(name, {}).get(args.metric), higher_is_better)
+        row("total", base["http"]["total"].get(args.metric), head["http"]["total"].get(args.metric),
+            higher_is_better)
+    return 1 if regressions else 0
+
+
+def main():
+    args = parse_args()
+    if args.command == "compare":
+        sys.exit(compare(args))
+    results = run(args)
+    text = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+        print(f"💾 wrote {args.out}")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+Concurrent HTTP load generator.
+
+`concurrency` threads each cycle through the target URLs (starting at
+different offsets) until `duration` seconds have passed or `requests`
+responses were recorded. Every target gets `warmup` unrecorded requests
+first. Latency is measured per request, to the last byte of the body.
+"""
+
+import itertools
+import math
+import threading
+import time
+import urllib.error
+import urllib.request
+from contextlib import contextmanager
+from urllib.parse import quote
+
+from .synth import ANCHOR_TERMS, HOTSPOTS
+
+
+def focus(point) -> str:
+    return "_".join(str(v) for v in point)
+
+
+def default_targets() -> dict:
+    """{name: path} over the routes that query the data, using terms and foci the synthetic data always has."""
+    a, b = (t.replace(" ", "_") for t in ANCHOR_TERMS[2:4])
+    pa, pb = focus(HOTSPOTS[0]), focus(HOTSPOTS[1])
+    expression = f"(term:default_mode OR term:self_referential) AND NOT loc:{pa}~6"
+    return {
+        "terms_dissociate": f"/dissociate/terms/{a}/{b}",
+        "terms_dissociate_both": f"/dissociate/terms/{a}/{b}/both",
+        "terms_dissociate_counts": f"/dissociate/terms/{a}/{b}/counts",
+        "terms_dissociate_page": f"/dissociate/terms/{a}/{b}?limit=100",
+        "locations_dissociate": f"/dissociate/locations/{pa}/{pb}?r=6",
+        "locations_dissociate_both": f"/dissociate/locations/{pa}/{pb}/both?r=6",
+        "search": "/search?q=" + quote("default mode network"),
+        "query": "/query?q=" + quote(expression),
+        "stats": "/stats",
+        "ready": "/ready",
+    }
+
+
+def percentile(sorted_values, p: float) -> float:
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return None
+    k = math.ceil(p / 100.0 * len(sorted_values)) - 1
+    return sorted_values[max(0, min(len(sorted_values) - 1, k))]
+
+
+def fetch(url: str, timeout: float):
+    """(ok, status) of one GET; the body is read fully."""
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            response.read()
+            return 200 <= response.status < 400, response.status
+    except urllib.error.HTTPError as e:
+        e.read()
+        return False, e.code
+    except Exception:
+        return False, None
+
+
+def run_load(base_url: str, targets: dict, concurrency: int = 8, duration: float = 30.0, requests: int = None,
+             warmup: int = 2, timeout: float = 30.0) -> dict:
+    """Drive the targets and return per-target and overall latency (ms) and throughput."""
+    base_url = base_url.rstrip("/")
+    names = list(targets)
+    for name in names:
+        for _ in range(warmup):
+            fetch(base_url + targets[name], timeout)
+
+    samples = {name: [] for name in names}
+    errors = {name: {} for name in names}
+    lock = threading.Lock()
+    recorded = itertools.count()
+    deadline = time.perf_counter() + duration if duration else None
+    stop = threading.Event()
+
+    def worker(offset):
+        for name in itertools.islice(itertools.cycle(names), offset, None):
+            if stop.is_set() or (deadline is not None and time.perf_counter() >= deadline):
+                return
+            t0 = time.perf_counter()
+            ok, status = fetch(base_url + targets[name], timeout)
+            ms = (time.perf_counter() - t0) * 1000
+            with lock:
+                samples[name].append(ms)
+                if not ok:
+                    errors[name][str(status)] = errors[name].get(str(status), 0) + 1
+            if requests is not None and next(recorded) + 1 >= requests:
+                stop.set()
+
+    threads = [threading.Thread(target=worker, args=(i % len(names),), daemon=True) for i in range(concurrency)]
+    t_start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t_start
+
+    def summary(values, errs):
+        values = sorted(values)
+        return {
+            "requests": len(values),
+            "errors": sum(errs.values()),
+            "error_statuses": errs,
+            "mean_ms": round(sum(values) / len(values), 3) if values else None,
+            "p50_ms": round(percentile(values, 50), 3) if values else None,
+            "p95_ms": round(percentile(values, 95), 3) if values else None,
+            "p99_ms": round(percentile(values, 99), 3) if values else None,
+            "max_ms": round(values[-1], 3) if values else None,
+            "rps": round(len(values) / elapsed, 2) if elapsed else None,
+        }
+
+    every = [ms for name in names for ms in samples[name]]
+    all_errors = {}
+    for name in names:
+        for status, n in errors[name].items():
+            all_errors[status] = all_errors.get(status, 0) + n
+    return {
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 3),
+        "endpoints": {name: {"path": targets[name], **summary(samples[name], errors[name])} for name in names},
+        "total": summary(every, all_errors),
+    }
+
+
+@contextmanager
+def serve_app(env: dict):
+    """Serve app.create_app() from a threaded in-process server on a free port; yields its base URL.
+
+    The load generator shares this process (and its GIL); point --base-url at a
+    gunicorn deployment to measure the production server instead.
+    """
+    import os
+
+    from werkzeug.serving import make_server
+
+    previous = {k: os.environ.get(k) for k in env}
+    os.environ.update(env)
+    try:
+        import app as app_module
+        server = make_server("127.0.0.1", 0, app_module.create_app(), threaded=True)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            yield f"http://127.0.0.1:{server.server_port}"
+        finally:
+            server.shutdown()
+            thread.join()
+    finally:
+        for k, v in previous.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
@@ -0,0 +1,62 @@
+"""
+Times each phase of a create_db.py load (the same calls main() makes, one after
+another so every phase gets its own wall time).
+"""
+
+import os
+import time
+
+from sqlalchemy import create_engine
+
+from create_db import (annotation_chunks, build_annotations, build_coordinates, build_embeddings, build_metadata,
+                       ensure_extensions, ensure_schema, index_annotations, index_coordinates, index_metadata,
+                       load_parquet, parquet_chunks, vacuum_annotations, write_load_info)
+
+
+def time_load(url: str, data_dir: str, schema: str = "ns", jobs: int = 1, batch_cols: int = 150,
+              stream: bool = True, memory_budget: int = 512, covering_index: bool = False,
+              embeddings: int = 0) -> dict:
+    """Load data_dir into `schema`; returns {phase: seconds} in phase order, plus "total"."""
+    engine = create_engine(url, pool_pre_ping=True, pool_size=max(5, jobs + 3))
+    phases = {}
+
+    def timed(name, fn):
+        t0 = time.perf_counter()
+        result = fn()
+        phases[name] = round(time.perf_counter() - t0, 3)
+        print(f"⏱  {name}: {phases[name]:.2f}s")
+        return result
+
+    paths = {kind: os.path.join(data_dir, f"{kind}.parquet") for kind in ("coordinates", "metadata", "annotations")}
+    t_start = time.perf_counter()
+    try:
+        timed("ensure_schema", lambda: (ensure_schema(engine, schema), ensure_extensions(engine)))
+        if stream:
+            # Reading is interleaved with COPY, as with create_db.py --stream
+            budget = memory_budget * 1024 * 1024
+            sources = {
+                "coordinates": parquet_chunks(paths["coordinates"], budget),
+                "metadata": parquet_chunks(paths["metadata"], budget),
+                "annotations": annotation_chunks(paths["annotations"], budget, batch_cols),
+            }
+        else:
+            frames = timed("read_parquet", lambda: {kind: load_parquet(p) for kind, p in paths.items()})
+            sources = {kind: [df] for kind, df in frames.items()}
+
+        timed("build_coordinates", lambda: build_coordinates(engine, sources["coordinates"], schema, 50000,
+                                                             "replace", 4326))
+        timed("build_metadata", lambda: build_metadata(engine, sources["metadata"], schema, "replace"))
+        timed("build_annotations", lambda: build_annotations(engine, sources["annotations"], schema, batch_cols,
+                                                             jobs=jobs))
+        timed("index_coordinates", lambda: index_coordinates(engine, schema, jobs))
+        timed("index_metadata", lambda: index_metadata(engine, schema, jobs))
+        timed("index_annotations", lambda: index_annotations(engine, schema, jobs=jobs, covering=covering_index))
+        if covering_index:
+            timed("vacuum_annotations", lambda: vacuum_annotations(engine, schema))
+        if embeddings:
+            timed("build_embeddings", lambda: build_embeddings(engine, schema, embeddings))
+        timed("write_load_info", lambda: write_load_info(engine, schema))
+    finally:
+        engine.dispose()
+    phases["total"] = round(time.perf_counter() - t_start, 3)
+    return phases
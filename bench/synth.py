@@ -0,0 +1,158 @@
+"""
+Synthetic Neurosynth-shaped Parquet files.
+
+Same columns and types as the real drop (metadata.parquet in the repo root):
+- metadata.parquet: id, study_id, contrast_id, authors, journal, year, title
+- coordinates.parquet: id, study_id, contrast_id, x, y, z, space
+- annotations.parquet: id, study_id, contrast_id and one dense float column
+  terms_abstract_tfidf__<term> per term, 0 where the study does not use it
+
+Term document frequencies follow a Zipf-like curve; foci are integer MNI
+coordinates, partly clustered around the hotspots in HOTSPOTS (some exactly on
+them, so r = 0 lookups match). The ANCHOR_TERMS and HOTSPOTS always exist, so
+the benchmark requests hit data at any scale. Everything is derived from
+`seed`; files are written in row groups of `chunk` studies.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+SCALES = {
+    # studies, terms, mean foci per study
+    "tiny": (500, 200, 10),
+    "small": (2000, 500, 20),
+    "neurosynth": (14371, 3228, 35),
+    "large": (57484, 3228, 35),
+}
+
+ANCHOR_TERMS = ["default mode", "self referential", "posterior cingulate", "ventromedial prefrontal",
+                "working memory", "pain", "reward", "amygdala"]
+# (0, -52, 26) posterior cingulate, (-2, 50, -6) ventromedial prefrontal
+HOTSPOTS = [(0, -52, 26), (-2, 50, -6), (-40, 22, 30), (44, -60, -14), (22, -4, -18)]
+
+WORDS = ["action", "attention", "auditory", "cingulate", "cognitive", "control", "cortex", "decision", "emotion",
+         "encoding", "executive", "face", "fear", "frontal", "gyrus", "hippocampus", "inhibition", "insula",
+         "language", "learning", "motor", "network", "parietal", "perception", "prefrontal", "retrieval",
+         "semantic", "sensory", "social", "spatial", "striatum", "temporal", "thalamus", "visual", "word"]
+JOURNALS = ["NeuroImage", "Human brain mapping", "Cerebral cortex", "The Journal of neuroscience",
+            "Neuropsychologia", "Brain research", "Cortex", "Social cognitive and affective neuroscience"]
+BRAIN_MIN = np.array([-70, -104, -44])
+BRAIN_MAX = np.array([70, 70, 76])
+
+
+def term_vocabulary(n_terms: int) -> list:
+    """ANCHOR_TERMS, then single words, then two-word terms, up to n_terms."""
+    terms = list(ANCHOR_TERMS)
+    for w in WORDS:
+        if w not in terms:
+            terms.append(w)
+    for a in WORDS:
+        for b in WORDS:
+            if a != b:
+                terms.append(f"{a} {b}")
+    if n_terms > len(terms):
+        terms += [f"term {i}" for i in range(n_terms - len(terms))]
+    return terms[:max(n_terms, len(ANCHOR_TERMS))]
+
+
+def document_frequencies(n_terms: int, n_studies: int) -> np.ndarray:
+    """Fraction of studies using each term: Zipf-like, anchors at 5-15%."""
+    rank = np.arange(n_terms, dtype=float)
+    p = np.clip(0.3 / (rank + 1) ** 0.7, 5.0 / n_studies, 0.3)
+    p[:len(ANCHOR_TERMS)] = np.linspace(0.15, 0.05, len(ANCHOR_TERMS))
+    return p
+
+
+def study_ids(n: int, rng) -> np.ndarray:
+    """Unique PMID-like ids, in random order."""
+    ids = rng.choice(np.arange(1_000_000, 40_000_000), size=n, replace=False)
+    return ids.astype(str)
+
+
+def metadata_frame(sids: np.ndarray, rng) -> pd.DataFrame:
+    n = len(sids)
+    words = np.array(WORDS + ["default", "mode", "self", "referential", "processing", "task", "fMRI"])
+    titles = [" ".join(rng.choice(words, size=rng.integers(6, 14))).capitalize() + "." for _ in range(n)]
+    surnames = np.array(["Smith", "Wang", "Muller", "Garcia", "Kim", "Rossi", "Chen", "Dubois", "Sato", "Novak"])
+    authors = [", ".join(f"{s} {chr(65 + rng.integers(0, 26))}" for s in rng.choice(surnames, size=rng.integers(1, 7)))
+               for _ in range(n)]
+    return pd.DataFrame({
+        "id": [f"{s}-1" for s in sids],
+        "study_id": sids,
+        "contrast_id": ["1"] * n,
+        "authors": authors,
+        "journal": rng.choice(JOURNALS, size=n),
+        "year": rng.integers(1997, 2019, size=n).astype(np.int64),
+        "title": titles,
+    })
+
+
+def coordinates_frame(sids: np.ndarray, mean_foci: float, rng) -> pd.DataFrame:
+    counts = rng.poisson(max(mean_foci - 1, 0), size=len(sids)) + 1
+    owner = np.repeat(np.arange(len(sids)), counts)
+    n = len(owner)
+    xyz = rng.uniform(BRAIN_MIN, BRAIN_MAX, size=(n, 3))
+    # A fifth of the foci cluster around a hotspot, one in 20 of those exactly on it
+    near = rng.random(n) < 0.2
+    hot = np.array(HOTSPOTS, dtype=float)[rng.integers(0, len(HOTSPOTS), size=n)]
+    exact = near & (rng.random(n) < 0.05)
+    xyz[near] = hot[near] + rng.normal(0, 4, size=(near.sum(), 3))
+    xyz[exact] = hot[exact]
+    xyz = np.clip(np.rint(xyz), BRAIN_MIN, BRAIN_MAX).astype(float)
+    sid = sids[owner]
+    return pd.DataFrame({
+        "id": [f"{s}-1" for s in sid],
+        "study_id": sid,
+        "contrast_id": ["1"] * n,
+        "x": xyz[:, 0], "y": xyz[:, 1], "z": xyz[:, 2],
+        "space": ["MNI"] * n,
+    })
+
+
+def annotations_frame(sids: np.ndarray, columns: list, df: np.ndarray, rng) -> pd.DataFrame:
+    n = len(sids)
+    used = rng.random((n, len(columns))) < df
+    weights = np.where(used, rng.uniform(0.01, 0.4, size=used.shape), 0.0)
+    frame = pd.DataFrame(weights, columns=columns)
+    frame.insert(0, "contrast_id", ["1"] * n)
+    frame.insert(0, "study_id", sids)
+    frame.insert(0, "id", [f"{s}-1" for s in sids])
+    return frame
+
+
+def generate(out_dir: str, studies: int, terms: int, foci: float, seed: int = 0, chunk: int = 2000) -> dict:
+    """Write the three Parquet files into out_dir; returns a summary of what was written."""
+    os.makedirs(out_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    sids = study_ids(studies, rng)
+    vocab = term_vocabulary(terms)
+    columns = [f"terms_abstract_tfidf__{t}" for t in vocab]
+    df = document_frequencies(len(vocab), studies)
+
+    writers = {}
+    rows = {"metadata": 0, "coordinates": 0, "annotations": 0}
+    nonzero = 0
+    try:
+        for start in range(0, studies, chunk):
+            part = sids[start:start + chunk]
+            frames = {
+                "metadata": metadata_frame(part, rng),
+                "coordinates": coordinates_frame(part, foci, rng),
+                "annotations": annotations_frame(part, columns, df, rng),
+            }
+            nonzero += int((frames["annotations"][columns].to_numpy() > 0).sum())
+            for name, frame in frames.items():
+                table = pa.Table.from_pandas(frame, preserve_index=False)
+                if name not in writers:
+                    writers[name] = pq.ParquetWriter(os.path.join(out_dir, f"{name}.parquet"), table.schema)
+                writers[name].write_table(table)
+                rows[name] += len(frame)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return {"studies": studies, "terms": len(vocab), "mean_foci": foci, "seed": seed,
+            "rows": rows, "term_postings": nonzero}
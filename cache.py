@@ -0,0 +1,151 @@
+"""
+Response cache for the dissociation endpoints.
+
+Keys include the data generation written by create_db.py into ns.load_info,
+so a reload of the database makes every older entry unreachable; entries also
+expire after a TTL. The in-process backend is a byte-bounded LRU; RedisCache
+lets several gunicorn workers share hits.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import text
+
+
+def cache_key(*parts) -> str:
+    return hashlib.sha1(json.dumps(parts, separators=(",", ":"), default=str).encode()).hexdigest()
+
+
+def estimate_size(value) -> int:
+    """Approximate memory held by a cached value (its JSON size, or length for bytes, plus overhead)."""
+    if isinstance(value, (bytes, bytearray)):
+        return len(value) + 200
+    return len(json.dumps(value, separators=(",", ":"))) + 200
+
+
+class ResponseCache:
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, ttl: float = 300.0):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, size, value)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Return (found, value)."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    self._drop(key)
+                self.misses += 1
+                return False, None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return True, entry[2]
+
+    def set(self, key, value):
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+            self._data[key] = (time.monotonic() + self.ttl, size, value)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._data))
+                self._drop(oldest)
+                self.evictions += 1
+
+    def _drop(self, key):
+        _, size, _ = self._data.pop(key)
+        self._bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        return {
+            "backend": "memory",
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._data),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+        }
+
+
+class RedisCache:
+    """Same interface as ResponseCache, backed by Redis (requires the `redis` package)."""
+
+    def __init__(self, url: str, ttl: float = 300.0, prefix: str = "ns-dissociate:"):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CACHE_URL is set but the 'redis' package is not installed.")
+        self._redis = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        raw = self._redis.get(self.prefix + key)
+        if raw is None:
+            self.misses += 1
+            return False, None
+        self.hits += 1
+        return True, json.loads(raw)
+
+    def set(self, key, value):
+        self._redis.set(self.prefix + key, json.dumps(value, separators=(",", ":")), ex=max(1, int(self.ttl)))
+
+    def clear(self):
+        for key in self._redis.scan_iter(self.prefix + "*"):
+            self._redis.delete(key)
+
+    def stats(self) -> dict:
+        return {"backend": "redis", "hits": self.hits, "misses": self.misses, "ttl": self.ttl}
+
+
+class GenerationWatcher:
+    """Reads the current data generation from ns.load_info, at most once per `ttl` seconds."""
+
+    def __init__(self, engine_factory, ttl: float = 5.0, schema: str = "ns"):
+        self.engine_factory = engine_factory
+        self.ttl = ttl
+        self.schema = schema
+        self.generation = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def current(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.ttl:
+            return self.generation
+        with self._lock:
+            if now - self._checked_at >= self.ttl:
+                try:
+                    with self.engine_factory().connect() as conn:
+                        self.generation = conn.execute(text(f"""
+                            SELECT generation FROM {self.schema}.load_info
+                            ORDER BY loaded_at DESC LIMIT 1
+                        """)).scalar()
+                except Exception:
+                    # Keep the last known generation (None if never read) until the DB answers
+                    pass
+                self._checked_at = now
+        return self.generation
@@ -1,5 +1,8 @@
 import json
 import argparse
+import statistics
+import sys
+import time
 from urllib.parse import urlparse, parse_qsl, urlencode, urlunparse
 
 from sqlalchemy import create_engine, text
@@ -104,9 +107,142 @@ def check_postgis(conn, summary):
         "SELECT ST_AsText(ST_Buffer(ST_GeomFromText('POINT(0 0)', 4326), 1.0)) LIMIT 1;",
         "Geometry operations (ST_Buffer)", summary, "postgis.geometry_ops")
 
+def plan_nodes(plan):
+    """Yield every node of an EXPLAIN (FORMAT JSON) plan tree."""
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from plan_nodes(child)
+
+def check_plan(conn, sql, params, name, summary, key, index_names, table):
+    """
+    EXPLAIN a query and verify that `table` is only reached through one of
+    `index_names` (no Seq Scan on it).
+    """
+    try:
+        plan = conn.execute(text("EXPLAIN (FORMAT JSON) " + sql), params).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        nodes = list(plan_nodes(plan[0]["Plan"]))
+        used = sorted({n["Index Name"] for n in nodes if n.get("Index Name") in index_names})
+        seq = [n for n in nodes if n["Node Type"] == "Seq Scan" and n.get("Relation Name") == table]
+        ok = bool(used) and not seq
+        print(f"{'✅' if ok else '❌'} {name}: {'index scan' if ok else 'NOT using index'}")
+        print("   ↳ Indexes:", used or "-", "| seq scans on", table + ":", len(seq))
+        summary[key] = {"ok": ok, "indexes": used, "seq_scans": len(seq)}
+        return ok
+    except SQLAlchemyError as e:
+        print(f"❌ {name}: FAILED")
+        print(f"   ↳ Error: {e}")
+        summary[key] = {"ok": False, "error": str(e)}
+        try:
+            conn.exec_driver_sql("ROLLBACK")
+        except Exception:
+            pass
+        return False
+
+def check_plans(conn, summary, term_a, term_b, coords_a, coords_b, radius, search="default mode network"):
+    """
+    Verify the app's dissociation and search queries are served by indexes
+    (needs a loaded DB); returns the summary keys of the checks that failed.
+    """
+    from queries import (COORDS_BOTH_SQL, COORDS_MINUS_SQL, SEARCH_SQL, TERMS_BOTH_SQL, TERMS_MINUS_SQL, coord_params,
+                         parse_foci, search_query, term_params)
+
+    print("\n=== Check query plans (loaded ns schema) ===")
+    conn.execute(text("SET search_path TO ns, public;"))
+    failed = []
+
+    def check(*args):
+        if not check_plan(conn, *args):
+            failed.append(args[4])
+
+    params = term_params(term_a, term_b)
+    term_indexes = {"idx_annotations_terms_key_rev", "idx_annotations_terms_key_rev_weight"}
+    check(TERMS_MINUS_SQL, params, "terms A \\ B", summary,
+          "plans.terms_minus", term_indexes, "annotations_terms")
+    check(TERMS_BOTH_SQL, params, "terms both directions", summary,
+          "plans.terms_both", term_indexes, "annotations_terms")
+
+    params = coord_params(parse_foci(coords_a), parse_foci(coords_b), radius)
+    coord_indexes = {"idx_coordinates_geom_gist"}
+    check(COORDS_MINUS_SQL, params, f"locations A \\ B (r={radius:g})", summary,
+          "plans.coords_minus", coord_indexes, "coordinates")
+    check(COORDS_BOTH_SQL, params, f"locations both directions (r={radius:g})", summary,
+          "plans.coords_both", coord_indexes, "coordinates")
+
+    _, params = search_query(search)
+    check(SEARCH_SQL, params, f"full-text search ({search!r})", summary,
+          "plans.search", {"idx_metadata_fts"}, "metadata")
+    return failed
+
+def bench_query(conn, sql, params, name, summary, key, repeat):
+    """
+    Run a query once to warm the cache, then `repeat` times; print and record
+    min / median / p95 / max latency in ms and the row count.
+    """
+    try:
+        rows = len(conn.execute(text(sql), params).all())
+        times = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            conn.execute(text(sql), params).all()
+            times.append((time.perf_counter() - t0) * 1000)
+        times.sort()
+        result = {"ok": True, "rows": rows, "min_ms": round(times[0], 3),
+                  "p50_ms": round(statistics.median(times), 3),
+                  "p95_ms": round(times[min(len(times) - 1, int(0.95 * len(times)))], 3),
+                  "max_ms": round(times[-1], 3)}
+        print(f"✅ {name}: p50 {result['p50_ms']:.2f} ms, p95 {result['p95_ms']:.2f} ms ({rows} rows)")
+        summary[key] = result
+        return result
+    except SQLAlchemyError as e:
+        print(f"❌ {name}: FAILED")
+        print(f"   ↳ Error: {e}")
+        summary[key] = {"ok": False, "error": str(e)}
+        try:
+            conn.exec_driver_sql("ROLLBACK")
+        except Exception:
+            pass
+        return None
+
+def bench(conn, summary, term_a, term_b, coords_a, coords_b, radius, search="default mode network", repeat=20):
+    """Time the app's hot index lookups (needs a loaded DB); for validating a new database before cutover."""
+    from queries import PREPARED_STATEMENTS, STUDY_FOCI_SQL, minus_query, search_query, term_params
+
+    print(f"\n=== Benchmark index lookups (x{repeat}, after one warm-up run) ===")
+    conn.execute(text("SET search_path TO ns, public;"))
+    name, params = minus_query("terms", term_a, term_b)
+    bench_query(conn, PREPARED_STATEMENTS[name], params, "terms A \\ B", summary, "bench.terms_minus", repeat)
+    bench_query(conn, PREPARED_STATEMENTS["ns_terms_counts"], term_params(term_a, term_b), "term pair counts",
+                summary, "bench.terms_counts", repeat)
+    name, params = minus_query("locations", coords_a, coords_b, radius)
+    bench_query(conn, PREPARED_STATEMENTS[name], params, f"locations A \\ B (r={radius:g})", summary,
+                "bench.coords_minus", repeat)
+    name, params = search_query(search)
+    bench_query(conn, PREPARED_STATEMENTS[name], params, f"full-text search ({search!r})", summary,
+                "bench.search", repeat)
+    try:
+        ids = conn.execute(text("SELECT study_id FROM metadata ORDER BY study_id LIMIT 10")).scalars().all()
+    except SQLAlchemyError:
+        conn.exec_driver_sql("ROLLBACK")
+        ids = []
+    bench_query(conn, STUDY_FOCI_SQL, {"ids": ids}, f"foci of {len(ids)} studies by id", summary,
+                "bench.study_foci", repeat)
+
 def main():
     parser = argparse.ArgumentParser(description="PostgreSQL feature self-check (tsvector, pgvector, PostGIS)")
     parser.add_argument("--url", required=True, help="Postgres connection URL")
+    parser.add_argument("--plans", action="store_true",
+                        help="Also EXPLAIN the app's dissociation queries against the loaded ns schema")
+    parser.add_argument("--bench", action="store_true",
+                        help="Also time the app's index lookups against the loaded ns schema")
+    parser.add_argument("--bench-repeat", type=int, default=20, help="Timed runs per query for --bench")
+    parser.add_argument("--term-a", default="posterior_cingulate", help="Term A used by --plans/--bench")
+    parser.add_argument("--term-b", default="ventromedial_prefrontal", help="Term B used by --plans/--bench")
+    parser.add_argument("--coords-a", default="0_-52_26", help="Location A (x_y_z) used by --plans/--bench")
+    parser.add_argument("--coords-b", default="-2_50_-6", help="Location B (x_y_z) used by --plans/--bench")
+    parser.add_argument("--radius", type=float, default=6.0, help="Radius in mm used by --plans/--bench")
+    parser.add_argument("--search", default="default mode network", help="Full-text query used by --plans/--bench")
     args = parser.parse_args()
 
     db_url = ensure_sslmode_required(args.url)
@@ -124,8 +260,20 @@ def main():
         check_pgvector(conn, summary)
         check_postgis(conn, summary)
 
+        failed = []
+        if args.plans:
+            failed = check_plans(conn, summary, args.term_a, args.term_b,
+                        args.coords_a, args.coords_b, args.radius, args.search)
+
+        if args.bench:
+            bench(conn, summary, args.term_a, args.term_b, args.coords_a, args.coords_b, args.radius,
+                  args.search, max(1, args.bench_repeat))
+
     print("\n=== Summary (JSON) ===")
     print(json.dumps(summary, indent=2, default=str))
+    if failed:
+        print(f"\n❌ {len(failed)} plan check(s) failed: {', '.join(failed)}")
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,67 @@
+"""
+Response compression for the JSON / NDJSON endpoints and raw map volumes.
+
+gzip is always available; br is offered when the optional `brotli` package is
+installed. Buffered responses are compressed in one go (if at least
+`min_bytes`), streamed ones chunk by chunk as they are produced.
+"""
+
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "application/octet-stream")
+
+
+def available_encodings() -> list:
+    """Supported Content-Encodings in server preference order."""
+    return ["br", "gzip"] if brotli is not None else ["gzip"]
+
+
+def compress_bytes(data: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=5)
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_stream(chunks, encoding: str):
+    """Compress an iterable of bytes/str chunks incrementally."""
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=5)
+        process, finish = compressor.process, compressor.finish
+    else:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        process, finish = compressor.compress, compressor.flush
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        out = process(chunk)
+        if out:
+            yield out
+    yield finish()
+
+
+def compress_response(response, accept_encodings, min_bytes: int = 1024):
+    """Compress a Flask response in place if the client accepts a supported encoding."""
+    if (response.status_code != 200 or response.direct_passthrough
+            or "Content-Encoding" in response.headers
+            or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = accept_encodings.best_match(available_encodings())
+    if encoding is None:
+        return response
+    if response.is_streamed:
+        response.response = compress_stream(response.response, encoding)
+        response.headers.pop("Content-Length", None)
+    else:
+        data = response.get_data()
+        if len(data) < min_bytes:
+            return response
+        response.set_data(compress_bytes(data, encoding))
+    response.headers["Content-Encoding"] = encoding
+    return response
@@ -4,24 +4,47 @@
 """
 PostgreSQL loader (accelerated) with:
 - PostGIS POINTZ geometry (+ GIST) for coordinates
-- FTS (tsvector) + trigger (+ GIN) for metadata
-- Fast annotations_terms via NumPy + COPY
+- FTS (tsvector generated column) (+ GIN) for metadata
+- Fast annotations_terms via NumPy-encoded binary COPY (streamed)
 - Optional annotations_json aggregation (+ GIN) via --enable-json
+- Optional term vocabulary / co-occurrence counts via --cooccurrence
+- Optional covering (term_key_rev, study_id) INCLUDE (weight) index via --covering-index
+- Optional per-study term embeddings (pgvector + HNSW) for /studies/<id>/similar via --embeddings
+- Optional memory-mapped snapshot for app.py (SNAPSHOT_DIR) via --snapshot
 
 Default schema: ns
 """
 
 import argparse
+import itertools
 import os
 import io
+import queue
 import re
-from typing import List, Tuple
+import resource
+import struct
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, List
 
 import numpy as np
 import pandas as pd
+import pyarrow.parquet as pq
 from sqlalchemy import create_engine, text
 from sqlalchemy.engine import Engine
 
+from snapshot import write_snapshot
+from table_stats import TABLES
+from term_index import TermIndex, normalize_term
+
+try:
+    import scipy.sparse as sp
+except ImportError:  # dense blocked fallback in TermCooccurrence
+    sp = None
+
 
 # -----------------------------
 # Args
@@ -34,8 +57,35 @@ def parse_args():
     ap.add_argument("--if-exists", choices=["replace", "append"], default="replace", help="Behavior for coordinates/metadata")
     ap.add_argument("--batch-cols", type=int, default=150, help="terms_* columns to melt per batch (smaller uses less RAM)")
     ap.add_argument("--stage-chunksize", type=int, default=50000, help="pandas.to_sql() chunksize for staging loads")
+    ap.add_argument("--load-method", choices=["copy", "to_sql"], default="copy",
+                    help="coordinates/metadata: COPY with EWKB and generated fts (default), or the previous "
+                         "to_sql + INSERT/UPDATE path (kept for benchmarking)")
     ap.add_argument("--enable-json", action="store_true", help="Also build annotations_json (slow)")
     ap.add_argument("--srid", type=int, default=4326, help="SRID for geometry(POINTZ). Default 4326")
+    ap.add_argument("--stream", action="store_true",
+                    help="Read Parquet files in row chunks with column projection instead of loading them whole")
+    ap.add_argument("--memory-budget", type=int, default=512,
+                    help="With --stream: approximate MiB of decoded data held per table at a time (default 512)")
+    ap.add_argument("--incremental", action="store_true",
+                    help="Only delete/re-insert studies whose content fingerprint changed since the last load "
+                         "(tables and indexes are kept; the service can stay online)")
+    ap.add_argument("--cooccurrence", action="store_true",
+                    help="Also materialize term_vocab (per-term document frequency) and term_cooccurrence "
+                         "(studies per term pair) for the /counts endpoint")
+    ap.add_argument("--covering-index", action="store_true",
+                    help="Index annotations_terms on (term_key_rev, study_id) INCLUDE (weight) and VACUUM ANALYZE it, "
+                         "so ?threshold= term lookups are index-only scans")
+    ap.add_argument("--embeddings", type=int, default=0, metavar="DIM",
+                    help="Also store DIM-dimensional per-study embeddings (truncated SVD of the study x term "
+                         "weights) in study_embeddings, with an HNSW index when pgvector is available")
+    ap.add_argument("--snapshot", metavar="DIR",
+                    help="After loading, also write a versioned memory-mapped snapshot (study dictionary, CSR "
+                         "term->study matrix, float32 coordinates) under DIR and switch DIR/CURRENT to it")
+    ap.add_argument("--snapshot-cell", type=float, default=8.0,
+                    help="Voxel-grid cell (mm) the snapshot's coordinates are bucketed by; match SPATIAL_INDEX_CELL")
+    ap.add_argument("--jobs", type=int, default=1,
+                    help="Load the three tables concurrently and COPY annotation batches over N connections; "
+                         "indexes are built afterwards with max_parallel_maintenance_workers=N")
     return ap.parse_args()
 
 
@@ -48,6 +98,65 @@ def load_parquet(path: str) -> pd.DataFrame:
     return pd.read_parquet(path)
 
 
+def term_columns(columns) -> List[str]:
+    fixed = {"id", "study_id", "contrast_id"}
+    return [c for c in columns if c not in fixed and str(c).startswith("terms_")]
+
+
+def term_name(column) -> str:
+    """Term stored in annotations_terms for a terms_<source>__<term> column."""
+    return re.sub(r"^terms_.*?__", "", str(column)).strip().lower()
+
+
+def rows_per_chunk(pf: "pq.ParquetFile", columns: List[str], budget_bytes: int) -> int:
+    """
+    Rows per chunk so that one decoded chunk of `columns` stays within budget_bytes.
+    Uses the uncompressed column sizes in the Parquet footer, with headroom for
+    the pandas copy and per-object overhead of string columns.
+    """
+    meta = pf.metadata
+    wanted = set(columns)
+    size = 0
+    for rg in range(meta.num_row_groups):
+        group = meta.row_group(rg)
+        for ci in range(group.num_columns):
+            col = group.column(ci)
+            if col.path_in_schema in wanted:
+                size += col.total_uncompressed_size
+    per_row = max(1.0, size / max(1, meta.num_rows)) * 4
+    return max(1000, int(budget_bytes / per_row))
+
+
+def parquet_chunks(path: str, budget_bytes: int, columns: List[str] = None) -> Iterator[pd.DataFrame]:
+    """Stream a Parquet file as DataFrames of projected columns, bounded by budget_bytes each."""
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    pf = pq.ParquetFile(path)
+    batch_size = rows_per_chunk(pf, columns or pf.schema_arrow.names, budget_bytes)
+    for batch in pf.iter_batches(batch_size=batch_size, columns=columns):
+        yield batch.to_pandas()
+
+
+def annotation_chunks(path: str, budget_bytes: int, batch_cols: int) -> Iterator[pd.DataFrame]:
+    """
+    Stream the wide annotations file as (id columns + batch_cols term columns) x row
+    chunks, so memory depends on the budget and batch size, not on the vocabulary.
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+    names = pq.ParquetFile(path).schema_arrow.names
+    id_cols = [c for c in ("study_id", "contrast_id") if c in names]
+    terms = term_columns(names)
+    for i in range(0, len(terms), batch_cols):
+        yield from parquet_chunks(path, budget_bytes, id_cols + terms[i:i+batch_cols])
+
+
+def peak_rss_mib() -> float:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
 def ensure_schema(engine: Engine, schema: str):
     with engine.begin() as conn:
         conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {schema};"))
@@ -69,8 +178,7 @@ def is_finite_series(s: pd.Series) -> pd.Series:
 # -----------------------------
 # Coordinates (POINTZ + GIST)
 # -----------------------------
-def build_coordinates(engine: Engine, df: pd.DataFrame, schema: str, chunksize: int, if_exists: str, srid: int):
-    print("→ coordinates: preparing dataframe")
+def clean_coordinates(df: pd.DataFrame, verbose: bool = True) -> pd.DataFrame:
     must_have = ["study_id", "x", "y", "z"]
     missing = [c for c in must_have if c not in df.columns]
     if missing:
@@ -81,10 +189,80 @@ def build_coordinates(engine: Engine, df: pd.DataFrame, schema: str, chunksize:
         df[c] = pd.to_numeric(df[c], errors="coerce")
     finite_mask = is_finite_series(df["x"]) & is_finite_series(df["y"]) & is_finite_series(df["z"])
     bad = (~finite_mask).sum()
-    if bad:
+    if bad and verbose:
         print(f"   … dropping {bad:,} non-finite rows from coordinates")
-    df = df[finite_mask].reset_index(drop=True)
+    return df[finite_mask].reset_index(drop=True)
+
+
+EWKB_POINTZ = np.dtype([("order", "u1"), ("type", "<u4"), ("srid", "<u4"),
+                        ("x", "<f8"), ("y", "<f8"), ("z", "<f8")])
+HEX_BYTES = np.array([f"{i:02X}".encode() for i in range(256)], dtype="S2")
+
+
+def ewkb_pointz_hex(x: np.ndarray, y: np.ndarray, z: np.ndarray, srid: int) -> np.ndarray:
+    """Hex EWKB (little-endian POINT Z with SRID) for every row, built without a Python loop."""
+    rec = np.empty(len(x), dtype=EWKB_POINTZ)
+    rec["order"] = 1
+    rec["type"] = 0x80000000 | 0x20000000 | 1  # Z flag | SRID flag | Point
+    rec["srid"] = srid
+    rec["x"], rec["y"], rec["z"] = x, y, z
+    raw = rec.view(np.uint8).reshape(len(x), EWKB_POINTZ.itemsize)
+    return HEX_BYTES[raw].view(f"S{2 * EWKB_POINTZ.itemsize}").ravel().astype(str)
+
+
+def copy_csv(cur, table: str, columns: List[str], df: pd.DataFrame):
+    """COPY a DataFrame (columns in the given order) as CSV; missing values become NULL."""
+    buf = io.StringIO()
+    df.to_csv(buf, columns=columns, header=False, index=False, na_rep="\\N")
+    buf.seek(0)
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buf)
+
+
+def build_coordinates(engine: Engine, chunks: Iterable[pd.DataFrame], schema: str, chunksize: int, if_exists: str,
+                      srid: int, load_method: str = "copy"):
+    if load_method == "to_sql":
+        return build_coordinates_staged(engine, chunks, schema, chunksize, if_exists, srid)
 
+    print("→ coordinates: creating table")
+    with engine.begin() as conn:
+        if if_exists == "replace":
+            conn.execute(text(f"DROP TABLE IF EXISTS {schema}.coordinates CASCADE;"))
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {schema}.coordinates (
+                study_id TEXT NOT NULL,
+                geom geometry(POINTZ, {srid}) NOT NULL
+            );
+        """))
+
+    print("→ coordinates: loading (COPY, EWKB)")
+    raw = engine.raw_connection()
+    try:
+        with raw.cursor() as cur:
+            total = copy_coordinates(cur, schema, chunks, srid)
+        raw.commit()
+    finally:
+        raw.close()
+    print(f"→ coordinates (POINTZ) loaded: {total:,} rows.")
+
+
+def copy_coordinates(cur, schema: str, chunks: Iterable[pd.DataFrame], srid: int) -> int:
+    """COPY cleaned coordinate chunks; geometry arrives as hex EWKB, so rows land in one pass."""
+    total = 0
+    for df in chunks:
+        df = clean_coordinates(df)
+        out = pd.DataFrame({
+            "study_id": df["study_id"],
+            "geom": ewkb_pointz_hex(df["x"].to_numpy(float), df["y"].to_numpy(float), df["z"].to_numpy(float), srid),
+        })
+        copy_csv(cur, f"{schema}.coordinates", ["study_id", "geom"], out)
+        total += len(out)
+    return total
+
+
+def build_coordinates_staged(engine: Engine, chunks: Iterable[pd.DataFrame], schema: str, chunksize: int,
+                             if_exists: str, srid: int):
+    """Previous path (--load-method to_sql): to_sql into a staging table, then INSERT ... SELECT."""
+    print("→ coordinates: preparing staging table")
     with engine.begin() as conn:
         if if_exists == "replace":
             conn.execute(text(f"DROP TABLE IF EXISTS {schema}.coordinates CASCADE;"))
@@ -99,8 +277,10 @@ def build_coordinates(engine: Engine, df: pd.DataFrame, schema: str, chunksize:
         """))
 
     print("→ coordinates: loading staging (to_sql)")
-    df.to_sql("coordinates_stage", engine, schema=schema, if_exists="append", index=False,
-              chunksize=chunksize, method="multi")
+    for df in chunks:
+        df = clean_coordinates(df)
+        df.to_sql("coordinates_stage", engine, schema=schema, if_exists="append", index=False,
+                  chunksize=chunksize, method="multi")
 
     with engine.begin() as conn:
         conn.execute(text(f"""
@@ -118,21 +298,92 @@ def build_coordinates(engine: Engine, df: pd.DataFrame, schema: str, chunksize:
                    ST_SetSRID(ST_MakePoint(x, y, z), {srid})::geometry(POINTZ, {srid})
             FROM {schema}.coordinates_stage;
         """))
-        print("→ coordinates: indexing & analyze")
+        conn.execute(text(f"DROP TABLE IF EXISTS {schema}.coordinates_stage;"))
+    print("→ coordinates (POINTZ) loaded.")
+
+
+def set_maintenance_parallelism(conn, jobs: int):
+    """With --jobs N, let CREATE INDEX (btree) use up to N parallel workers in this transaction."""
+    if jobs > 1:
+        conn.execute(text(f"SET LOCAL max_parallel_maintenance_workers = {int(jobs)};"))
+
+
+def index_coordinates(engine: Engine, schema: str, jobs: int = 1):
+    print("→ coordinates: indexing & analyze")
+    with engine.begin() as conn:
+        set_maintenance_parallelism(conn, jobs)
         conn.execute(text(f"CREATE INDEX IF NOT EXISTS idx_coordinates_study ON {schema}.coordinates (study_id);"))
-        conn.execute(text(f"CREATE INDEX IF NOT EXISTS idx_coordinates_geom_gist ON {schema}.coordinates USING GIST (geom);"))
+        # N-D opclass so 3D box tests (&&&, ST_3DDWithin) can use the index
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS idx_coordinates_geom_gist ON {schema}.coordinates USING GIST (geom gist_geometry_ops_nd);"))
         conn.execute(text(f"ANALYZE {schema}.coordinates;"))
-        conn.execute(text(f"DROP TABLE IF EXISTS {schema}.coordinates_stage;"))
     print("→ coordinates (POINTZ + GIST) done.")
 
 
 # -----------------------------
-# Metadata (FTS tsvector + trigger + GIN)
+# Metadata (FTS tsvector generated column + GIN)
 # -----------------------------
-def build_metadata(engine: Engine, df: pd.DataFrame, schema: str, if_exists: str):
-    print("→ metadata: preparing & creating table")
+def normalize_metadata_columns(df: pd.DataFrame) -> pd.DataFrame:
     df = df.copy()
     df.columns = [str(c).strip().lower().replace(" ", "_") for c in df.columns]
+    return df
+
+
+def metadata_table_ddl(df: pd.DataFrame, schema: str) -> str:
+    """CREATE TABLE for metadata with fts as a generated column over the text columns."""
+    cols, text_cols = [], []
+    for c in df.columns:
+        if pd.api.types.is_numeric_dtype(df[c]):
+            cols.append(f"{c} DOUBLE PRECISION")
+        else:
+            cols.append(f"{c} TEXT")
+            text_cols.append(c)
+    if text_cols:
+        cols_expr = " || ' ' || ".join([f"coalesce({c},'')" for c in text_cols])
+        cols.append(f"fts tsvector GENERATED ALWAYS AS (to_tsvector('pg_catalog.english', {cols_expr})) STORED")
+    else:
+        cols.append("fts tsvector")
+    return f"CREATE TABLE IF NOT EXISTS {schema}.metadata ({', '.join(cols)});"
+
+
+def build_metadata(engine: Engine, chunks: Iterable[pd.DataFrame], schema: str, if_exists: str,
+                   load_method: str = "copy"):
+    if load_method == "to_sql":
+        return build_metadata_staged(engine, chunks, schema, if_exists)
+
+    print("→ metadata: preparing & creating table")
+    chunks = iter(chunks)
+    first = normalize_metadata_columns(next(chunks))
+    with engine.begin() as conn:
+        if if_exists == "replace":
+            conn.execute(text(f"DROP TABLE IF EXISTS {schema}.metadata CASCADE;"))
+        conn.execute(text(metadata_table_ddl(first, schema)))
+
+    # fts is computed by the generated column as rows are copied in (no UPDATE pass)
+    print("→ metadata: loading (COPY, fts generated on insert)")
+    raw = engine.raw_connection()
+    try:
+        with raw.cursor() as cur:
+            total = copy_metadata(cur, schema, itertools.chain([first], chunks))
+        raw.commit()
+    finally:
+        raw.close()
+    print(f"→ metadata (FTS generated column) loaded: {total:,} rows.")
+
+
+def copy_metadata(cur, schema: str, chunks: Iterable[pd.DataFrame]) -> int:
+    total = 0
+    for df in chunks:
+        df = normalize_metadata_columns(df)
+        copy_csv(cur, f"{schema}.metadata", list(df.columns), df)
+        total += len(df)
+    return total
+
+
+def build_metadata_staged(engine: Engine, chunks: Iterable[pd.DataFrame], schema: str, if_exists: str):
+    """Previous path (--load-method to_sql): to_sql, then UPDATE fts and add a trigger."""
+    print("→ metadata: preparing & creating table")
+    chunks = iter(chunks)
+    df = normalize_metadata_columns(next(chunks))
 
     with engine.begin() as conn:
         if if_exists == "replace":
@@ -147,7 +398,11 @@ def build_metadata(engine: Engine, df: pd.DataFrame, schema: str, if_exists: str
         conn.execute(text(f"CREATE TABLE IF NOT EXISTS {schema}.metadata ({', '.join(cols)});"))
 
     print("→ metadata: bulk inserting (to_sql)")
-    df.to_sql("metadata", engine, schema=schema, if_exists="append", index=False, chunksize=20000, method="multi")
+    while df is not None:
+        df.to_sql("metadata", engine, schema=schema, if_exists="append", index=False, chunksize=20000, method="multi")
+        df = next(chunks, None)
+        if df is not None:
+            df = normalize_metadata_columns(df)
 
     with engine.begin() as conn:
         res = conn.execute(text(f"""
@@ -159,8 +414,7 @@ def build_metadata(engine: Engine, df: pd.DataFrame, schema: str, if_exists: str
             cols_expr = " || ' ' || ".join([f"coalesce({c},'')" for c in text_cols])
             print("→ metadata: computing tsvector over text columns")
             conn.execute(text(f"UPDATE {schema}.metadata SET fts = to_tsvector('pg_catalog.english', {cols_expr});"))
-            print("→ metadata: creating GIN index & trigger")
-            conn.execute(text(f"CREATE INDEX IF NOT EXISTS idx_metadata_fts ON {schema}.metadata USING GIN (fts);"))
+            print("→ metadata: creating trigger")
             conn.execute(text(f"DROP TRIGGER IF EXISTS metadata_fts_update ON {schema}.metadata;"))
             conn.execute(text(f"""
                 CREATE TRIGGER metadata_fts_update
@@ -169,39 +423,197 @@ def build_metadata(engine: Engine, df: pd.DataFrame, schema: str, if_exists: str
                     'fts', 'pg_catalog.english', {", ".join(text_cols)}
                 );
             """))
-            conn.execute(text(f"ANALYZE {schema}.metadata;"))
-    print("→ metadata (FTS + trigger) done.")
+    print("→ metadata (FTS + trigger) loaded.")
+
+
+def index_metadata(engine: Engine, schema: str, jobs: int = 1):
+    print("→ metadata: creating GIN index & analyze")
+    with engine.begin() as conn:
+        set_maintenance_parallelism(conn, jobs)
+        has_fts = conn.execute(text("""
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = :schema AND table_name = 'metadata' AND column_name = 'fts';
+        """), {"schema": schema}).first()
+        if has_fts:
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS idx_metadata_fts ON {schema}.metadata USING GIN (fts);"))
+        conn.execute(text(f"ANALYZE {schema}.metadata;"))
+    print("→ metadata (FTS + GIN) done.")
 
 
 # -----------------------------
 # Annotations -> sparse terms via NumPy + COPY (+ optional JSONB)
 # -----------------------------
-def copy_terms(engine: Engine, schema: str, rows: List[Tuple[str, str, str, float]]):
-    buf = io.StringIO()
-    for study_id, contrast_id, term, weight in rows:
-        # COPY text format uses \N for NULL
-        cval = r'\N' if contrast_id is None else str(contrast_id)
-        buf.write(f"{study_id}\t{cval}\t{term}\t{weight}\n")
-    buf.seek(0)
-    raw = engine.raw_connection()
-    try:
-        with raw.cursor() as cur:
-            cur.execute("SET LOCAL synchronous_commit = off;")
-            cur.copy_expert(
-                f"COPY {schema}.annotations_terms (study_id, contrast_id, term, weight) FROM STDIN WITH (FORMAT text)",
-                buf,
-            )
-        raw.commit()
-    finally:
-        raw.close()
+PGCOPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+PGCOPY_TRAILER = struct.pack("!h", -1)
+
+
+def pg_binary_field(value) -> bytes:
+    """One field of a binary COPY tuple: int32 length + UTF-8 bytes (length -1 = NULL)."""
+    if value is None:
+        return struct.pack("!i", -1)
+    data = str(value).encode("utf-8")
+    return struct.pack("!i", len(data)) + data
+
+
+class TermRowEncoder:
+    """
+    Encodes annotations_terms rows (study_id, contrast_id, term, weight) as
+    binary COPY tuples straight from NumPy arrays.
+
+    The (field count, study_id, contrast_id) prefix of every annotations row is
+    encoded once. Rows are grouped by prefix length, so for one term column the
+    tuples of each group form a fixed-width uint8 matrix filled by slicing:
+    [prefix | term field | int32 8 | float8 big-endian weight].
+    """
+
+    def __init__(self, sid_arr: np.ndarray, cid_arr: np.ndarray):
+        prefixes = [struct.pack("!h", 4) + pg_binary_field(s) + pg_binary_field(c) for s, c in zip(sid_arr, cid_arr)]
+        self.plen = np.fromiter((len(p) for p in prefixes), dtype=np.int64, count=len(prefixes))
+        self.groups = []
+        for length in np.unique(self.plen):
+            rows = np.nonzero(self.plen == length)[0]
+            mat = np.frombuffer(b"".join(prefixes[r] for r in rows), dtype=np.uint8).reshape(len(rows), length)
+            pos = np.full(len(prefixes), -1, dtype=np.int64)
+            pos[rows] = np.arange(len(rows))
+            self.groups.append((int(length), mat, pos))
+
+    def encode(self, idx: np.ndarray, term: str, weights: np.ndarray) -> List[bytes]:
+        """Tuples for rows `idx` of one term column (weights aligned with idx)."""
+        tail = np.frombuffer(pg_binary_field(term) + struct.pack("!i", 8), dtype=np.uint8)
+        wbytes = np.ascontiguousarray(weights, dtype=">f8").view(np.uint8).reshape(-1, 8)
+        out = []
+        for length, mat, pos in self.groups:
+            sel = self.plen[idx] == length if len(self.groups) > 1 else slice(None)
+            rows = idx[sel]
+            if not len(rows):
+                continue
+            rec = np.empty((len(rows), length + len(tail) + 8), dtype=np.uint8)
+            rec[:, :length] = mat[pos[rows]]
+            rec[:, length:length + len(tail)] = tail
+            rec[:, length + len(tail):] = wbytes[sel]
+            out.append(rec.tobytes())
+        return out
+
+
+def encode_term_batches(df: pd.DataFrame, term_cols: List[str], batch_cols: int):
+    """
+    Yield (payload, rows, seconds) per batch of term columns; payload is a complete
+    binary COPY stream (header, tuples, trailer) for annotations_terms.
+    """
+    sid_arr = df["study_id"].astype(str).to_numpy(copy=False)
+    cid_series = df["contrast_id"] if "contrast_id" in df.columns else pd.Series([None]*len(df))
+    cid_arr = cid_series.astype(object).where(pd.notna(cid_series), None).to_numpy(copy=False)
+    encoder = TermRowEncoder(sid_arr, cid_arr)
+
+    for i in range(0, len(term_cols), batch_cols):
+        t0 = time.perf_counter()
+        parts = [PGCOPY_HEADER]
+        n_rows = 0
+        for c in term_cols[i:i+batch_cols]:
+            col = pd.to_numeric(df[c], errors="coerce").to_numpy(dtype=float)
+            mask = np.isfinite(col) & (col > 0)
+            if not mask.any():
+                continue
+            idx = np.nonzero(mask)[0]
+            term = term_name(c)
+            parts.extend(encoder.encode(idx, term, col[idx]))
+            n_rows += len(idx)
+        if n_rows:
+            parts.append(PGCOPY_TRAILER)
+            yield b"".join(parts), n_rows, time.perf_counter() - t0
+
+
+def copy_term_batches(cur, schema: str, batches) -> int:
+    """COPY encoded batches on an existing cursor, inside the caller's transaction."""
+    total = 0
+    sql = f"COPY {schema}.annotations_terms (study_id, contrast_id, term, weight) FROM STDIN WITH (FORMAT binary)"
+    for payload, n_rows, _ in batches:
+        cur.copy_expert(sql, io.BytesIO(payload))
+        total += n_rows
+    return total
+
+
+def copy_terms_stream(engine: Engine, schema: str, batches, consumers: int = 1) -> int:
+    """
+    Load encoded batches with `consumers` COPY threads, each on its own reused
+    connection. Encoding runs in a producer thread so it overlaps with COPY; at
+    most `consumers + 1` batches wait in the queue.
+    """
+    q: "queue.Queue" = queue.Queue(maxsize=consumers + 1)
+    done = object()
+    stop = threading.Event()
+    lock = threading.Lock()
+    total = 0
+    errors = []
+
+    def produce():
+        try:
+            for item in batches:
+                if stop.is_set():
+                    break
+                q.put(item)
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            for _ in range(consumers):
+                q.put(done)
 
+    def consume():
+        nonlocal total
+        raw = None
+        try:
+            # Connecting inside the try: a failed connect must still stop and drain
+            raw = engine.raw_connection()
+            with raw.cursor() as cur:
+                cur.execute("SET synchronous_commit = off;")
+                sql = f"COPY {schema}.annotations_terms (study_id, contrast_id, term, weight) FROM STDIN WITH (FORMAT binary)"
+                while True:
+                    item = q.get()
+                    if item is done:
+                        break
+                    if stop.is_set():
+                        continue
+                    payload, n_rows, encode_s = item
+                    t0 = time.perf_counter()
+                    cur.copy_expert(sql, io.BytesIO(payload))
+                    raw.commit()
+                    copy_s = time.perf_counter() - t0
+                    with lock:
+                        total += n_rows
+                        print(f"   … copied {n_rows:,} rows in {copy_s:.2f}s ({n_rows / max(copy_s, 1e-9):,.0f} rows/s; "
+                              f"encode {encode_s:.2f}s) cumulative {total:,}")
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+            # Keep draining so the producer never blocks on a full queue
+            while q.get() is not done:
+                pass
+        finally:
+            if raw is not None:
+                raw.close()
 
-def build_annotations(engine: Engine, df: pd.DataFrame, schema: str, batch_cols: int, enable_json: bool = False):
+    threads = [threading.Thread(target=produce, name="annotations-encoder", daemon=True)]
+    threads += [threading.Thread(target=consume, name=f"annotations-copy-{i}", daemon=True) for i in range(consumers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    if errors:
+        raise errors[0]
+    return total
+
+
+TERM_KEY_EXPR = "regexp_replace(lower(term), '[^a-z0-9]+', '_', 'g')"
+
+
+def build_annotations(engine: Engine, chunks: Iterable[pd.DataFrame], schema: str, batch_cols: int,
+                      enable_json: bool = False, jobs: int = 1):
     print("→ annotations: preparing")
-    fixed = {"id", "study_id", "contrast_id"}
-    term_cols = [c for c in df.columns if c not in fixed and str(c).startswith("terms_")]
-    if not term_cols:
+    chunks = iter(chunks)
+    first = next(chunks, None)
+    if first is None or not term_columns(first.columns):
         raise RuntimeError("No term columns found in annotations.*")
+    chunks = itertools.chain([first], chunks)
 
     with engine.begin() as conn:
         conn.execute(text(f"DROP TABLE IF EXISTS {schema}.annotations_terms CASCADE;"))
@@ -210,7 +622,11 @@ def build_annotations(engine: Engine, df: pd.DataFrame, schema: str, batch_cols:
                 study_id    TEXT NOT NULL,
                 contrast_id TEXT,
                 term        TEXT NOT NULL,
-                weight      DOUBLE PRECISION NOT NULL
+                weight      DOUBLE PRECISION NOT NULL,
+                -- canonical key (see term_index.normalize_term) and its reverse, so
+                -- suffix matches become btree range scans instead of '%term' ILIKE
+                term_key    TEXT GENERATED ALWAYS AS ({TERM_KEY_EXPR}) STORED,
+                term_key_rev TEXT COLLATE "C" GENERATED ALWAYS AS (reverse({TERM_KEY_EXPR})) STORED
             );
         """))
         if enable_json:
@@ -224,43 +640,27 @@ def build_annotations(engine: Engine, df: pd.DataFrame, schema: str, batch_cols:
                 );
             """))
 
-    id_vars = ["study_id", "contrast_id"]
-    total_inserted = 0
-
-    # Pre-extract ID arrays once
-    sid_arr = df["study_id"].astype(str).to_numpy(copy=False)
-    cid_series = df["contrast_id"] if "contrast_id" in df.columns else pd.Series([None]*len(df))
-    cid_arr = cid_series.where(pd.notna(cid_series), None).astype(object).to_numpy(copy=False)
+    # Stream binary COPY batches built from the NumPy column arrays; with --jobs the
+    # term-column batches are spread over `jobs` COPY connections
+    batches = (batch for df in chunks for batch in encode_term_batches(df, term_columns(df.columns), batch_cols))
+    total_inserted = copy_terms_stream(engine, schema, batches, consumers=jobs)
 
-    for i in range(0, len(term_cols), batch_cols):
-        cols = term_cols[i:i+batch_cols]
-
-        # Filter out columns that are entirely null or <= 0 to avoid useless processing
-        nonempty = [c for c in cols if (pd.to_numeric(df[c], errors="coerce") > 0).any()]
-        if not nonempty:
-            continue
-
-        # Build rows with NumPy (avoid huge melted DataFrame)
-        term_rows: List[Tuple[str, str, str, float]] = []
-        for c in nonempty:
-            col = pd.to_numeric(df[c], errors="coerce").to_numpy(copy=False)
-            mask = np.isfinite(col) & (col > 0)
-            if not mask.any():
-                continue
-            idx = np.nonzero(mask)[0]
-            term = re.sub(r"^terms_[^_]*__", "", str(c)).strip().lower()
-            term_rows.extend(zip(sid_arr[idx], cid_arr[idx], [term]*len(idx), col[idx].astype(float)))
+    print(f"→ annotations_terms total inserted: {total_inserted:,}")
 
-        if term_rows:
-            copy_terms(engine, schema, term_rows)
-            total_inserted += len(term_rows)
-            print(f"   … copied {len(term_rows):,} rows (cumulative {total_inserted:,})")
 
+def index_annotations(engine: Engine, schema: str, enable_json: bool = False, jobs: int = 1, covering: bool = False):
     # Indexes AFTER bulk load (faster)
+    print("→ annotations: indexing & analyze")
     with engine.begin() as conn:
+        set_maintenance_parallelism(conn, jobs)
         conn.execute(text(f"CREATE INDEX IF NOT EXISTS idx_annotations_terms_term ON {schema}.annotations_terms (term);"))
         conn.execute(text(f"CREATE INDEX IF NOT EXISTS idx_annotations_terms_study ON {schema}.annotations_terms (study_id);"))
         conn.execute(text(f"CREATE INDEX IF NOT EXISTS idx_annotations_terms_term_study ON {schema}.annotations_terms (term, study_id);"))
+        if covering:
+            # Same key as idx_annotations_terms_key_rev, plus the weight for ?threshold= filters
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS idx_annotations_terms_key_rev_weight ON {schema}.annotations_terms (term_key_rev, study_id) INCLUDE (weight);"))
+        else:
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS idx_annotations_terms_key_rev ON {schema}.annotations_terms (term_key_rev, study_id);"))
         conn.execute(text(f"ANALYZE {schema}.annotations_terms;"))
         # Build PK/unique AFTER load to avoid per-row maintenance
         conn.execute(text(f"CREATE UNIQUE INDEX IF NOT EXISTS ux_annotations_terms ON {schema}.annotations_terms (study_id, contrast_id, term);"))
@@ -281,18 +681,493 @@ def build_annotations(engine: Engine, df: pd.DataFrame, schema: str, batch_cols:
             conn.execute(text(f"CREATE INDEX IF NOT EXISTS idx_annotations_json_terms_gin ON {schema}.annotations_json USING GIN (terms);"))
             conn.execute(text(f"ANALYZE {schema}.annotations_json;"))
 
-    print(f"→ annotations_terms total inserted: {total_inserted:,}")
     if enable_json:
         print("   … annotations_json populated and indexed.")
     print("   … annotations done.")
 
 
+def vacuum_annotations(engine: Engine, schema: str):
+    """VACUUM ANALYZE annotations_terms: sets the visibility map index-only scans rely on (outside a transaction)."""
+    print("→ annotations_terms: vacuum analyze")
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(f"VACUUM (ANALYZE) {schema}.annotations_terms;"))
+
+
+def has_covering_index(engine: Engine, schema: str) -> bool:
+    with engine.begin() as conn:
+        return conn.execute(text("SELECT to_regclass(:t)"),
+                            {"t": f"{schema}.idx_annotations_terms_key_rev_weight"}).scalar() is not None
+
+
+# -----------------------------
+# Term vocabulary & co-occurrence (--cooccurrence)
+# -----------------------------
+class TermCooccurrence:
+    """
+    Per-term document frequency and term x term co-occurrence (studies mentioning
+    both), over canonical term keys. (study, term) presence pairs are collected as the
+    annotation chunks stream past; the study x term 0/1 matrix X then gives all pair
+    counts as X.T @ X (scipy.sparse, or dense blocks of studies without SciPy).
+    """
+
+    def __init__(self):
+        self.keys = {}  # term key -> term id
+        self._sids = []
+        self._tids = []
+
+    def add(self, df: pd.DataFrame):
+        sid_arr = df["study_id"].astype(str).to_numpy()
+        for c in term_columns(df.columns):
+            col = pd.to_numeric(df[c], errors="coerce").to_numpy(dtype=float)
+            idx = np.nonzero(np.isfinite(col) & (col > 0))[0]
+            if not len(idx):
+                continue
+            tid = self.keys.setdefault(normalize_term(term_name(c)), len(self.keys))
+            self._sids.append(sid_arr[idx])
+            self._tids.append(np.full(len(idx), tid, dtype=np.int32))
+
+    def add_pairs(self, study_ids, term_keys):
+        """Add (study_id, term_key) rows, e.g. read back from annotations_terms."""
+        tids = np.array([self.keys.setdefault(k, len(self.keys)) for k in term_keys], dtype=np.int32)
+        self._sids.append(np.asarray(study_ids, dtype=object).astype(str))
+        self._tids.append(tids)
+
+    def tap(self, chunks: Iterable[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+        """Pass chunks through unchanged while collecting term presence."""
+        for df in chunks:
+            self.add(df)
+            yield df
+
+    def result(self, block: int = 2048):
+        """(vocab, pairs): vocab[term_id, term_key, df]; pairs[term_a, term_b, n] with term_a < term_b, n > 0."""
+        n_terms = len(self.keys)
+        vocab = pd.DataFrame({"term_id": np.arange(n_terms, dtype=np.int32), "term_key": list(self.keys)})
+        if not self._sids:
+            vocab["df"] = 0
+            return vocab, pd.DataFrame({"term_a": [], "term_b": [], "n": []}, dtype=np.int32)
+
+        _, s = np.unique(np.concatenate(self._sids), return_inverse=True)
+        t = np.concatenate(self._tids).astype(np.int64)
+        # One entry per (study, term), however many contrasts mention it
+        cells = np.unique(s.astype(np.int64) * n_terms + t)
+        s, t = cells // n_terms, cells % n_terms
+        n_studies = int(s.max()) + 1
+
+        if sp is not None:
+            x = sp.csr_matrix((np.ones(len(cells), dtype=np.int32), (s, t)), shape=(n_studies, n_terms))
+            c = (x.T @ x).tocoo()
+            rows, cols, n = c.row, c.col, c.data
+            df_counts = np.zeros(n_terms, dtype=np.int64)
+            diag = rows == cols
+            df_counts[rows[diag]] = n[diag]
+        else:
+            c = np.zeros((n_terms, n_terms), dtype=np.float32)  # exact for counts < 2**24
+            for lo in range(0, n_studies, block):
+                sel = (s >= lo) & (s < lo + block)
+                xb = np.zeros((block, n_terms), dtype=np.float32)
+                xb[s[sel] - lo, t[sel]] = 1.0
+                c += xb.T @ xb
+            df_counts = np.diag(c).astype(np.int64)
+            rows, cols = np.nonzero(c)
+            n = c[rows, cols]
+
+        upper = rows < cols
+        vocab["df"] = df_counts.astype(np.int32)
+        pairs = pd.DataFrame({"term_a": rows[upper].astype(np.int32), "term_b": cols[upper].astype(np.int32),
+                              "n": np.asarray(n[upper]).astype(np.int32)})
+        return vocab, pairs
+
+
+def store_cooccurrence(cur, schema: str, cooc: TermCooccurrence):
+    """(Re)create term_vocab and term_cooccurrence from the collected presence pairs."""
+    vocab, pairs = cooc.result()
+    cur.execute(f"DROP TABLE IF EXISTS {schema}.term_cooccurrence;")
+    cur.execute(f"DROP TABLE IF EXISTS {schema}.term_vocab;")
+    cur.execute(f"""
+        CREATE TABLE {schema}.term_vocab (
+            term_id      INTEGER NOT NULL,
+            term_key     TEXT NOT NULL,
+            term_key_rev TEXT COLLATE "C" GENERATED ALWAYS AS (reverse(term_key)) STORED,
+            df           INTEGER NOT NULL
+        );
+    """)
+    cur.execute(f"""
+        CREATE TABLE {schema}.term_cooccurrence (
+            term_a INTEGER NOT NULL,  -- term_a < term_b; the diagonal is term_vocab.df
+            term_b INTEGER NOT NULL,
+            n      INTEGER NOT NULL
+        );
+    """)
+    copy_csv(cur, f"{schema}.term_vocab", ["term_id", "term_key", "df"], vocab)
+    copy_csv(cur, f"{schema}.term_cooccurrence", ["term_a", "term_b", "n"], pairs)
+    cur.execute(f"ALTER TABLE {schema}.term_vocab ADD PRIMARY KEY (term_id);")
+    cur.execute(f"CREATE UNIQUE INDEX idx_term_vocab_key_rev ON {schema}.term_vocab (term_key_rev) INCLUDE (term_id, df);")
+    cur.execute(f"ALTER TABLE {schema}.term_cooccurrence ADD PRIMARY KEY (term_a, term_b);")
+    cur.execute(f"ANALYZE {schema}.term_vocab;")
+    cur.execute(f"ANALYZE {schema}.term_cooccurrence;")
+    print(f"→ term_vocab: {len(vocab):,} terms; term_cooccurrence: {len(pairs):,} pairs")
+
+
+# -----------------------------
+# Study embeddings (--embeddings)
+# -----------------------------
+def study_term_matrix(terms: TermIndex):
+    """Study x term weight matrix (scipy CSR, or dense float32 without SciPy), rows L2-normalized."""
+    n_studies, n_terms = len(terms.study_ids), len(terms.terms)
+    rows = np.asarray(terms.indices, dtype=np.int64)
+    cols = np.repeat(np.arange(n_terms), np.diff(terms.indptr))
+    weights = np.asarray(terms.weights, dtype=np.float32)
+    if sp is not None:
+        x = sp.csr_matrix((weights, (rows, cols)), shape=(n_studies, n_terms), dtype=np.float32)
+        norms = np.sqrt(np.asarray(x.multiply(x).sum(axis=1)).ravel())
+        return sp.diags(1.0 / np.maximum(norms, 1e-12)).astype(np.float32) @ x
+    x = np.zeros((n_studies, n_terms), dtype=np.float32)
+    x[rows, cols] = weights
+    x /= np.maximum(np.linalg.norm(x, axis=1, keepdims=True), 1e-12)
+    return x
+
+
+def truncated_svd(x, dim: int, n_iter: int = 4, seed: int = 0) -> np.ndarray:
+    """
+    Rank-`dim` study embeddings U * S of x by randomized SVD (range finder with
+    power iterations). Only products with x are needed, so x may be sparse.
+    """
+    rng = np.random.default_rng(seed)
+    width = min(dim + 10, min(x.shape))
+    q, _ = np.linalg.qr(np.asarray(x @ rng.standard_normal((x.shape[1], width)).astype(np.float32)))
+    for _ in range(n_iter):
+        q, _ = np.linalg.qr(np.asarray(x.T @ q))
+        q, _ = np.linalg.qr(np.asarray(x @ q))
+    b = np.asarray(x.T @ q).T  # width x terms, = q.T @ x
+    ub, sv, _ = np.linalg.svd(b, full_matrices=False)
+    dim = min(dim, width)
+    return (q @ ub[:, :dim]) * sv[:dim]
+
+
+def has_extension(engine: Engine, name: str) -> bool:
+    try:
+        with engine.begin() as conn:
+            conn.execute(text(f"CREATE EXTENSION IF NOT EXISTS {name};"))
+    except Exception:
+        return False
+    return True
+
+
+def build_embeddings(engine: Engine, schema: str, dim: int):
+    """
+    (Re)build study_embeddings: L2-normalized truncated-SVD vectors of each study's
+    term weights. Stored as vector(dim) with an HNSW cosine index when pgvector is
+    available (IVFFlat on pgvector < 0.5), else as real[] for the app's in-process
+    fallback. Built under a new name and swapped in one transaction.
+    """
+    terms = TermIndex.from_engine(engine, schema)
+    t0 = time.perf_counter()
+    emb = truncated_svd(study_term_matrix(terms), dim)
+    emb /= np.maximum(np.linalg.norm(emb, axis=1, keepdims=True), 1e-12)
+    dim = emb.shape[1]
+    print(f"→ study embeddings: {len(emb):,} studies x {dim} dims (SVD {time.perf_counter() - t0:.1f}s)")
+
+    pgvector = has_extension(engine, "vector")
+    if pgvector:
+        column, literal = f"vector({dim})", "[{}]"
+    else:
+        print("   … pgvector unavailable; storing real[] for the in-process fallback")
+        column, literal = "real[]", "{{{}}}"
+    out = pd.DataFrame({
+        "study_id": terms.study_ids.astype(str),
+        "embedding": [literal.format(",".join(f"{v:.6g}" for v in row)) for row in emb],
+    })
+    raw = engine.raw_connection()
+    try:
+        with raw.cursor() as cur:
+            cur.execute(f"DROP TABLE IF EXISTS {schema}.study_embeddings_new;")
+            cur.execute(f"CREATE TABLE {schema}.study_embeddings_new (study_id TEXT NOT NULL, embedding {column} NOT NULL);")
+            copy_csv(cur, f"{schema}.study_embeddings_new", ["study_id", "embedding"], out)
+            cur.execute(f"ALTER TABLE {schema}.study_embeddings_new "
+                        f"ADD CONSTRAINT study_embeddings_new_pkey PRIMARY KEY (study_id);")
+            if pgvector:
+                try:
+                    cur.execute("SAVEPOINT ann_index;")
+                    cur.execute(f"CREATE INDEX idx_study_embeddings_new_ann ON {schema}.study_embeddings_new "
+                                f"USING hnsw (embedding vector_cosine_ops);")
+                except Exception:
+                    cur.execute("ROLLBACK TO SAVEPOINT ann_index;")
+                    lists = max(1, int(np.sqrt(len(emb))))
+                    cur.execute(f"CREATE INDEX idx_study_embeddings_new_ann ON {schema}.study_embeddings_new "
+                                f"USING ivfflat (embedding vector_cosine_ops) WITH (lists = {lists});")
+            cur.execute(f"DROP TABLE IF EXISTS {schema}.study_embeddings;")
+            cur.execute(f"ALTER TABLE {schema}.study_embeddings_new RENAME TO study_embeddings;")
+            cur.execute(f"ALTER INDEX {schema}.study_embeddings_new_pkey RENAME TO study_embeddings_pkey;")
+            if pgvector:
+                cur.execute(f"ALTER INDEX {schema}.idx_study_embeddings_new_ann RENAME TO idx_study_embeddings_ann;")
+            cur.execute(f"ANALYZE {schema}.study_embeddings;")
+        raw.commit()
+    finally:
+        raw.close()
+    print(f"→ study_embeddings ({column}{' + ANN index' if pgvector else ''}) done.")
+
+
+# -----------------------------
+# Study fingerprints (incremental reload)
+# -----------------------------
+FINGERPRINT_TABLES = ("coordinates", "metadata", "annotations")
+
+
+def mix64(h: np.ndarray) -> np.ndarray:
+    """splitmix64 finalizer (uint64 arithmetic wraps)."""
+    h = h ^ (h >> np.uint64(30))
+    h = h * np.uint64(0xBF58476D1CE4E5B9)
+    h = h ^ (h >> np.uint64(27))
+    h = h * np.uint64(0x94D049BB133111EB)
+    return h ^ (h >> np.uint64(31))
+
+
+def row_hashes(df: pd.DataFrame, kind: str):
+    """(study_ids, uint64 hashes) for the rows/entries a chunk contributes to one table."""
+    if kind == "coordinates":
+        df = clean_coordinates(df, verbose=False)
+        return df["study_id"].to_numpy(), pd.util.hash_pandas_object(df, index=False).to_numpy()
+    if kind == "metadata":
+        df = normalize_metadata_columns(df)
+        return df["study_id"].astype(str).to_numpy(), pd.util.hash_pandas_object(df, index=False).to_numpy()
+
+    # annotations: hash each non-zero (study_id, contrast_id, term, weight) entry, i.e.
+    # exactly what lands in annotations_terms, independent of how columns are batched
+    ids = df[[c for c in ("study_id", "contrast_id") if c in df.columns]].astype(str)
+    id_hash = pd.util.hash_pandas_object(ids, index=False).to_numpy()
+    sid_arr = ids["study_id"].to_numpy()
+    sids, hashes = [], []
+    for c in term_columns(df.columns):
+        col = pd.to_numeric(df[c], errors="coerce").to_numpy(dtype=float)
+        idx = np.nonzero(np.isfinite(col) & (col > 0))[0]
+        if not len(idx):
+            continue
+        term = term_name(c)
+        term_hash = pd.util.hash_array(np.array([term], dtype=object))[0]
+        h = mix64(id_hash[idx] ^ term_hash) ^ mix64(np.ascontiguousarray(col[idx]).view(np.uint64))
+        sids.append(sid_arr[idx])
+        hashes.append(h)
+    if not hashes:
+        return np.empty(0, dtype=object), np.empty(0, dtype=np.uint64)
+    return np.concatenate(sids), np.concatenate(hashes)
+
+
+class StudyFingerprints:
+    """
+    Order-independent per-study content hash of one table: the sum (mod 2**64) of
+    row hashes, accumulated chunk by chunk as 32-bit halves so nothing overflows.
+    """
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self._parts = []
+
+    def add(self, df: pd.DataFrame):
+        sids, h = row_hashes(df, self.kind)
+        if len(h):
+            part = pd.DataFrame({"lo": h & np.uint64(0xFFFFFFFF), "hi": h >> np.uint64(32)})
+            self._parts.append(part.groupby(sids).sum())
+
+    def tap(self, chunks: Iterable[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+        """Pass chunks through unchanged while fingerprinting them."""
+        for df in chunks:
+            self.add(df)
+            yield df
+
+    def result(self) -> pd.Series:
+        """study_id -> signed 64-bit fingerprint (fits a BIGINT column)."""
+        if not self._parts:
+            return pd.Series(dtype=np.int64)
+        acc = pd.concat(self._parts).groupby(level=0).sum()
+        lo_sum = acc["lo"].to_numpy(np.uint64)
+        lo = lo_sum & np.uint64(0xFFFFFFFF)
+        # Carry the low halves' overflow into the high half before wrapping it
+        hi = (acc["hi"].to_numpy(np.uint64) + (lo_sum >> np.uint64(32))) & np.uint64(0xFFFFFFFF)
+        return pd.Series(((hi << np.uint64(32)) | lo).view(np.int64), index=acc.index.astype(str))
+
+
+def store_fingerprints(cur, schema: str, fingerprints: dict, replace: bool = True):
+    """Write {kind: Series(study_id -> fp)}; replace=False upserts only the given studies."""
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {schema}.study_fingerprints (
+            kind        TEXT NOT NULL,
+            study_id    TEXT NOT NULL,
+            fingerprint BIGINT NOT NULL,
+            PRIMARY KEY (kind, study_id)
+        );
+    """)
+    for kind, fp in fingerprints.items():
+        if replace:
+            cur.execute(f"DELETE FROM {schema}.study_fingerprints WHERE kind = %s;", (kind,))
+        else:
+            cur.execute(f"DELETE FROM {schema}.study_fingerprints WHERE kind = %s AND study_id = ANY(%s);",
+                        (kind, list(fp.index)))
+        out = pd.DataFrame({"kind": kind, "study_id": fp.index, "fingerprint": fp.to_numpy()})
+        copy_csv(cur, f"{schema}.study_fingerprints", ["kind", "study_id", "fingerprint"], out)
+
+
+def read_fingerprints(engine: Engine, schema: str) -> dict:
+    with engine.begin() as conn:
+        if conn.execute(text("SELECT to_regclass(:t)"), {"t": f"{schema}.study_fingerprints"}).scalar() is None:
+            return {}
+        rows = conn.execute(text(f"SELECT kind, study_id, fingerprint FROM {schema}.study_fingerprints")).all()
+    df = pd.DataFrame(rows, columns=["kind", "study_id", "fingerprint"])
+    return {kind: g.set_index("study_id")["fingerprint"] for kind, g in df.groupby("kind")}
+
+
+def diff_fingerprints(stored: pd.Series, incoming: pd.Series):
+    """(changed_or_new, deleted) study ids."""
+    # Compare as int64 on the common ids; an outer join would turn the column
+    # into float64 (NaN for new ids) and round away the low bits
+    common = incoming.index.intersection(stored.index)
+    differs = incoming[common].to_numpy(np.int64) != stored[common].to_numpy(np.int64)
+    changed = incoming.index.difference(stored.index).union(common[differs])
+    deleted = stored.index.difference(incoming.index)
+    return list(changed), list(deleted)
+
+
+def only_studies(chunks: Iterable[pd.DataFrame], study_ids: set) -> Iterator[pd.DataFrame]:
+    for df in chunks:
+        df = df[df["study_id"].astype(str).isin(study_ids)]
+        if len(df):
+            yield df
+
+
+def incremental_load(engine: Engine, schema: str, sources: dict, batch_cols: int, srid: int) -> str:
+    """
+    Re-load only studies whose content changed. `sources` maps table kind to a
+    zero-argument callable returning a fresh iterable of chunks (read twice: once to
+    fingerprint, once to copy). All deletes/inserts, the annotations_json refresh,
+    the fingerprints and the new generation commit in one transaction, so readers
+    see either the old or the new data.
+    """
+    stored = read_fingerprints(engine, schema)
+    missing = [k for k in FINGERPRINT_TABLES if k not in stored]
+    if missing:
+        raise RuntimeError(f"No stored fingerprints for {missing}; run a full (replace) load first.")
+
+    plan = {}
+    for kind in FINGERPRINT_TABLES:
+        fp = StudyFingerprints(kind)
+        for df in sources[kind]():
+            fp.add(df)
+        incoming = fp.result()
+        changed, deleted = diff_fingerprints(stored[kind], incoming)
+        plan[kind] = (incoming, changed, deleted)
+        print(f"→ {kind}: {len(changed):,} new/changed, {len(deleted):,} deleted studies")
+
+    with engine.begin() as conn:
+        has_json = conn.execute(text("SELECT to_regclass(:t)"), {"t": f"{schema}.annotations_json"}).scalar() is not None
+        has_cooc = conn.execute(text("SELECT to_regclass(:t)"), {"t": f"{schema}.term_vocab"}).scalar() is not None
+
+    generation = uuid.uuid4().hex
+    raw = engine.raw_connection()
+    try:
+        with raw.cursor() as cur:
+            tables = {"coordinates": "coordinates", "metadata": "metadata", "annotations": "annotations_terms"}
+            for kind, (incoming, changed, deleted) in plan.items():
+                if not changed and not deleted:
+                    continue
+                cur.execute(f"DELETE FROM {schema}.{tables[kind]} WHERE study_id = ANY(%s);", (changed + deleted,))
+                rows = only_studies(sources[kind](), set(changed))
+                if kind == "coordinates":
+                    n = copy_coordinates(cur, schema, rows, srid)
+                elif kind == "metadata":
+                    n = copy_metadata(cur, schema, rows)
+                else:
+                    batches = (b for df in rows for b in encode_term_batches(df, term_columns(df.columns), batch_cols))
+                    n = copy_term_batches(cur, schema, batches)
+                    if has_json:
+                        cur.execute(f"DELETE FROM {schema}.annotations_json WHERE study_id = ANY(%s);", (changed + deleted,))
+                        cur.execute(f"""
+                            INSERT INTO {schema}.annotations_json (study_id, contrast_id, terms)
+                            SELECT study_id, contrast_id, jsonb_object_agg(term, weight)
+                            FROM {schema}.annotations_terms
+                            WHERE study_id = ANY(%s)
+                            GROUP BY study_id, contrast_id;
+                        """, (changed,))
+                print(f"→ {kind}: re-inserted {n:,} rows")
+                store_fingerprints(cur, schema, {kind: incoming.loc[changed]}, replace=False)
+                if deleted:
+                    cur.execute(f"DELETE FROM {schema}.study_fingerprints WHERE kind = %s AND study_id = ANY(%s);",
+                                (kind, deleted))
+            if has_cooc and (plan["annotations"][1] or plan["annotations"][2]):
+                # Pair counts are global; recount from the updated annotations_terms
+                cur.execute(f"SELECT DISTINCT study_id, term_key FROM {schema}.annotations_terms;")
+                rows = cur.fetchall()
+                cooc = TermCooccurrence()
+                cooc.add_pairs([r[0] for r in rows], [r[1] for r in rows])
+                store_cooccurrence(cur, schema, cooc)
+            cur.execute(LOAD_INFO_DDL.format(schema=schema))
+            cur.execute(load_info_insert(schema, "%s"), (generation,))
+        raw.commit()
+    finally:
+        raw.close()
+    if plan["annotations"][1] or plan["annotations"][2]:
+        if has_covering_index(engine, schema):
+            # Re-inserted rows are not all-visible until vacuumed
+            vacuum_annotations(engine, schema)
+    return generation
+
+
+# -----------------------------
+# Phases
+# -----------------------------
+def run_phase(phase: str, steps, jobs: int):
+    """Run (name, fn) steps one after another, or concurrently when jobs > 1; report timings."""
+    def timed(name, fn):
+        t = time.perf_counter()
+        fn()
+        print(f"⏱  {phase} {name}: {time.perf_counter() - t:.1f}s")
+
+    t0 = time.perf_counter()
+    if jobs <= 1:
+        for name, fn in steps:
+            print(f"\n=== {phase}: {name} ===")
+            timed(name, fn)
+    else:
+        print(f"\n=== {phase}: {', '.join(name for name, _ in steps)} (concurrent, jobs={jobs}) ===")
+        with ThreadPoolExecutor(max_workers=min(jobs, len(steps))) as pool:
+            futures = [pool.submit(timed, name, fn) for name, fn in steps]
+            for f in futures:
+                f.result()
+    print(f"⏱  {phase} phase: {time.perf_counter() - t0:.1f}s")
+
+
+# -----------------------------
+# Load info (data generation token read by app.py's response cache)
+# -----------------------------
+LOAD_INFO_DDL = """
+    CREATE TABLE IF NOT EXISTS {schema}.load_info (
+        generation TEXT PRIMARY KEY,
+        loaded_at  TIMESTAMPTZ NOT NULL DEFAULT now(),
+        counts     JSONB
+    );
+    ALTER TABLE {schema}.load_info ADD COLUMN IF NOT EXISTS counts JSONB;
+"""
+
+
+def load_info_insert(schema: str, param: str) -> str:
+    """INSERT of a new generation with the exact row counts of the tables (served by app.py's /stats)."""
+    counts = ", ".join(f"'{t}', (SELECT COUNT(*) FROM {schema}.{t})" for t in TABLES)
+    return f"INSERT INTO {schema}.load_info (generation, counts) VALUES ({param}, jsonb_build_object({counts}));"
+
+
+def write_load_info(engine: Engine, schema: str) -> str:
+    generation = uuid.uuid4().hex
+    with engine.begin() as conn:
+        conn.execute(text(LOAD_INFO_DDL.format(schema=schema)))
+        conn.execute(text(load_info_insert(schema, ":g")), {"g": generation})
+    return generation
+
+
 # -----------------------------
 # Main
 # -----------------------------
 def main():
     args = parse_args()
-    engine = create_engine(args.url, pool_pre_ping=True)
+    # Room for the table loaders plus one COPY connection per job
+    engine = create_engine(args.url, pool_pre_ping=True, pool_size=max(5, args.jobs + 3))
 
     ensure_schema(engine, args.schema)
     ensure_extensions(engine)
@@ -307,26 +1182,120 @@ def main():
     print("✅ current_schema:", sch[0])
 
     # Load Parquet files
-    print("📦 loading Parquet files...")
-    coords = load_parquet(os.path.join(args.data_dir, "coordinates.parquet"))
-    meta   = load_parquet(os.path.join(args.data_dir, "metadata.parquet"))
-    ann    = load_parquet(os.path.join(args.data_dir, "annotations.parquet"))
-    print(f"📐 shapes -> coordinates: {coords.shape}, metadata: {meta.shape}, annotations: {ann.shape}")
+    jobs = max(1, args.jobs)
+    coords_path = os.path.join(args.data_dir, "coordinates.parquet")
+    meta_path = os.path.join(args.data_dir, "metadata.parquet")
+    ann_path = os.path.join(args.data_dir, "annotations.parquet")
+    if args.stream:
+        # Concurrent table loads share the budget
+        budget = args.memory_budget * 1024 * 1024 // (3 if jobs > 1 else 1)
+        print(f"📦 streaming Parquet files (≈{budget / 2**20:,.0f} MiB per table chunk)...")
+        sources = {
+            "coordinates": lambda: parquet_chunks(coords_path, budget),
+            "metadata": lambda: parquet_chunks(meta_path, budget),
+            "annotations": lambda: annotation_chunks(ann_path, budget, args.batch_cols),
+        }
+    else:
+        print("📦 loading Parquet files...")
+        coords_df = load_parquet(coords_path)
+        meta_df   = load_parquet(meta_path)
+        ann_df    = load_parquet(ann_path)
+        print(f"📐 shapes -> coordinates: {coords_df.shape}, metadata: {meta_df.shape}, annotations: {ann_df.shape}")
+        sources = {"coordinates": lambda: [coords_df], "metadata": lambda: [meta_df], "annotations": lambda: [ann_df]}
+
+    if args.incremental:
+        print("\n=== Incremental reload ===")
+        generation = incremental_load(engine, args.schema, sources, args.batch_cols, args.srid)
+        if args.embeddings:
+            print("\n=== Study embeddings ===")
+            build_embeddings(engine, args.schema, args.embeddings)
+            # The neighbours changed after the reload's generation was recorded
+            generation = write_load_info(engine, args.schema)
+    else:
+        # Fingerprint studies as the chunks stream past, for later --incremental runs
+        fingerprints = {kind: StudyFingerprints(kind) for kind in FINGERPRINT_TABLES}
+        coords = fingerprints["coordinates"].tap(sources["coordinates"]())
+        meta = fingerprints["metadata"].tap(sources["metadata"]())
+        ann = fingerprints["annotations"].tap(sources["annotations"]())
+        cooc = TermCooccurrence() if args.cooccurrence else None
+        if cooc is not None:
+            ann = cooc.tap(ann)
+
+        # Build (tables first, all indexes in one final phase)
+        builds = [
+            ("coordinates", lambda: build_coordinates(engine, coords, args.schema, args.stage_chunksize, args.if_exists,
+                                                      args.srid, args.load_method)),
+            ("metadata", lambda: build_metadata(engine, meta, args.schema, args.if_exists, args.load_method)),
+            ("annotations", lambda: build_annotations(engine, ann, args.schema, args.batch_cols,
+                                                      enable_json=args.enable_json, jobs=jobs)),
+        ]
+        indexes = [
+            ("coordinates", lambda: index_coordinates(engine, args.schema, jobs)),
+            ("metadata", lambda: index_metadata(engine, args.schema, jobs)),
+            ("annotations", lambda: index_annotations(engine, args.schema, args.enable_json, jobs,
+                                                      covering=args.covering_index)),
+        ]
+        run_phase("Build", builds, jobs)
+        run_phase("Index", indexes, jobs)
+
+        if args.covering_index:
+            t0 = time.perf_counter()
+            vacuum_annotations(engine, args.schema)
+            print(f"⏱  vacuum annotations_terms: {time.perf_counter() - t0:.1f}s")
+
+        if cooc is not None:
+            print("\n=== Term co-occurrence ===")
+            t0 = time.perf_counter()
+            raw = engine.raw_connection()
+            try:
+                with raw.cursor() as cur:
+                    store_cooccurrence(cur, args.schema, cooc)
+                raw.commit()
+            finally:
+                raw.close()
+            print(f"⏱  term_cooccurrence: {time.perf_counter() - t0:.1f}s")
+
+        if args.if_exists == "replace":
+            raw = engine.raw_connection()
+            try:
+                with raw.cursor() as cur:
+                    store_fingerprints(cur, args.schema, {k: fp.result() for k, fp in fingerprints.items()})
+                raw.commit()
+            finally:
+                raw.close()
+        else:
+            # Appended tables no longer match a single Parquet drop; force a full load before --incremental
+            with engine.begin() as conn:
+                conn.execute(text(f"DROP TABLE IF EXISTS {args.schema}.study_fingerprints;"))
 
-    # Build
-    print("\n=== Build: coordinates ===")
-    build_coordinates(engine, coords, args.schema, args.stage_chunksize, args.if_exists, args.srid)
+        if args.embeddings:
+            print("\n=== Study embeddings ===")
+            t0 = time.perf_counter()
+            build_embeddings(engine, args.schema, args.embeddings)
+            print(f"⏱  study_embeddings: {time.perf_counter() - t0:.1f}s")
 
-    print("\n=== Build: metadata ===")
-    build_metadata(engine, meta, args.schema, args.if_exists)
+        generation = write_load_info(engine, args.schema)
 
-    print("\n=== Build: annotations ===")
-    build_annotations(engine, ann, args.schema, args.batch_cols, enable_json=args.enable_json)
+    if args.snapshot:
+        print("\n=== Snapshot ===")
+        t0 = time.perf_counter()
+        path = write_snapshot(engine, args.schema, args.snapshot, generation, args.snapshot_cell)
+        print(f"⏱  snapshot {path}: {time.perf_counter() - t0:.1f}s")
 
     print("\n=== Ready ===")
+    print(f"- generation   : {generation} ({args.schema}.load_info, with row counts)")
     print(f"- coordinates  : {args.schema}.coordinates (geometry(POINTZ,{args.srid}) + GIST)")
-    print(f"- metadata     : {args.schema}.metadata (FTS + trigger + GIN)")
+    print(f"- metadata     : {args.schema}.metadata (FTS + GIN)")
     print(f"- annotations  : {args.schema}.annotations_terms (sparse via COPY)" + (" + annotations_json (GIN)" if args.enable_json else ""))
+    if args.covering_index:
+        print(f"- covering idx : {args.schema}.idx_annotations_terms_key_rev_weight (term_key_rev, study_id) INCLUDE (weight)")
+    if args.cooccurrence:
+        print(f"- co-occurrence: {args.schema}.term_vocab + {args.schema}.term_cooccurrence")
+    if args.embeddings:
+        print(f"- embeddings   : {args.schema}.study_embeddings ({args.embeddings} dims)")
+    if args.snapshot:
+        print(f"- snapshot     : {args.snapshot}/CURRENT (memory-mapped by app.py with SNAPSHOT_DIR)")
+    print(f"📈 peak RSS: {peak_rss_mib():,.0f} MiB")
 
 
 if __name__ == "__main__":
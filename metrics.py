@@ -0,0 +1,211 @@
+"""
+Latency instrumentation for app.py / asgi.py, exposed in the Prometheus text
+format at /metrics.
+
+- request latency per endpoint, method and status, and 5xx errors per endpoint
+- SQL latency and rows returned per statement (prepared statement name, or a
+  short hash of ad hoc SQL), and SQL errors
+- pool checkout wait (time to get a connection from the pool)
+- response-cache counters, read from the caches' own stats at scrape time
+
+Statements slower than SLOW_QUERY_MS are kept in a bounded ring buffer with
+their EXPLAIN (ANALYZE, BUFFERS) plan, captured off the request path on one
+background thread (each statement is executed once more to capture it).
+"""
+
+import hashlib
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+
+
+def label_str(names, values) -> str:
+    if not names:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, escaped)) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels=()):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{label_str(self.labels, key)} {value:g}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels=(), buckets=LATENCY_BUCKETS):
+        self.name, self.help, self.labels = name, help, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(n, "") for n in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.labels + ("le",)
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, n in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{label_str(names, key + (f'{bound:g}',))} {n}")
+                lines.append(f"{self.name}_bucket{label_str(names, key + ('+Inf',))} {series[-2]}")
+                lines.append(f"{self.name}_count{label_str(self.labels, key)} {series[-2]}")
+                lines.append(f"{self.name}_sum{label_str(self.labels, key)} {series[-1]:g}")
+        return lines
+
+
+class Metrics:
+    def __init__(self):
+        self.request_seconds = Histogram("ns_http_request_duration_seconds", "HTTP request latency",
+                                         ("endpoint", "method", "status"))
+        self.request_errors = Counter("ns_http_errors_total", "HTTP responses with status >= 500", ("endpoint",))
+        self.sql_seconds = Histogram("ns_sql_duration_seconds", "SQL statement latency", ("statement",))
+        self.sql_rows = Histogram("ns_sql_rows", "Rows returned per SQL statement", ("statement",), ROW_BUCKETS)
+        self.sql_errors = Counter("ns_sql_errors_total", "Failed SQL statements", ("statement",))
+        self.pool_wait_seconds = Histogram("ns_pool_checkout_seconds", "Time to check a connection out of the pool")
+        self.slow_queries = Counter("ns_sql_slow_total", "Statements slower than SLOW_QUERY_MS", ("statement",))
+
+    def observe_request(self, endpoint, method, status, seconds):
+        endpoint = endpoint or "unmatched"
+        self.request_seconds.observe(seconds, endpoint=endpoint, method=method, status=str(status))
+        if status >= 500:
+            self.request_errors.inc(endpoint=endpoint)
+
+    def render(self, caches=None) -> str:
+        """Exposition text; `caches` maps a cache name to its stats() dict."""
+        lines = []
+        for metric in (self.request_seconds, self.request_errors, self.sql_seconds, self.sql_rows,
+                       self.sql_errors, self.pool_wait_seconds, self.slow_queries):
+            lines += metric.render()
+        if caches:
+            for field, kind in (("hits", "counter"), ("misses", "counter"), ("evictions", "counter"),
+                                ("entries", "gauge"), ("bytes", "gauge")):
+                name = f"ns_cache_{field}" + ("_total" if kind == "counter" else "")
+                lines += [f"# HELP {name} Response cache {field}", f"# TYPE {name} {kind}"]
+                for cache, stats in sorted(caches.items()):
+                    if field in stats:
+                        lines.append(f"{name}{label_str(('cache',), (cache,))} {stats[field]:g}")
+        return "\n".join(lines) + "\n"
+
+
+_PREPARED = re.compile(r"\s*(?:EXECUTE\s+)(\w+)", re.IGNORECASE)
+
+
+def statement_label(statement: str) -> str:
+    """Prepared statement name for EXECUTE, else sql_<hash> of the statement text."""
+    m = _PREPARED.match(statement)
+    if m:
+        return m.group(1)
+    return "sql_" + hashlib.sha1(" ".join(statement.split()).encode()).hexdigest()[:8]
+
+
+class SlowQueryLog:
+    """Ring buffer of statements slower than threshold_ms, with their EXPLAIN (ANALYZE, BUFFERS) plans."""
+
+    def __init__(self, threshold_ms: float = 1000.0, size: int = 50, explain: bool = True):
+        self.threshold = threshold_ms / 1000.0
+        self.explain = explain
+        self._entries = deque(maxlen=size)
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="slow-query-explain")
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold > 0
+
+    def record(self, label: str, statement: str, params, seconds: float, explain_fn=None):
+        """Keep a slow statement; explain_fn() -> plan text runs in the background (once per label at a time)."""
+        entry = {"statement": label, "sql": statement, "params": repr(params)[:2000],
+                 "ms": round(seconds * 1000, 3), "at": time.time(), "plan": None}
+        with self._lock:
+            self._entries.append(entry)
+            if not self.explain or explain_fn is None or label in self._pending:
+                return
+            self._pending.add(label)
+
+        def capture():
+            try:
+                entry["plan"] = explain_fn()
+            except Exception as e:
+                entry["plan"] = f"EXPLAIN failed: {e}"
+            finally:
+                with self._lock:
+                    self._pending.discard(label)
+        self._executor.submit(capture)
+
+    def entries(self) -> list:
+        with self._lock:
+            return list(reversed(self._entries))
+
+
+def instrument_engine(engine, metrics: Metrics, slow_log: SlowQueryLog = None):
+    """Time every cursor execution on a SQLAlchemy engine (and capture slow plans)."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("ns_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after(conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - conn.info["ns_started"].pop()
+        if conn.info.get("ns_explaining"):
+            return
+        label = statement_label(statement)
+        metrics.sql_seconds.observe(seconds, statement=label)
+        if cursor.rowcount is not None and cursor.rowcount >= 0:
+            metrics.sql_rows.observe(cursor.rowcount, statement=label)
+        if slow_log is not None and slow_log.enabled and seconds >= slow_log.threshold:
+            metrics.slow_queries.inc(statement=label)
+            slow_log.record(label, statement, parameters, seconds,
+                            lambda: explain_sql(engine, statement, parameters))
+
+    @event.listens_for(engine, "handle_error")
+    def failed(context):
+        started = context.connection.info.get("ns_started") if context.connection is not None else None
+        if started:
+            started.pop()
+        if context.statement:
+            metrics.sql_errors.inc(statement=statement_label(context.statement))
+
+
+def explain_sql(engine, statement: str, parameters) -> str:
+    """EXPLAIN (ANALYZE, BUFFERS) a driver-level statement on a pooled connection."""
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.info["ns_explaining"] = True
+        try:
+            rows = conn.exec_driver_sql("EXPLAIN (ANALYZE, BUFFERS) " + statement, parameters).all()
+        finally:
+            conn.info.pop("ns_explaining", None)
+    return "\n".join(r[0] for r in rows)
+
@@ -0,0 +1,654 @@
+"""
+Query layer shared by the Flask app (app.py) and the async app (asgi.py).
+
+SQL text, parameter builders, request-argument parsing and result shaping
+live here so both entry points answer every route identically; each app only
+supplies its own driver (psycopg2 / asyncpg) and web framework glue.
+Placeholders are SQLAlchemy-style :name; positional() rewrites them to $n
+for PREPARE and asyncpg.
+"""
+
+import math
+import re
+from bisect import bisect_right
+
+import numpy as np
+
+from activation_map import FORMATS, KERNELS
+from term_index import KEY_UPPER, suffix_key
+
+
+# A term matches every stored term whose canonical key ends with the term's
+# key, i.e. whose reversed key (term_key_rev, COLLATE "C") starts with the
+# reversed search key. Written as a range so the btree index can serve it.
+# Only rows with weight >= :threshold count as mentions (0 keeps every row);
+# with the covering index (create_db.py --covering-index) these lookups are
+# index-only scans.
+TERMS_MINUS_SQL = """
+    SELECT DISTINCT a.study_id
+    FROM annotations_terms a
+    WHERE a.term_key_rev >= :key_a AND a.term_key_rev < :key_a_upper AND a.weight >= :threshold
+      AND NOT EXISTS (
+          SELECT 1
+          FROM annotations_terms b
+          WHERE b.study_id = a.study_id
+            AND b.term_key_rev >= :key_b AND b.term_key_rev < :key_b_upper AND b.weight >= :threshold
+      )
+"""
+
+# A \ B ranked by the study's (max) weight for term A, top :limit
+TERMS_RANKED_SQL = """
+    SELECT a.study_id, max(a.weight) AS weight
+    FROM annotations_terms a
+    WHERE a.term_key_rev >= :key_a AND a.term_key_rev < :key_a_upper AND a.weight >= :threshold
+      AND NOT EXISTS (
+          SELECT 1
+          FROM annotations_terms b
+          WHERE b.study_id = a.study_id
+            AND b.term_key_rev >= :key_b AND b.term_key_rev < :key_b_upper AND b.weight >= :threshold
+      )
+    GROUP BY a.study_id
+    ORDER BY weight DESC, a.study_id COLLATE "C"
+    LIMIT :limit
+"""
+
+TERMS_BOTH_SQL = """
+    WITH a AS (
+        SELECT DISTINCT study_id FROM annotations_terms
+        WHERE term_key_rev >= :key_a AND term_key_rev < :key_a_upper AND weight >= :threshold
+    ), b AS (
+        SELECT DISTINCT study_id FROM annotations_terms
+        WHERE term_key_rev >= :key_b AND term_key_rev < :key_b_upper AND weight >= :threshold
+    )
+    SELECT 'A_minus_B', a.study_id FROM a
+    WHERE NOT EXISTS (SELECT 1 FROM b WHERE b.study_id = a.study_id)
+    UNION ALL
+    SELECT 'B_minus_A', b.study_id FROM b
+    WHERE NOT EXISTS (SELECT 1 FROM a WHERE a.study_id = b.study_id)
+"""
+
+
+def term_params(term_a, term_b, threshold=0.0):
+    key_a, key_b = suffix_key(term_a), suffix_key(term_b)
+    return {"key_a": key_a, "key_a_upper": key_a + KEY_UPPER,
+            "key_b": key_b, "key_b_upper": key_b + KEY_UPPER, "threshold": float(threshold)}
+
+
+# Foci within :r mm of any point of A (resp. B); each side is one or more
+# points passed as parallel float8 arrays. The &&& bounding-box test lets the
+# N-D GIST index (idx_coordinates_geom_gist) prune; ST_3DDWithin is the exact
+# test, and r = 0 reduces to exact coordinate equality.
+COORDS_CTE_SQL = """
+    WITH s AS (
+        SELECT Find_SRID('ns', 'coordinates', 'geom') AS srid
+    ), pa AS (
+        SELECT ST_SetSRID(ST_MakePoint(u.x, u.y, u.z), s.srid) AS pt
+        FROM s, unnest(CAST(:xa AS float8[]), CAST(:ya AS float8[]), CAST(:za AS float8[])) AS u(x, y, z)
+    ), pb AS (
+        SELECT ST_SetSRID(ST_MakePoint(u.x, u.y, u.z), s.srid) AS pt
+        FROM s, unnest(CAST(:xb AS float8[]), CAST(:yb AS float8[]), CAST(:zb AS float8[])) AS u(x, y, z)
+    ), a AS (
+        SELECT DISTINCT c.study_id FROM pa
+        JOIN coordinates c
+          ON c.geom &&& ST_Expand(pa.pt, :r, :r, :r) AND ST_3DDWithin(c.geom, pa.pt, :r)
+    ), b AS (
+        SELECT DISTINCT c.study_id FROM pb
+        JOIN coordinates c
+          ON c.geom &&& ST_Expand(pb.pt, :r, :r, :r) AND ST_3DDWithin(c.geom, pb.pt, :r)
+    )
+"""
+
+COORDS_MINUS_SQL = COORDS_CTE_SQL + """
+    SELECT a.study_id FROM a
+    WHERE NOT EXISTS (SELECT 1 FROM b WHERE b.study_id = a.study_id)
+"""
+
+COORDS_BOTH_SQL = COORDS_CTE_SQL + """
+    SELECT 'A_minus_B', a.study_id FROM a
+    WHERE NOT EXISTS (SELECT 1 FROM b WHERE b.study_id = a.study_id)
+    UNION ALL
+    SELECT 'B_minus_A', b.study_id FROM b
+    WHERE NOT EXISTS (SELECT 1 FROM a WHERE a.study_id = b.study_id)
+"""
+
+
+def parse_foci(coords):
+    """Parse an 'x_y_z' path segment, or several joined by '+', into (x, y, z) tuples."""
+    foci = []
+    for focus in coords.split("+"):
+        try:
+            x, y, z = map(float, focus.split("_"))
+        except ValueError:
+            x = y = z = math.nan
+        if not all(map(math.isfinite, (x, y, z))):
+            raise ValueError(f"Invalid coordinates {focus!r}; expected x_y_z (several joined by '+')")
+        foci.append((x, y, z))
+    return foci
+
+
+def coord_params(foci_a, foci_b, radius=0.0):
+    return {
+        "xa": [p[0] for p in foci_a], "ya": [p[1] for p in foci_a], "za": [p[2] for p in foci_a],
+        "xb": [p[0] for p in foci_b], "yb": [p[1] for p in foci_b], "zb": [p[2] for p in foci_b],
+        "r": float(radius),
+    }
+
+
+# Batch forms: every distinct term key (resp. foci set) is resolved once into
+# `hits`, then each directed pair (:pa, :pb index into the keys/sides) is an
+# anti-join between two slices of it. Rows come back ordered by pair number.
+TERMS_BATCH_SQL = """
+    WITH k AS (
+        SELECT k.key COLLATE "C" AS key, k.kid
+        FROM unnest(CAST(:keys AS text[])) WITH ORDINALITY AS k(key, kid)
+    ), hits AS (
+        SELECT DISTINCT k.kid, t.study_id
+        FROM k
+        JOIN annotations_terms t
+          ON t.term_key_rev >= k.key AND t.term_key_rev < k.key || :upper AND t.weight >= :threshold
+    ), pairs AS (
+        SELECT * FROM unnest(CAST(:pa AS int[]), CAST(:pb AS int[])) WITH ORDINALITY AS p(a, b, pid)
+    )
+    SELECT p.pid, h.study_id
+    FROM pairs p
+    JOIN hits h ON h.kid = p.a
+    WHERE NOT EXISTS (SELECT 1 FROM hits x WHERE x.kid = p.b AND x.study_id = h.study_id)
+    ORDER BY p.pid
+"""
+
+COORDS_BATCH_SQL = """
+    WITH s AS (
+        SELECT Find_SRID('ns', 'coordinates', 'geom') AS srid
+    ), pts AS (
+        SELECT u.side, ST_SetSRID(ST_MakePoint(u.x, u.y, u.z), s.srid) AS pt
+        FROM s, unnest(CAST(:sides AS int[]), CAST(:xs AS float8[]), CAST(:ys AS float8[]), CAST(:zs AS float8[]))
+             AS u(side, x, y, z)
+    ), hits AS (
+        SELECT DISTINCT pts.side, c.study_id FROM pts
+        JOIN coordinates c
+          ON c.geom &&& ST_Expand(pts.pt, :r, :r, :r) AND ST_3DDWithin(c.geom, pts.pt, :r)
+    ), pairs AS (
+        SELECT * FROM unnest(CAST(:pa AS int[]), CAST(:pb AS int[])) WITH ORDINALITY AS p(a, b, pid)
+    )
+    SELECT p.pid, h.study_id
+    FROM pairs p
+    JOIN hits h ON h.side = p.a
+    WHERE NOT EXISTS (SELECT 1 FROM hits x WHERE x.side = p.b AND x.study_id = h.study_id)
+    ORDER BY p.pid
+"""
+
+
+def terms_batch_params(directed, threshold=0.0):
+    """Parameters for TERMS_BATCH_SQL: distinct reversed keys plus 1-based pair indices into them"""
+    keys, pa, pb = {}, [], []
+    for term_a, term_b in directed:
+        pa.append(keys.setdefault(suffix_key(term_a), len(keys) + 1))
+        pb.append(keys.setdefault(suffix_key(term_b), len(keys) + 1))
+    return {"keys": list(keys), "upper": KEY_UPPER, "pa": pa, "pb": pb, "threshold": float(threshold)}
+
+
+def coords_batch_params(directed, radius=0.0):
+    """Parameters for COORDS_BATCH_SQL: the points of each distinct foci set, tagged by side number"""
+    sides, pa, pb = {}, [], []
+    for coords_a, coords_b in directed:
+        pa.append(sides.setdefault(coords_a, len(sides) + 1))
+        pb.append(sides.setdefault(coords_b, len(sides) + 1))
+    params = {"sides": [], "xs": [], "ys": [], "zs": [], "pa": pa, "pb": pb, "r": float(radius)}
+    for coords, side in sides.items():
+        for x, y, z in parse_foci(coords):
+            params["sides"].append(side)
+            params["xs"].append(x)
+            params["ys"].append(y)
+            params["zs"].append(z)
+    return params
+
+
+def page_sql(sql):
+    """Wrap a single-column study_id query for keyset pagination (byte order, as in the in-memory indexes).
+
+    A NULL :after starts from the beginning and a NULL :limit means no limit,
+    so one statement serves every page and can be prepared once.
+    """
+    return f"""
+    SELECT d.study_id FROM ({sql}) d
+    WHERE CAST(:after AS text) IS NULL OR d.study_id COLLATE "C" > :after
+    ORDER BY d.study_id COLLATE "C"
+    LIMIT :limit
+"""
+
+
+# |A|, |B| and |A ∩ B| for /counts. With term_vocab / term_cooccurrence (built by
+# create_db.py --cooccurrence) a pair whose terms each resolve to at most one
+# canonical key is a single lookup; n_keys tells the caller whether that held.
+# The tables count every mention, so they only answer unthresholded requests.
+TERMS_COOC_COUNTS_SQL = """
+    SELECT va.n_keys, vb.n_keys, COALESCE(va.df, 0), COALESCE(vb.df, 0),
+           CASE WHEN va.term_id = vb.term_id THEN va.df
+                ELSE COALESCE((SELECT c.n FROM term_cooccurrence c
+                               WHERE c.term_a = LEAST(va.term_id, vb.term_id)
+                                 AND c.term_b = GREATEST(va.term_id, vb.term_id)), 0)
+           END
+    FROM (SELECT count(*) AS n_keys, min(term_id) AS term_id, min(df) AS df FROM term_vocab
+          WHERE term_key_rev >= :key_a AND term_key_rev < :key_a_upper) va,
+         (SELECT count(*) AS n_keys, min(term_id) AS term_id, min(df) AS df FROM term_vocab
+          WHERE term_key_rev >= :key_b AND term_key_rev < :key_b_upper) vb
+"""
+
+# Exact counts from annotations_terms, for terms matching several keys
+TERMS_COUNTS_SQL = """
+    WITH a AS (
+        SELECT DISTINCT study_id FROM annotations_terms
+        WHERE term_key_rev >= :key_a AND term_key_rev < :key_a_upper AND weight >= :threshold
+    ), b AS (
+        SELECT DISTINCT study_id FROM annotations_terms
+        WHERE term_key_rev >= :key_b AND term_key_rev < :key_b_upper AND weight >= :threshold
+    )
+    SELECT (SELECT count(*) FROM a), (SELECT count(*) FROM b),
+           (SELECT count(*) FROM a JOIN b USING (study_id))
+"""
+
+
+# Every focus of a set of studies, for activation maps (idx_coordinates_study)
+STUDY_FOCI_SQL = """
+    SELECT study_id, ST_X(geom), ST_Y(geom), ST_Z(geom)
+    FROM coordinates
+    WHERE study_id = ANY(CAST(:ids AS text[]))
+"""
+
+
+# Full-text search over metadata.fts (GIN idx_metadata_fts serves the @@ match).
+# Ranked by ts_rank_cd, one row per study, keyset-paginated on (rank DESC,
+# study_id): a NULL :after_rank starts from the top. :ids (NULL = no filter)
+# restricts hits to a dissociation result.
+SEARCH_SQL = """
+    WITH hits AS (
+        SELECT DISTINCT ON (m.study_id) m.study_id, m.title, m.journal, m.year,
+               CAST(ts_rank_cd(m.fts, websearch_to_tsquery('pg_catalog.english', :q)) AS float8) AS rank
+        FROM metadata m
+        WHERE m.fts @@ websearch_to_tsquery('pg_catalog.english', :q)
+          AND (CAST(:ids AS text[]) IS NULL OR m.study_id = ANY(CAST(:ids AS text[])))
+        ORDER BY m.study_id, rank DESC
+    )
+    SELECT study_id, title, journal, year, rank FROM hits
+    WHERE CAST(:after_rank AS float8) IS NULL
+       OR rank < :after_rank OR (rank = :after_rank AND study_id COLLATE "C" > :after_id)
+    ORDER BY rank DESC, study_id COLLATE "C"
+    LIMIT :limit
+"""
+
+# ts_headline is expensive, so it only runs over the rows of the page
+SEARCH_HEADLINE_SQL = f"""
+    SELECT p.study_id, p.title, p.journal, p.year, p.rank,
+           ts_headline('pg_catalog.english', coalesce(p.title, ''),
+                       websearch_to_tsquery('pg_catalog.english', :q),
+                       'StartSel=<b>, StopSel=</b>, HighlightAll=true')
+    FROM ({SEARCH_SQL}) p
+    ORDER BY p.rank DESC, p.study_id COLLATE "C"
+"""
+
+
+# k nearest studies by cosine distance on study_embeddings (create_db.py
+# --embeddings). The target vector is an InitPlan, so ORDER BY ... LIMIT is
+# served by the HNSW / IVFFlat index; a study without an embedding gives no rows.
+SIMILAR_SQL = """
+    SELECT e.study_id,
+           1 - (e.embedding <=> (SELECT embedding FROM study_embeddings WHERE study_id = :study_id)) AS score
+    FROM study_embeddings e
+    WHERE e.study_id <> :study_id
+      AND (SELECT embedding FROM study_embeddings WHERE study_id = :study_id) IS NOT NULL
+    ORDER BY e.embedding <=> (SELECT embedding FROM study_embeddings WHERE study_id = :study_id)
+    LIMIT :k
+"""
+
+
+# Hot queries; app.py prepares them once on every pooled connection, asyncpg
+# prepares and caches them itself.
+PREPARED_STATEMENTS = {
+    "ns_terms_minus": page_sql(TERMS_MINUS_SQL),
+    "ns_terms_both": TERMS_BOTH_SQL,
+    "ns_terms_ranked": TERMS_RANKED_SQL,
+    "ns_coords_minus": page_sql(COORDS_MINUS_SQL),
+    "ns_coords_both": COORDS_BOTH_SQL,
+    "ns_terms_cooc_counts": TERMS_COOC_COUNTS_SQL,
+    "ns_terms_counts": TERMS_COUNTS_SQL,
+    "ns_study_foci": STUDY_FOCI_SQL,
+    "ns_search": SEARCH_SQL,
+    "ns_search_headline": SEARCH_HEADLINE_SQL,
+    "ns_similar": SIMILAR_SQL,
+}
+
+PARAM_TYPES = {
+    "key_a": "text", "key_a_upper": "text", "key_b": "text", "key_b_upper": "text",
+    "xa": "float8[]", "ya": "float8[]", "za": "float8[]",
+    "xb": "float8[]", "yb": "float8[]", "zb": "float8[]",
+    "r": "float8", "threshold": "float8", "after": "text", "limit": "bigint", "ids": "text[]",
+    "q": "text", "after_rank": "float8", "after_id": "text", "study_id": "text", "k": "bigint",
+}
+
+
+def positional(sql):
+    """Rewrite :name placeholders as $1, $2, ... for PREPARE; returns (sql, names)"""
+    names = []
+
+    def number(m):
+        if m.group(1) not in names:
+            names.append(m.group(1))
+        return f"${names.index(m.group(1)) + 1}"
+    return re.sub(r"(?<![:\w]):(\w+)", number, sql), names
+
+
+# -----------------------
+# Query selection
+# -----------------------
+def minus_query(kind, a, b, radius=0.0, after=None, limit=None, threshold=0.0):
+    """(prepared statement name, params) for one direction of a term or location dissociation"""
+    if kind == "terms":
+        name, params = "ns_terms_minus", term_params(a, b, threshold)
+    else:
+        name, params = "ns_coords_minus", coord_params(parse_foci(a), parse_foci(b), radius)
+    params.update(after=after, limit=limit)
+    return name, params
+
+
+def both_query(kind, a, b, radius=0.0, threshold=0.0):
+    """(prepared statement name, params) for both directions in one statement"""
+    if kind == "terms":
+        return "ns_terms_both", term_params(a, b, threshold)
+    return "ns_coords_both", coord_params(parse_foci(a), parse_foci(b), radius)
+
+
+def ranked_query(term_a, term_b, threshold=0.0, limit=None):
+    """(prepared statement name, params) for A \\ B by descending weight"""
+    params = term_params(term_a, term_b, threshold)
+    params.update(limit=limit)
+    return "ns_terms_ranked", params
+
+
+def search_query(q, ids=None, after=None, limit=20, highlight=False):
+    """(prepared statement name, params) for one page of full-text search results"""
+    after_rank, after_id = after if after is not None else (None, None)
+    params = {"q": q, "ids": ids, "after_rank": after_rank, "after_id": after_id, "limit": limit}
+    return ("ns_search_headline" if highlight else "ns_search"), params
+
+
+def similar_query(study_id, k=10):
+    """(prepared statement name, params) for the k nearest studies on pgvector"""
+    return "ns_similar", {"study_id": study_id, "k": k}
+
+
+def batch_query(kind, directed, radius=0.0, threshold=0.0):
+    """(SQL, params) answering every directed pair in one statement"""
+    if kind == "terms":
+        return TERMS_BATCH_SQL, terms_batch_params(directed, threshold)
+    return COORDS_BATCH_SQL, coords_batch_params(directed, radius)
+
+
+# -----------------------
+# In-memory index paths
+# -----------------------
+def index_minus(kind, index, a, b, radius=0.0, threshold=0.0):
+    """A \\ B from a resident TermIndex / CoordIndex (sorted by study id)"""
+    if kind == "terms":
+        return index.dissociate(a, b, threshold)
+    return index.dissociate(parse_foci(a), parse_foci(b), radius)
+
+
+def index_batch(kind, index, directed, radius=0.0, threshold=0.0):
+    """Yield the study list of each directed pair from a resident index"""
+    if kind == "terms":
+        for term_a, term_b in directed:
+            yield index.dissociate(term_a, term_b, threshold)
+        return
+    # Each distinct foci set is searched once, however many pairs use it
+    hits = {}
+    for pair in directed:
+        for coords in pair:
+            if coords not in hits:
+                hits[coords] = index.studies(parse_foci(coords), radius)
+    for coords_a, coords_b in directed:
+        diff = np.setdiff1d(hits[coords_a], hits[coords_b], assume_unique=True)
+        yield index.study_ids[diff].tolist()
+
+
+# -----------------------
+# Result shaping
+# -----------------------
+def split_sides(rows):
+    """Turn ('A_minus_B' | 'B_minus_A', study_id) rows into the /both response"""
+    result = {"A_minus_B": [], "B_minus_A": []}
+    for side, study_id in rows:
+        result[side].append(study_id)
+    return result
+
+
+def group_by_pair(rows, n_pairs):
+    """Yield one study list per pair from (pair number, study_id) rows ordered by pair number (1-based)"""
+    pid, studies = 1, []
+    for row_pid, study_id in rows:
+        while row_pid > pid:
+            yield studies
+            pid, studies = pid + 1, []
+        studies.append(study_id)
+    while pid <= n_pairs:
+        yield studies
+        pid, studies = pid + 1, []
+
+
+def page_slice(studies, after=None, limit=None):
+    """Keyset page of an already sorted study list"""
+    start = bisect_right(studies, after) if after is not None else 0
+    return studies[start:start + limit if limit else None]
+
+
+def page_body(studies, after=None, limit=None):
+    """Plain list when unpaginated, else {"studies", "next"} where next is the cursor for the following page"""
+    if after is None and limit is None:
+        return studies
+    return {"studies": studies, "next": studies[-1] if limit and len(studies) == limit else None}
+
+
+def search_body(rows, limit, highlight=False):
+    """{"results": [...], "next"} for search rows; `next` is the ?after= cursor of the following page"""
+    results = []
+    for row in rows:
+        hit = {"study_id": row[0], "title": row[1], "journal": row[2],
+               "year": int(row[3]) if row[3] is not None else None, "rank": float(row[4])}
+        if highlight:
+            hit["headline"] = row[5]
+        results.append(hit)
+    last = results[-1] if len(results) == limit else None
+    return {"results": results, "next": f"{last['rank']!r},{last['study_id']}" if last else None}
+
+
+def similar_body(study_id, neighbours, source):
+    """The /studies/<id>/similar response from (study_id, score) pairs, best first"""
+    return {"study_id": study_id, "source": source,
+            "similar": [{"study_id": sid, "score": float(score)} for sid, score in neighbours]}
+
+
+def counts_body(n_a, n_b, n_ab, source):
+    """The /counts response; `source` says which path answered (index, cooccurrence, annotations)"""
+    n_a, n_b, n_ab = int(n_a), int(n_b), int(n_ab)
+    return {"A": n_a, "B": n_b, "A_and_B": n_ab, "A_minus_B": n_a - n_ab, "B_minus_A": n_b - n_ab, "source": source}
+
+
+def directed_pairs(items, both=False):
+    """Expand (a, b) pairs to the directed pairs to compute: (a, b)[, (b, a)] each"""
+    directed = []
+    for a, b in items:
+        directed.append((a, b))
+        if both:
+            directed.append((b, a))
+    return directed
+
+
+def pair_entries(items, both, results):
+    """Yield ("a/b", {"A_minus_B": [...][, "B_minus_A": [...]]}) from per-directed-pair results"""
+    results = iter(results)
+    for a, b in items:
+        entry = {"A_minus_B": next(results)}
+        if both:
+            entry["B_minus_A"] = next(results)
+        yield f"{a}/{b}", entry
+
+
+# -----------------------
+# Request arguments
+# -----------------------
+# Larger than any distance inside the MNI brain box; bounds the cells a
+# radius query visits in the resident CoordIndex
+MAX_RADIUS = 200.0
+
+
+def check_radius(r: float) -> float:
+    """r unchanged if it is a usable radius in mm; NaN, inf and radii past MAX_RADIUS raise ValueError."""
+    if not 0 <= r <= MAX_RADIUS:
+        raise ValueError(f"r must be a radius in mm between 0 and {MAX_RADIUS:g}")
+    return r
+
+
+def parse_radius(args):
+    """?r= (mm, default 0) from a query-string mapping"""
+    try:
+        r = float(args.get("r", 0.0))
+    except (TypeError, ValueError):
+        r = math.nan
+    return check_radius(r)
+
+
+def parse_threshold(args):
+    """?threshold= (minimum TF-IDF weight, default 0 = every mention)"""
+    try:
+        threshold = float(args.get("threshold", 0.0))
+    except (TypeError, ValueError):
+        threshold = None
+    if threshold is None or not threshold >= 0:
+        raise ValueError("threshold must be a non-negative weight")
+    return threshold
+
+
+def parse_order(args):
+    """?order=study_id (default, pageable) or ?order=weight (descending, top ?limit=)"""
+    order = args.get("order", "study_id")
+    if order not in ("study_id", "weight"):
+        raise ValueError("order must be 'study_id' or 'weight'")
+    return order
+
+
+def parse_kernel(args):
+    """(kernel, size) from ?kernel=sphere|gaussian&size= (sphere radius / Gaussian FWHM in mm, default 10)"""
+    kernel = args.get("kernel", "sphere")
+    if kernel not in KERNELS:
+        raise ValueError("kernel must be 'sphere' or 'gaussian'")
+    try:
+        size = float(args.get("size", 10.0))
+    except (TypeError, ValueError):
+        size = None
+    if size is None or not 0 < size <= 50:
+        raise ValueError("size must be a kernel size in mm, greater than 0 and at most 50")
+    return kernel, size
+
+
+def parse_map_format(args):
+    """?format=nifti (default, gzipped NIfTI-1) or ?format=raw (float32 volume)"""
+    fmt = args.get("format", "nifti")
+    if fmt not in FORMATS:
+        raise ValueError("format must be 'nifti' or 'raw'")
+    return fmt
+
+
+def parse_search(args, page_max=10000):
+    """(q, after, limit, highlight, within) from ?q=&after=&limit=&highlight=&terms=a/b|locations=a/b.
+
+    after is the (rank, study_id) keyset cursor returned as "next"; within is
+    None or ("terms" | "locations", a, b) to intersect with that dissociation.
+    """
+    q = (args.get("q") or "").strip()
+    if not q or len(q) > 500:
+        raise ValueError("q must be a non-empty search string of at most 500 characters")
+    after = None
+    if args.get("after"):
+        rank, _, study_id = args.get("after").partition(",")
+        try:
+            after = (float(rank), study_id)
+        except ValueError:
+            raise ValueError("after must be the 'next' cursor of a previous page")
+    limit = 20
+    if "limit" in args:
+        try:
+            limit = int(args.get("limit"))
+        except (TypeError, ValueError):
+            limit = None
+        if limit is None or not 1 <= limit <= page_max:
+            raise ValueError(f"limit must be an integer between 1 and {page_max}")
+    highlight = args.get("highlight", "0").strip().lower() in ("1", "true", "yes", "on")
+    within = None
+    for kind in ("terms", "locations"):
+        if args.get(kind):
+            if within is not None:
+                raise ValueError("Pass at most one of terms= and locations=")
+            a, sep, b = args.get(kind).partition("/")
+            if not (a and sep and b):
+                raise ValueError(f"{kind} must be '<a>/<b>' (studies in A but not B)")
+            if kind == "locations":
+                parse_foci(a), parse_foci(b)
+            within = (kind, a, b)
+    return q, after, limit, highlight, within
+
+
+def parse_k(args, k_max=100):
+    """?k= neighbours (default 10)"""
+    try:
+        k = int(args.get("k", 10))
+    except (TypeError, ValueError):
+        k = None
+    if k is None or not 1 <= k <= k_max:
+        raise ValueError(f"k must be an integer between 1 and {k_max}")
+    return k
+
+
+def parse_exact(args):
+    """?exact=1: exact COUNT(*) instead of the manifest/estimated row counts"""
+    return args.get("exact", "0").strip().lower() in ("1", "true", "yes", "on")
+
+
+def parse_page(args, page_max=10000):
+    """(after, limit) from ?after=&limit=; both None when unpaginated"""
+    after = args.get("after") or None
+    limit = None
+    if "limit" in args:
+        try:
+            limit = int(args.get("limit"))
+        except (TypeError, ValueError):
+            limit = None
+        if limit is None or not 1 <= limit <= page_max:
+            raise ValueError(f"limit must be an integer between 1 and {page_max}")
+    return after, limit
+
+
+def wants_ndjson(args, headers):
+    return args.get("format") == "ndjson" or "application/x-ndjson" in headers.get("Accept", "")
+
+
+def parse_batch(body, max_pairs=1000):
+    """Validate a batch body: {"terms": [[a, b], ...], "locations": [[a, b], ...], "both": bool, "r": mm, "threshold": w}"""
+    if not isinstance(body, dict):
+        raise ValueError("Expected a JSON object body")
+    pairs = {}
+    for kind in ("terms", "locations"):
+        items = body.get(kind) or []
+        if not isinstance(items, list) or not all(
+                isinstance(p, (list, tuple)) and len(p) == 2 and all(isinstance(v, str) and v for v in p)
+                for p in items):
+            raise ValueError(f"'{kind}' must be a list of [a, b] string pairs")
+        pairs[kind] = [tuple(p) for p in items]
+    for a, b in pairs["locations"]:
+        parse_foci(a), parse_foci(b)
+    if len(pairs["terms"]) + len(pairs["locations"]) > max_pairs:
+        raise ValueError(f"At most {max_pairs} pairs per batch")
+    r = body.get("r", 0.0)
+    check_radius(math.nan if isinstance(r, bool) or not isinstance(r, (int, float)) else r)
+    threshold = body.get("threshold", 0.0)
+    if isinstance(threshold, bool) or not isinstance(threshold, (int, float)) or not 0 <= threshold < math.inf:
+        raise ValueError("threshold must be a non-negative weight")
+    return pairs, bool(body.get("both", False)), float(r), float(threshold)
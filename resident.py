@@ -0,0 +1,64 @@
+"""
+Holder for a per-worker, in-memory index that is loaded from the database on
+first use, can be refreshed (swapped atomically), and reports None while it
+is unavailable so callers fall back to SQL.
+
+Callers pass the current data generation (ns.load_info); the index remembers
+the generation it was loaded at and is reloaded on the next get() after it
+moves, so results cached under a new generation never come from old data.
+"""
+
+import threading
+import time
+
+
+class Resident:
+    def __init__(self, loader, retry_after: float = 60.0):
+        # loader: engine -> index object
+        self.loader = loader
+        self.retry_after = retry_after
+        self.index = None
+        self.generation = None
+        self.error = None
+        self.failed_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, engine_factory, generation=None):
+        """Return the loaded index, (re)loading it on first use or when `generation` moved; None if unavailable."""
+        index = self.index
+        if index is not None and not self._stale(generation):
+            return index
+        if self.failed_at and time.time() - self.failed_at < self.retry_after:
+            return None
+        with self._lock:
+            if self.index is None or self._stale(generation):
+                try:
+                    self.index = self.loader(engine_factory())
+                    self.generation = generation
+                    self.error = None
+                    self.failed_at = 0.0
+                except Exception as e:
+                    # Drop a stale index rather than serve it under the new generation
+                    self.index = None
+                    self.error = str(e)
+                    self.failed_at = time.time()
+        return self.index
+
+    def refresh(self, engine_factory, generation=None):
+        """Rebuild the index from the database and swap it in atomically."""
+        new_index = self.loader(engine_factory())
+        with self._lock:
+            self.index = new_index
+            self.generation = generation
+            self.error = None
+            self.failed_at = 0.0
+        return new_index
+
+    def _stale(self, generation) -> bool:
+        # An unknown generation (DB unreachable) keeps the loaded index
+        return generation is not None and generation != self.generation
+
+    def status(self) -> dict:
+        if self.index is None:
+            return {"loaded": False, "error": self.error}
+        return {"loaded": True, "generation": self.generation, **self.index.stats()}
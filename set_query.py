@@ -0,0 +1,354 @@
+"""
+Boolean set algebra over studies for GET /query?q=...
+
+    (term:default_mode OR term:self_referential) AND NOT loc:0_-52_26~6
+
+Operands are `term:<term>` (suffix match on the canonical key, as on
+/dissociate/terms; `term:"two words"` for terms with spaces) and
+`loc:x_y_z[+x_y_z...][~r]` (studies with a focus within r mm of any point;
+r defaults to ?r=). Operators are AND, OR, NOT and parentheses, with the
+usual precedence NOT > AND > OR.
+
+An expression is parsed into a tuple AST, then normalized: nested AND/OR are
+flattened, duplicates dropped, double negations removed, NOT (a OR b) inside
+an AND becomes NOT a AND NOT b, and operands are sorted, so equivalent
+queries share one canonical form (and cache key). NOT is only meaningful
+against a positive operand of an AND; it is evaluated as an anti-join.
+
+The result is computed either
+- by compile_sql(): one statement, one CTE per distinct operand, AND as
+  EXISTS / NOT EXISTS semi- and anti-joins, OR as UNION. Each AND is driven
+  by its smallest operand as estimated from term_vocab.df (TERM_DF_SQL, only
+  with create_db.py --cooccurrence); location operands and terms without
+  those statistics have no estimate and rank after estimated ones, single
+  operands ahead of compounds, or
+- by evaluate(): sorted study arrays from the resident TermIndex / CoordIndex,
+  intersected smallest set first with an early exit once empty.
+"""
+
+import re
+
+import numpy as np
+
+from queries import check_radius, page_sql, parse_foci
+from term_index import KEY_UPPER, normalize_term, suffix_key
+
+MAX_LENGTH = 2000
+MAX_DEPTH = 32
+
+TOKEN = re.compile(r"""
+    \s*(?:
+        (?P<paren>[()])
+      | (?P<atom>(?P<kind>term|loc):(?:"(?P<quoted>[^"]*)"|(?P<bare>[^\s()"]+)))
+      | (?P<word>[A-Za-z]+)
+    )""", re.VERBOSE | re.IGNORECASE)
+OPERATORS = ("AND", "OR", "NOT")
+
+
+def tokenize(expression: str) -> list:
+    tokens, pos = [], 0
+    expression = expression.rstrip()
+    while pos < len(expression):
+        m = TOKEN.match(expression, pos)
+        if m is None:
+            raise ValueError(f"Unexpected input at position {pos}: {expression[pos:pos + 20]!r}")
+        if m.group("paren"):
+            tokens.append(m.group("paren"))
+        elif m.group("atom"):
+            value = m.group("quoted") if m.group("quoted") is not None else m.group("bare")
+            tokens.append((m.group("kind").lower(), value))
+        else:
+            word = m.group("word").upper()
+            if word not in OPERATORS:
+                raise ValueError(f"Unknown word {m.group('word')!r}; operands are term:<term> or loc:x_y_z[~r]")
+            tokens.append(word)
+        pos = m.end()
+    return tokens
+
+
+def parse_atom(kind: str, value: str, radius: float) -> tuple:
+    if kind == "term":
+        # Same key as /dissociate/terms (term_params), so both match the same terms
+        key = normalize_term(value)
+        if not key:
+            raise ValueError(f"Empty term in term:{value!r}")
+        return ("term", key)
+    coords, sep, r = value.partition("~")
+    if sep:
+        try:
+            radius = check_radius(float(r))
+        except ValueError as e:
+            raise ValueError(f"Invalid radius in loc:{value}; {e}")
+    return ("loc", tuple(parse_foci(coords)), float(radius))
+
+
+def parse_expression(expression: str, radius: float = 0.0, max_atoms: int = 32) -> tuple:
+    """Parse and normalize an expression into its AST; raises ValueError with a client-facing message."""
+    expression = (expression or "").strip()
+    if not expression or len(expression) > MAX_LENGTH:
+        raise ValueError(f"q must be a non-empty expression of at most {MAX_LENGTH} characters")
+    tokens = tokenize(expression)
+    pos = 0
+
+    def peek():
+        return tokens[pos] if pos < len(tokens) else None
+
+    def take():
+        nonlocal pos
+        pos += 1
+        return tokens[pos - 1]
+
+    def parse_or(depth):
+        children = [parse_and(depth)]
+        while peek() == "OR":
+            take()
+            children.append(parse_and(depth))
+        return children[0] if len(children) == 1 else ("or", tuple(children))
+
+    def parse_and(depth):
+        children = [parse_not(depth)]
+        while peek() == "AND":
+            take()
+            children.append(parse_not(depth))
+        return children[0] if len(children) == 1 else ("and", tuple(children))
+
+    def parse_not(depth):
+        if peek() == "NOT":
+            take()
+            return ("not", parse_not(depth))
+        return parse_primary(depth)
+
+    def parse_primary(depth):
+        token = peek()
+        if token == "(":
+            if depth >= MAX_DEPTH:
+                raise ValueError(f"Expression nested deeper than {MAX_DEPTH} levels")
+            take()
+            node = parse_or(depth + 1)
+            if peek() != ")":
+                raise ValueError("Missing ')'")
+            take()
+            return node
+        if isinstance(token, tuple):
+            take()
+            return parse_atom(token[0], token[1], radius)
+        raise ValueError("Expected an operand (term:..., loc:... or '(')" + (f", got {token!r}" if token else " at end"))
+
+    node = parse_or(0)
+    if peek() is not None:
+        raise ValueError(f"Unexpected {peek()!r}; combine operands with AND / OR")
+    node = optimize(node)
+    check_bounded(node)
+    if len(atoms(node)) > max_atoms:
+        raise ValueError(f"At most {max_atoms} distinct operands per query")
+    return node
+
+
+def optimize(node) -> tuple:
+    """Canonical form: flattened, deduplicated, sorted operands; NOT NOT x = x; NOT (a OR b) in AND = NOT a AND NOT b."""
+    kind = node[0]
+    if kind in ("term", "loc"):
+        return node
+    if kind == "not":
+        child = optimize(node[1])
+        return child[1] if child[0] == "not" else ("not", child)
+    children = []
+    for child in map(optimize, node[1]):
+        if child[0] == kind:
+            children.extend(child[1])
+        elif kind == "and" and child[0] == "not" and child[1][0] == "or":
+            # One anti-join per operand instead of one against their union
+            children.extend(optimize(("not", c)) for c in child[1][1])
+        else:
+            children.append(child)
+    children = sorted(set(children), key=lambda c: (c[0] == "not", canonical(c)))
+    return children[0] if len(children) == 1 else (kind, tuple(children))
+
+
+def check_bounded(node):
+    """Every NOT must be an operand of an AND that has a positive operand (no complements of the whole corpus)."""
+    message = "NOT must be combined with a positive operand, e.g. 'term:a AND NOT term:b'"
+    if node[0] == "not":
+        raise ValueError(message)
+    if node[0] in ("and", "or"):
+        children = node[1]
+        if node[0] == "or" and any(c[0] == "not" for c in children):
+            raise ValueError(message)
+        if node[0] == "and" and all(c[0] == "not" for c in children):
+            raise ValueError(message)
+        for child in children:
+            check_bounded(child[1] if child[0] == "not" else child)
+
+
+def canonical(node) -> str:
+    kind = node[0]
+    if kind == "term":
+        return f"term:{node[1]}"
+    if kind == "loc":
+        return "loc:" + "+".join("_".join(f"{v:g}" for v in p) for p in node[1]) + f"~{node[2]:g}"
+    if kind == "not":
+        return "NOT " + canonical(node[1])
+    return "(" + f" {kind.upper()} ".join(canonical(c) for c in node[1]) + ")"
+
+
+def atoms(node) -> list:
+    """Distinct operands, in first-use order."""
+    if node[0] in ("term", "loc"):
+        return [node]
+    children = [node[1]] if node[0] == "not" else node[1]
+    return list(dict.fromkeys(a for c in children for a in atoms(c)))
+
+
+def atom_kinds(node) -> set:
+    return {a[0] for a in atoms(node)}
+
+
+# -----------------------
+# SQL
+# -----------------------
+# Estimated studies per term operand: term_vocab.df summed over the keys it
+# suffix-matches (an upper bound; mentions below ?threshold= still count)
+TERM_DF_SQL = f"""
+    SELECT k.key_rev, COALESCE((SELECT sum(v.df) FROM term_vocab v
+                                WHERE v.term_key_rev >= k.key_rev COLLATE "C"
+                                  AND v.term_key_rev < (k.key_rev || '{KEY_UPPER}') COLLATE "C"), 0)
+    FROM unnest(CAST(:keys AS text[])) AS k(key_rev)
+"""
+
+
+def size_params(node) -> dict:
+    """TERM_DF_SQL parameters for the term operands of `node` (None when there is nothing to order)."""
+    keys = [suffix_key(a[1]) for a in atoms(node) if a[0] == "term"]
+    return {"keys": keys} if keys and node[0] in ("and", "or") else None
+
+
+def sizes_from_rows(rows) -> dict:
+    """{atom: estimated study count} from TERM_DF_SQL rows, for compile_sql(sizes=)."""
+    return {("term", key_rev[::-1]): int(df) for key_rev, df in rows}
+
+
+def compile_sql(node, threshold: float = 0.0, sizes: dict = None) -> tuple:
+    """
+    (SQL, params) for the study ids of `node`, keyset-paginated like page_sql()
+    (add :after and :limit). `sizes` ({atom: estimated studies}, e.g. from
+    sizes_from_rows()) picks the operand that drives each AND.
+    """
+    sizes = sizes or {}
+    ctes, params, names = [], {}, {}
+
+    def cte(atom):
+        if atom in names:
+            return names[atom]
+        i = len(names)
+        names[atom] = name = f"n{i}"
+        if atom[0] == "term":
+            key = suffix_key(atom[1])
+            params.update({f"k{i}": key, f"k{i}_upper": key + KEY_UPPER, "threshold": float(threshold)})
+            ctes.append(f"""{name} AS (
+        SELECT DISTINCT study_id FROM annotations_terms
+        WHERE term_key_rev >= :k{i} AND term_key_rev < :k{i}_upper AND weight >= :threshold
+    )""")
+        else:
+            foci = atom[1]
+            params.update({f"x{i}": [p[0] for p in foci], f"y{i}": [p[1] for p in foci],
+                           f"z{i}": [p[2] for p in foci], f"r{i}": atom[2]})
+            ctes.append(f"""p{i} AS (
+        SELECT ST_SetSRID(ST_MakePoint(u.x, u.y, u.z), s.srid) AS pt
+        FROM s, unnest(CAST(:x{i} AS float8[]), CAST(:y{i} AS float8[]), CAST(:z{i} AS float8[])) AS u(x, y, z)
+    ), {name} AS (
+        SELECT DISTINCT c.study_id FROM p{i}
+        JOIN coordinates c
+          ON c.geom &&& ST_Expand(p{i}.pt, :r{i}, :r{i}, :r{i}) AND ST_3DDWithin(c.geom, p{i}.pt, :r{i})
+    )""")
+        return name
+
+    aliases = iter(f"q{i}" for i in range(10 ** 6))
+
+    def estimate(node):
+        """Estimated studies of a positive node, None if unknown"""
+        if node[0] in ("term", "loc"):
+            return sizes.get(node)
+        if node[0] == "or":
+            known = [estimate(c) for c in node[1]]
+            return None if None in known else sum(known)
+        known = [e for e in (estimate(c) for c in node[1] if c[0] != "not") if e is not None]
+        return min(known) if known else None
+
+    def drive_order(node):
+        # Smallest estimate first; unknown after known, single operands ahead of compounds
+        e = estimate(node)
+        return e is None, e or 0, node[0] in ("and", "or")
+
+    def source(node):
+        return cte(node) if node[0] in ("term", "loc") else f"({select(node)})"
+
+    def select(node):
+        if node[0] in ("term", "loc"):
+            return f"SELECT study_id FROM {cte(node)}"
+        if node[0] == "or":
+            return " UNION ".join(f"SELECT study_id FROM {source(c)} {next(aliases)}" for c in node[1])
+        positive = sorted((c for c in node[1] if c[0] != "not"), key=drive_order)
+        negative = [c[1] for c in node[1] if c[0] == "not"]
+        a = next(aliases)
+        conditions = []
+        for other, exists in [(c, "EXISTS") for c in positive[1:]] + [(c, "NOT EXISTS") for c in negative]:
+            b = next(aliases)
+            conditions.append(f"{exists} (SELECT 1 FROM {source(other)} {b} WHERE {b}.study_id = {a}.study_id)")
+        return f"SELECT {a}.study_id FROM {source(positive[0])} {a}" + \
+            (" WHERE " + " AND ".join(conditions) if conditions else "")
+
+    body = select(node)
+    if any(a[0] == "loc" for a in names):
+        ctes.insert(0, "s AS (SELECT Find_SRID('ns', 'coordinates', 'geom') AS srid)")
+    return "WITH " + ", ".join(ctes) + page_sql(body), params
+
+
+# -----------------------
+# In-memory indexes
+# -----------------------
+def evaluate(node, terms=None, coords=None, threshold: float = 0.0) -> list:
+    """Sorted study ids of `node` from a TermIndex / CoordIndex (whichever its operands need)."""
+    kinds = atom_kinds(node)
+    # Integer codes when every operand shares one study dictionary (a single index, or a snapshot's pair)
+    shared = len(kinds) == 1 or (terms is not None and coords is not None and terms.study_ids is coords.study_ids)
+    dictionary = (terms if "term" in kinds else coords).study_ids
+    sets = {}
+
+    def atom_set(atom):
+        if atom not in sets:
+            if atom[0] == "term":
+                codes, ids = terms.studies(atom[1], threshold), terms.study_ids
+            else:
+                codes, ids = coords.studies(atom[1], atom[2]), coords.study_ids
+            sets[atom] = codes if shared else ids[codes].astype(str)
+        return sets[atom]
+
+    def size(node):
+        if node[0] in ("term", "loc"):
+            return len(atom_set(node))
+        if node[0] == "or":
+            return sum(size(c) for c in node[1])
+        return min(size(c) for c in node[1] if c[0] != "not")
+
+    def run(node):
+        if node[0] in ("term", "loc"):
+            return atom_set(node)
+        if node[0] == "or":
+            result = run(node[1][0])
+            for child in node[1][1:]:
+                result = np.union1d(result, run(child))
+            return result
+        positive = sorted((c for c in node[1] if c[0] != "not"), key=size)
+        result = run(positive[0])
+        for child in positive[1:]:
+            if not len(result):
+                return result
+            result = np.intersect1d(result, run(child), assume_unique=True)
+        for child in (c[1] for c in node[1] if c[0] == "not"):
+            if not len(result):
+                return result
+            result = np.setdiff1d(result, run(child), assume_unique=True)
+        return result
+
+    result = run(node)
+    return dictionary[result].tolist() if shared else result.tolist()
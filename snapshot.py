@@ -0,0 +1,188 @@
+"""
+Memory-mapped snapshot of the dissociation data, for zero-DB startup.
+
+create_db.py --snapshot DIR writes, next to the Postgres load, one directory
+per version holding plain .npy arrays:
+- study_ids.npy: sorted study ids (bytes); position = integer code, shared by
+  the term and coordinate arrays
+- terms.npy, term_indptr.npy, term_indices.npy, term_weights.npy: the CSR
+  term -> study matrix of term_index.TermIndex (reversed canonical keys)
+- coord_codes.npy, coord_xyz.npy (float32), coord_keys.npy: the foci sorted
+  by voxel-grid cell, as spatial_index.CoordIndex keeps them
+- manifest.json: format, data generation, cell size and grid of the coordinates
+
+DIR/CURRENT names the live version and is replaced atomically (os.replace)
+once a version is complete, so readers never see a partial snapshot.
+app.py maps the arrays read-only (np.load(mmap_mode="r")); every gunicorn
+worker shares the same page-cache pages, and only the small id and term
+dictionaries are decoded per worker.
+"""
+
+import json
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+from sqlalchemy import text
+
+from spatial_index import CoordIndex
+from term_index import TermIndex
+
+FORMAT = 1
+CURRENT = "CURRENT"
+
+# Versions kept besides the current one, for workers still mapping them
+KEEP_PREVIOUS = 1
+
+
+def write_snapshot(engine, schema: str, root: str, generation: str, cell: float = 8.0) -> str:
+    """Write a new snapshot version of the loaded schema under root and make it current; returns its path."""
+    terms = TermIndex.from_engine(engine, schema)
+    with engine.begin() as conn:
+        rows = conn.execute(text(f"SELECT study_id, ST_X(geom), ST_Y(geom), ST_Z(geom) FROM {schema}.coordinates")).all()
+    coord_sids = np.array([r[0] for r in rows], dtype=str)
+    xyz = np.array([r[1:4] for r in rows], dtype=np.float32).reshape(-1, 3)
+
+    # One study dictionary for both tables; codes are remapped into it (monotonically, so
+    # posting lists stay sorted)
+    study_ids = np.union1d(terms.study_ids.astype(str), coord_sids)
+    term_codes = np.searchsorted(study_ids, terms.study_ids.astype(str))
+    coords = CoordIndex(study_ids, np.searchsorted(study_ids, coord_sids).astype(np.int32), xyz, cell=cell)
+
+    version = f"{int(time.time())}-{generation}"
+    os.makedirs(root, exist_ok=True)
+    tmp = os.path.join(root, f".tmp-{version}")
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    arrays = {
+        "study_ids": np.char.encode(study_ids.astype(str), "utf-8"),
+        "terms": np.char.encode(np.array(terms.terms, dtype=str), "utf-8"),
+        "term_indptr": terms.indptr.astype(np.int64),
+        "term_indices": term_codes[terms.indices].astype(np.int32),
+        "term_weights": np.asarray(terms.weights, dtype=np.float64),
+        "coord_codes": coords.codes.astype(np.int32),
+        "coord_xyz": coords.xyz,
+        "coord_keys": coords.keys.astype(np.int64),
+    }
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp, f"{name}.npy"), np.ascontiguousarray(array))
+    manifest = {
+        "format": FORMAT,
+        "version": version,
+        "generation": generation,
+        "schema": schema,
+        "created_at": time.time(),
+        "studies": len(study_ids),
+        "terms": len(terms.terms),
+        "postings": int(len(terms.indices)),
+        "foci": len(xyz),
+        "cell_mm": coords.cell,
+        "origin": coords.origin.tolist(),
+        "dims": coords.dims.tolist(),
+    }
+    with open(os.path.join(tmp, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    path = os.path.join(root, version)
+    os.rename(tmp, path)
+    with open(os.path.join(root, CURRENT + ".tmp"), "w") as f:
+        f.write(version + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(os.path.join(root, CURRENT + ".tmp"), os.path.join(root, CURRENT))
+    prune_snapshots(root, version)
+    return path
+
+
+def prune_snapshots(root: str, current: str, keep: int = KEEP_PREVIOUS):
+    """Delete all but the current and the `keep` newest previous versions (mapped files stay readable)."""
+    versions = sorted(d for d in os.listdir(root)
+                      if d != current and not d.startswith(".") and os.path.isdir(os.path.join(root, d)))
+    for old in versions[:max(0, len(versions) - keep)]:
+        shutil.rmtree(os.path.join(root, old), ignore_errors=True)
+
+
+def current_version(root: str):
+    try:
+        with open(os.path.join(root, CURRENT)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+class Snapshot:
+    """A loaded snapshot version: a TermIndex and a CoordIndex over memory-mapped arrays."""
+
+    def __init__(self, path: str, cell: float = None):
+        with open(os.path.join(path, "manifest.json")) as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("format") != FORMAT:
+            raise RuntimeError(f"Unsupported snapshot format {self.manifest.get('format')!r} in {path}")
+        self.path = path
+        self.version = self.manifest["version"]
+        self.generation = self.manifest["generation"]
+
+        def load(name):
+            return np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+
+        study_ids = np.char.decode(load("study_ids"), "utf-8").astype(object)
+        terms = np.char.decode(load("terms"), "utf-8").tolist()
+        self.terms = TermIndex(study_ids, terms, load("term_indptr"), load("term_indices"), load("term_weights"))
+
+        codes, xyz = load("coord_codes"), load("coord_xyz")
+        snap_cell = float(self.manifest["cell_mm"])
+        if cell is None or float(cell) == snap_cell:
+            layout = (np.array(self.manifest["origin"], dtype=xyz.dtype),
+                      np.array(self.manifest["dims"], dtype=np.int64), load("coord_keys"))
+            self.coords = CoordIndex(study_ids, codes, xyz, cell=snap_cell, layout=layout)
+        else:
+            # A different SPATIAL_INDEX_CELL: re-bucket (copies the coordinates into this worker)
+            self.coords = CoordIndex(study_ids, np.asarray(codes), np.asarray(xyz), cell=cell)
+
+    def stats(self) -> dict:
+        return {"version": self.version, "generation": self.generation, "path": self.path,
+                "terms": self.terms.stats(), "coordinates": self.coords.stats()}
+
+
+class SnapshotStore:
+    """Follows root/CURRENT, re-checked at most every `ttl` seconds, and swaps in new versions atomically."""
+
+    def __init__(self, root: str, cell: float = None, ttl: float = 5.0):
+        self.root = root
+        self.cell = cell
+        self.ttl = ttl
+        self.snapshot = None
+        self.error = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        """The current Snapshot, or None if there is none (callers fall back to the database)."""
+        now = time.monotonic()
+        if now - self._checked_at < self.ttl:
+            return self.snapshot
+        with self._lock:
+            if now - self._checked_at >= self.ttl:
+                try:
+                    version = current_version(self.root)
+                    if version is not None and (self.snapshot is None or self.snapshot.version != version):
+                        self.snapshot = Snapshot(os.path.join(self.root, version), self.cell)
+                    self.error = None
+                except Exception as e:
+                    # Keep serving the last good version
+                    self.error = str(e)
+                self._checked_at = now
+        return self.snapshot
+
+    def current(self):
+        """Data generation of the current snapshot (GenerationWatcher interface, for cache keys and ETags)."""
+        snapshot = self.get()
+        return snapshot.generation if snapshot is not None else None
+
+    def status(self) -> dict:
+        snapshot = self.get()
+        if snapshot is None:
+            return {"loaded": False, "root": self.root, "error": self.error}
+        return {"loaded": True, "root": self.root, "error": self.error, **snapshot.stats()}
@@ -0,0 +1,148 @@
+"""
+In-process spatial index over ns.coordinates for the location endpoints.
+
+All foci are loaded once per worker into NumPy arrays and bucketed on a
+uniform voxel grid (cell size in mm). Points are stored sorted by cell key,
+so the foci of any cell are one contiguous slice found by binary search.
+
+A radius query visits the cells overlapping each query sphere's bounding
+box, gathers the candidate foci and applies the exact distance test; r = 0
+is exact coordinate equality, as on the SQL path. Several query points are
+answered in one vectorized pass.
+"""
+
+import time
+
+import numpy as np
+from sqlalchemy import text
+
+from resident import Resident
+
+
+class CoordIndex:
+    def __init__(self, study_ids: np.ndarray, codes: np.ndarray, xyz: np.ndarray, cell: float = 8.0,
+                 layout: tuple = None):
+        self.study_ids = study_ids
+        self.cell = float(cell)
+        self.loaded_at = time.time()
+
+        if layout is not None:
+            # (origin, dims, keys) of arrays already sorted by cell key, e.g. a memory-mapped snapshot;
+            # used as they are, without a per-worker copy
+            self.origin, self.dims, self.keys = layout
+            self.xyz, self.codes = xyz, codes
+            return
+        if len(xyz):
+            self.origin = xyz.min(axis=0)
+            self.dims = (np.floor((xyz.max(axis=0) - self.origin) / self.cell).astype(np.int64) + 1)
+        else:
+            self.origin = np.zeros(3)
+            self.dims = np.ones(3, dtype=np.int64)
+        keys = self._cell_keys(np.floor((xyz - self.origin) / self.cell).astype(np.int64))
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.xyz = np.ascontiguousarray(xyz[order])
+        self.codes = codes[order]
+
+    @classmethod
+    def from_engine(cls, engine, schema: str = "ns", cell: float = 8.0) -> "CoordIndex":
+        with engine.begin() as conn:
+            rows = conn.execute(text(f"""
+                SELECT study_id, ST_X(geom), ST_Y(geom), ST_Z(geom)
+                FROM {schema}.coordinates
+            """)).all()
+        return cls.from_rows(rows, cell=cell)
+
+    @classmethod
+    def from_rows(cls, rows, cell: float = 8.0) -> "CoordIndex":
+        """Build from (study_id, x, y, z) rows."""
+        sids = np.array([r[0] for r in rows], dtype=str)
+        xyz = np.array([r[1:4] for r in rows], dtype=np.float64).reshape(-1, 3)
+        study_ids, codes = np.unique(sids, return_inverse=True)
+        return cls(study_ids.astype(object), codes.astype(np.int32), xyz, cell=cell)
+
+    def _cell_keys(self, cells: np.ndarray) -> np.ndarray:
+        return (cells[:, 0] * self.dims[1] + cells[:, 1]) * self.dims[2] + cells[:, 2]
+
+    def __len__(self):
+        return len(self.xyz)
+
+    def stats(self) -> dict:
+        return {
+            "foci": len(self.xyz),
+            "studies": len(self.study_ids),
+            "cell_mm": self.cell,
+            "grid": self.dims.tolist(),
+            "loaded_at": self.loaded_at,
+        }
+
+    def studies(self, points, radius: float = 0.0) -> np.ndarray:
+        """Sorted study codes with a focus within `radius` mm of any of `points`."""
+        # Same precision as the stored foci, so r = 0 stays exact equality on float32 snapshots
+        pts = np.asarray(points, dtype=self.xyz.dtype).reshape(-1, 3)
+        r = float(radius)
+        lo = np.floor((pts - r - self.origin) / self.cell).astype(np.int64)
+        hi = np.floor((pts + r - self.origin) / self.cell).astype(np.int64)
+        lo = np.clip(lo, 0, self.dims - 1)
+        hi = np.clip(hi, 0, self.dims - 1)
+        span = hi - lo + 1
+        n_cells = span.prod(axis=1)
+
+        # Enumerate every (query point, cell) pair of each query's cell box
+        q = np.repeat(np.arange(len(pts)), n_cells)
+        local = np.arange(n_cells.sum()) - np.repeat(np.cumsum(n_cells) - n_cells, n_cells)
+        plane = span[q, 1] * span[q, 2]
+        cells = np.stack([
+            lo[q, 0] + local // plane,
+            lo[q, 1] + (local % plane) // span[q, 2],
+            lo[q, 2] + local % span[q, 2],
+        ], axis=1)
+        keys = self._cell_keys(cells)
+
+        # Expand the matching slices of the sorted point arrays into candidates
+        start = np.searchsorted(self.keys, keys, side="left")
+        counts = np.searchsorted(self.keys, keys, side="right") - start
+        cand_q = np.repeat(q, counts)
+        cand = np.repeat(start - (np.cumsum(counts) - counts), counts) + np.arange(counts.sum())
+
+        d2 = ((self.xyz[cand] - pts[cand_q]) ** 2).sum(axis=1)
+        return np.unique(self.codes[cand[d2 <= r * r]])
+
+    def foci(self, study_ids) -> tuple:
+        """(study codes, xyz) of every focus of the given studies."""
+        ids = np.array(sorted(set(map(str, study_ids))), dtype=object)
+        pos = np.searchsorted(self.study_ids, ids)
+        found = pos < len(self.study_ids)
+        found[found] = self.study_ids[pos[found]] == ids[found]
+        mask = np.isin(self.codes, pos[found])
+        return self.codes[mask].astype(np.int64), self.xyz[mask]
+
+    def dissociate(self, points_a, points_b, radius: float = 0.0) -> list:
+        """Return studies near any of points_a but near none of points_b."""
+        diff = np.setdiff1d(self.studies(points_a, radius), self.studies(points_b, radius), assume_unique=True)
+        return self.study_ids[diff].tolist()
+
+
+_resident = None
+
+
+def _get_resident(cell: float) -> Resident:
+    global _resident
+    if _resident is None:
+        _resident = Resident(lambda engine: CoordIndex.from_engine(engine, cell=cell))
+    return _resident
+
+
+def get_coord_index(engine_factory, cell: float = 8.0, generation=None):
+    """The loaded CoordIndex, (re)loaded on first use or once `generation` moves; None if unavailable."""
+    return _get_resident(cell).get(engine_factory, generation)
+
+
+def refresh_coord_index(engine_factory, cell: float = 8.0, generation=None) -> CoordIndex:
+    return _get_resident(cell).refresh(engine_factory, generation)
+
+
+def coord_index_status() -> dict:
+    if _resident is None:
+        return {"loaded": False, "error": None}
+    return _resident.status()
@@ -0,0 +1,67 @@
+"""
+Row counts of the ns tables without scanning them.
+
+create_db.py records exact counts in ns.load_info.counts when it loads; when
+that is missing (databases loaded by an older create_db.py) the planner's
+estimate pg_class.reltuples is used instead. Either costs one index/catalog
+lookup, cached for `ttl` seconds. Exact COUNT(*) only runs on request.
+"""
+
+import threading
+import time
+
+from sqlalchemy import text
+
+TABLES = ("coordinates", "metadata", "annotations_terms")
+
+
+def exact_counts(conn, schema: str = "ns") -> dict:
+    """COUNT(*) of every table (full scans)."""
+    return {t: conn.execute(text(f"SELECT COUNT(*) FROM {schema}.{t}")).scalar() for t in TABLES}
+
+
+class TableStats:
+    """Row counts from the latest load_info manifest, else pg_class.reltuples, re-read at most every `ttl` seconds."""
+
+    def __init__(self, engine_factory, ttl: float = 60.0, schema: str = "ns"):
+        self.engine_factory = engine_factory
+        self.ttl = ttl
+        self.schema = schema
+        self.stats = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self) -> dict:
+        now = time.monotonic()
+        if self.stats is not None and now - self._checked_at < self.ttl:
+            return self.stats
+        with self._lock:
+            if self.stats is None or now - self._checked_at >= self.ttl:
+                self.stats = self.read()
+                self._checked_at = now
+        return self.stats
+
+    def read(self) -> dict:
+        with self.engine_factory().connect() as conn:
+            manifest = None
+            if conn.execute(text("SELECT to_regclass(:t)"), {"t": f"{self.schema}.load_info"}).scalar() is not None:
+                # to_jsonb(l) so load_info tables without the counts column still read
+                manifest = conn.execute(text(f"""
+                    SELECT generation, loaded_at, to_jsonb(l) -> 'counts'
+                    FROM {self.schema}.load_info l
+                    ORDER BY loaded_at DESC LIMIT 1
+                """)).first()
+            if manifest is not None and manifest[2]:
+                return {"source": "manifest", "generation": manifest[0], "loaded_at": manifest[1].isoformat(),
+                        "counts": {t: manifest[2].get(t) for t in TABLES}, "read_at": time.time()}
+            rows = conn.execute(text("""
+                SELECT c.relname, c.reltuples::bigint
+                FROM pg_class c
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE n.nspname = :schema AND c.relname = ANY(:tables)
+            """), {"schema": self.schema, "tables": list(TABLES)}).all()
+        # reltuples is -1 (or 0) until the table is first vacuumed/analyzed
+        estimates = {name: (n if n >= 0 else None) for name, n in rows}
+        return {"source": "reltuples", "generation": manifest[0] if manifest else None,
+                "loaded_at": manifest[1].isoformat() if manifest else None,
+                "counts": {t: estimates.get(t) for t in TABLES}, "read_at": time.time()}
@@ -0,0 +1,154 @@
+"""
+In-process term -> study index for the dissociation endpoints.
+
+The whole of ns.annotations_terms is loaded once per worker into:
+- a study-id dictionary (sorted array of study ids; position = integer code)
+- a term dictionary (sorted array of reversed canonical term keys)
+- CSR posting lists: for key i, indices[indptr[i]:indptr[i+1]] are the sorted,
+  unique integer codes of the studies mentioning it, and weights[...] the
+  study's (max) TF-IDF weight for that key
+
+A term matches every key it is a suffix of (the same rule as the SQL path),
+which is a binary-searched range of the reversed keys. A \\ B is then a
+sorted-array set difference, with no database round trip. A threshold keeps
+only postings with weight >= threshold, as `?threshold=` does on the SQL path.
+"""
+
+import re
+import time
+from bisect import bisect_left
+from functools import lru_cache
+
+import numpy as np
+from sqlalchemy import text
+
+from resident import Resident
+
+
+def normalize_term(term: str) -> str:
+    """Canonical term key: lower-cased, runs of non-alphanumerics folded to '_'.
+
+    Must agree with the term_key generated column in create_db.py.
+    """
+    return re.sub(r"[^a-z0-9]+", "_", str(term).lower())
+
+
+def suffix_key(term: str) -> str:
+    """Reversed canonical key; a suffix match on the key is a prefix match on this."""
+    return normalize_term(term)[::-1]
+
+
+# Sorts after every character normalize_term() can produce, so that
+# [key, key || KEY_UPPER) is the range of strings starting with key.
+KEY_UPPER = "~"
+
+
+class TermIndex:
+    def __init__(self, study_ids: np.ndarray, terms: list, indptr: np.ndarray, indices: np.ndarray,
+                 weights: np.ndarray = None):
+        self.study_ids = study_ids
+        self.terms = terms
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights if weights is not None else np.ones(len(indices))
+        self.loaded_at = time.time()
+        self._match = lru_cache(maxsize=4096)(self._match_uncached)
+
+    @classmethod
+    def from_engine(cls, engine, schema: str = "ns") -> "TermIndex":
+        with engine.begin() as conn:
+            rows = conn.execute(text(f"""
+                SELECT term_key_rev, array_agg(study_id), array_agg(weight)
+                FROM (
+                    SELECT term_key_rev, study_id, max(weight) AS weight
+                    FROM {schema}.annotations_terms
+                    GROUP BY term_key_rev, study_id
+                ) p
+                GROUP BY term_key_rev
+            """)).all()
+        return cls.from_postings((r[0], r[1], r[2]) for r in rows)
+
+    @classmethod
+    def from_postings(cls, postings) -> "TermIndex":
+        """Build from (reversed term key, [study_id, ...][, [weight, ...]]) tuples; one entry per study and key."""
+        postings = sorted(postings, key=lambda p: p[0])
+        terms = [p[0] for p in postings]
+        lengths = np.array([len(p[1]) for p in postings], dtype=np.int64)
+        flat = np.array([sid for p in postings for sid in p[1]], dtype=object)
+        weights = np.array([w for p in postings for w in (p[2] if len(p) > 2 else [1.0] * len(p[1]))],
+                           dtype=np.float64)
+        study_ids, codes = np.unique(flat.astype(str), return_inverse=True)
+
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        # Sort codes inside each term's segment (term-major, then code)
+        owner = np.repeat(np.arange(len(terms)), lengths)
+        order = np.lexsort((codes, owner))
+        indices = codes[order].astype(np.int32)
+        return cls(study_ids.astype(object), terms, indptr, indices, weights[order])
+
+    def __len__(self):
+        return len(self.terms)
+
+    def stats(self) -> dict:
+        return {
+            "terms": len(self.terms),
+            "studies": len(self.study_ids),
+            "postings": int(len(self.indices)),
+            "loaded_at": self.loaded_at,
+        }
+
+    def _match_uncached(self, key_rev: str, threshold: float = 0.0):
+        """(sorted unique study codes, their max weight) over the matching keys' postings."""
+        lo = bisect_left(self.terms, key_rev)
+        hi = bisect_left(self.terms, key_rev + KEY_UPPER, lo)
+        codes = self.indices[self.indptr[lo]:self.indptr[hi]]
+        weights = self.weights[self.indptr[lo]:self.indptr[hi]]
+        if threshold > 0:
+            keep = weights >= threshold
+            codes, weights = codes[keep], weights[keep]
+        if hi - lo <= 1:
+            return codes, weights
+        # Several keys: max weight per study, via a (code, weight) sort
+        order = np.lexsort((weights, codes))
+        codes, weights = codes[order], weights[order]
+        last = np.r_[codes[1:] != codes[:-1], True] if len(codes) else np.empty(0, dtype=bool)
+        return codes[last], weights[last]
+
+    def studies(self, term: str, threshold: float = 0.0) -> np.ndarray:
+        """Sorted study codes of every term whose canonical key ends with term's key (weight >= threshold)."""
+        return self._match(suffix_key(term), float(threshold))[0]
+
+    def counts(self, term_a: str, term_b: str, threshold: float = 0.0) -> tuple:
+        """(|A|, |B|, |A ∩ B|) in studies."""
+        a, b = self.studies(term_a, threshold), self.studies(term_b, threshold)
+        return len(a), len(b), len(np.intersect1d(a, b, assume_unique=True))
+
+    def dissociate(self, term_a: str, term_b: str, threshold: float = 0.0) -> list:
+        """Return studies that contain term_a but not term_b (same matching as the SQL path)."""
+        diff = np.setdiff1d(self.studies(term_a, threshold), self.studies(term_b, threshold), assume_unique=True)
+        return self.study_ids[diff].tolist()
+
+    def ranked(self, term_a: str, term_b: str, threshold: float = 0.0, limit: int = None) -> list:
+        """A \\ B as [{"study_id", "weight"}] by descending weight for term_a (ties by study id), top `limit`."""
+        codes, weights = self._match(suffix_key(term_a), float(threshold))
+        keep = ~np.isin(codes, self.studies(term_b, threshold), assume_unique=True)
+        codes, weights = codes[keep], weights[keep]
+        order = np.lexsort((codes, -weights))[:limit]
+        return [{"study_id": sid, "weight": float(w)} for sid, w in zip(self.study_ids[codes[order]], weights[order])]
+
+
+_resident = Resident(TermIndex.from_engine)
+
+
+def get_term_index(engine_factory, generation=None):
+    """The loaded TermIndex, (re)loaded on first use or once `generation` moves; None if unavailable."""
+    return _resident.get(engine_factory, generation)
+
+
+def refresh_term_index(engine_factory, generation=None) -> TermIndex:
+    return _resident.refresh(engine_factory, generation)
+
+
+def term_index_status() -> dict:
+    return _resident.status()